@@ -0,0 +1,369 @@
+"""
+Latency / throughput benchmark for the booking, search, check-in and report paths.
+
+Seeds a throwaway database with the generators from ``seed.py`` (sizes are
+configurable), then drives the app through the Flask test client and reports
+p50/p95/p99 latency, SQL queries per request and requests per second for:
+
+    events_search     GET  /events with search / category / price filters
+    event_detail      GET  /event/<id>
+    booking           POST /booking/process (VNPay, one ticket)
+    vnpay_redirect    GET  /vnpay/redirect for the bookings above (gateway stubbed)
+    scan_ticket       POST /staff/scan-ticket
+    admin_dashboard   GET  /admin/dashboard
+    organizer_reports GET  /organizer/revenue-reports
+
+No external service is called: the VNPay callback is generated locally,
+Cloudinary uploads (ticket QR codes) and ticket e-mails are replaced by stubs.
+The benchmark database is a fresh temporary SQLite file unless ``--database-url``
+is given; that database is dropped and re-seeded.
+
+    python benchmarks/hot_paths.py --users 2000 --events 500 --tickets 20000
+    python benchmarks/hot_paths.py --save-baseline benchmarks/baseline.json
+    python benchmarks/hot_paths.py --baseline benchmarks/baseline.json --tolerance 0.25
+
+With ``--baseline`` the script exits 1 when a scenario's p95 latency or mean
+query count grew by more than the tolerance.
+"""
+import argparse
+import contextlib
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+SCENARIOS = ('events_search', 'event_detail', 'booking', 'vnpay_redirect', 'scan_ticket',
+             'admin_dashboard', 'organizer_reports')
+
+
+def _configure_environment(database_url):
+    # Must happen before eventapp is imported: the app reads its config at import time
+    os.environ['DATABASE_URL'] = database_url
+    os.environ['MEDIA_UPLOAD_WORKER'] = '0'
+    os.environ['MEDIA_STORAGE'] = 'local'
+    os.environ.setdefault('VNPAY_TMN_CODE', 'BENCH000')
+    os.environ.setdefault('VNPAY_HASH_SECRET', 'benchmark-secret')
+    sys.path.insert(0, ROOT)
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+
+def stub_upload(data, public_id=None, folder=None, **kwargs):
+    """Cloudinary upload stand-in: nothing leaves the machine, the public id is kept"""
+    return {'public_id': f'{folder}/{public_id}' if folder else public_id}
+
+
+def stub_destroy(public_id, **kwargs):
+    return {'result': 'ok'}
+
+
+def seed(args):
+    """Fill the database with seed.py generators; returns ids used by the scenarios"""
+    import seed as seeder
+    from faker import Faker
+    from eventapp import db
+    from eventapp.models import Event, Ticket, TicketType, User, UserRole
+
+    random.seed(args.seed)
+    Faker.seed(args.seed)
+    # Hashing thousands of passwords would dominate seeding; nobody logs in with them
+    password_hash = seeder.generate_password_hash('password123', method='pbkdf2:sha256:1')
+    started = time.perf_counter()
+    with mock.patch.object(seeder, 'generate_password_hash', lambda password: password_hash):
+        db.drop_all()
+        db.create_all()
+        users = seeder.create_users(max(args.users, 20))
+        events = seeder.create_events(users, args.events)
+        ticket_types = seeder.create_ticket_types(events)
+        discount_codes = seeder.create_discount_codes(15)
+        seeder.create_tickets_and_payments(users, ticket_types, discount_codes, args.tickets)
+        seeder.create_reviews(users, events, args.reviews)
+        seeder.create_notifications_and_user_notifications(users, events, args.notifications)
+        seeder.create_event_trending_logs(events)
+    seconds = time.perf_counter() - started
+
+    organizer_id = (db.session.query(Event.organizer_id).group_by(Event.organizer_id)
+                    .order_by(db.func.count(Event.id).desc()).limit(1).scalar())
+    bookable = (TicketType.query.join(Event)
+                .filter(Event.is_active == True, TicketType.is_active == True,
+                        TicketType.total_quantity - TicketType.sold_quantity > args.requests)
+                .all())
+    data = {
+        'seed_seconds': round(seconds, 1),
+        'admin_id': User.query.filter_by(role=UserRole.admin).first().id,
+        'organizer_id': organizer_id,
+        'staff_id': User.query.filter_by(role=UserRole.staff).first().id,
+        'customer_ids': [u.id for u in User.query.filter_by(role=UserRole.customer, is_active=True).limit(50)],
+        'event_ids': [e.id for e in Event.query.filter_by(is_active=True)],
+        'search_terms': sorted({e.title.split()[0] for e in events if e.title}),
+        'bookable': [(t.event_id, t.id, float(t.price)) for t in bookable],
+        'unscanned': [t.uuid for t in Ticket.query.filter_by(is_paid=True, is_checked_in=False)
+                      .limit(args.requests)],
+    }
+    db.session.remove()
+    return data
+
+
+def login(app, client, user_id):
+    from flask_login.utils import _create_identifier
+    with app.test_request_context(environ_base=client.environ_base):
+        identifier = _create_identifier()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(user_id)
+        sess['_id'] = identifier
+        sess['_fresh'] = True
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    # Nearest-rank percentile
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def measure(client, counter, requests, is_error):
+    """Run ``requests`` (method, url, kwargs) in order; returns stats and the responses"""
+    timings, queries, errors, responses = [], [], 0, []
+    started = time.perf_counter()
+    for method, url, kwargs in requests:
+        counter.count = 0
+        t0 = time.perf_counter()
+        response = client.open(url, method=method, **kwargs)
+        response.get_data()
+        timings.append((time.perf_counter() - t0) * 1000)
+        queries.append(counter.count)
+        errors += is_error(response)
+        responses.append(response)
+    elapsed = time.perf_counter() - started
+    stats = {
+        'requests': len(timings),
+        'errors': errors,
+        'p50_ms': round(percentile(timings, 50), 2),
+        'p95_ms': round(percentile(timings, 95), 2),
+        'p99_ms': round(percentile(timings, 99), 2),
+        'mean_ms': round(sum(timings) / len(timings), 2) if timings else 0.0,
+        'rps': round(len(timings) / elapsed, 1) if elapsed else 0.0,
+        'queries_mean': round(sum(queries) / len(queries), 1) if queries else 0.0,
+        'queries_max': max(queries, default=0),
+    }
+    return stats, responses
+
+
+def _http_error(response):
+    return response.status_code >= 400
+
+
+def _json_error(response):
+    return response.status_code >= 400 or not (response.get_json(silent=True) or {}).get('success')
+
+
+def build_requests(name, data, count, state):
+    rng = random.Random(name)
+    if name == 'events_search':
+        from eventapp.models import EventCategory
+        requests = []
+        for i in range(count):
+            params = {'search': rng.choice(data['search_terms'])} if i % 2 == 0 else {}
+            if i % 3 == 0:
+                params['category'] = rng.choice(list(EventCategory)).value
+            if i % 4 == 0:
+                params.update(price_min=50000, price_max=1000000)
+            if i % 5 == 0:
+                params['page'] = 2
+            requests.append(('GET', '/events', {'query_string': params}))
+        return requests
+    if name == 'event_detail':
+        return [('GET', f"/event/{rng.choice(data['event_ids'])}", {}) for _ in range(count)]
+    if name == 'booking':
+        requests = []
+        for _ in range(count):
+            event_id, ticket_type_id, price = rng.choice(data['bookable'])
+            requests.append(('POST', '/booking/process', {'json': {
+                'event_id': event_id, 'payment_method': 'vnpay', 'total_amount': price,
+                'subtotal': price, 'discount_amount': 0,
+                'tickets': [{'ticket_type_id': ticket_type_id, 'quantity': 1}],
+            }}))
+        return requests
+    if name == 'vnpay_redirect':
+        return [('GET', '/vnpay/redirect', {'query_string': {'vnp_ResponseCode': '00', 'vnp_TxnRef': ref}})
+                for ref in state.get('txn_refs', [])]
+    if name == 'scan_ticket':
+        return [('POST', '/staff/scan-ticket', {'json': {'qr_data': ticket_uuid}})
+                for ticket_uuid in data['unscanned'][:count]]
+    if name == 'admin_dashboard':
+        return [('GET', '/admin/dashboard', {})] * count
+    if name == 'organizer_reports':
+        return [('GET', '/organizer/revenue-reports', {})] * count
+    raise ValueError(name)
+
+
+# Who is logged in for each scenario (None = anonymous; the VNPay callback carries no session)
+ROLES = {
+    'events_search': None, 'event_detail': None, 'booking': 'customer', 'vnpay_redirect': None,
+    'scan_ticket': 'staff', 'admin_dashboard': 'admin', 'organizer_reports': 'organizer',
+}
+JSON_SCENARIOS = {'booking', 'scan_ticket'}
+# Each request consumes data (a ticket, a pending payment), so they are not warmed up
+WRITE_SCENARIOS = {'booking', 'vnpay_redirect', 'scan_ticket'}
+
+
+def run(args):
+    from eventapp import create_app, db, logging_config, media
+
+    app = create_app()
+    # One customer places every benchmark booking: anti-bot limits would turn most of them into 429s
+    app.config['RATE_LIMITS'] = {**app.config['RATE_LIMITS'], 'booking': {}}
+    app.config['MAX_TICKETS_PER_USER_PER_EVENT'] = 10 ** 9
+    with app.app_context():
+        data = seed(args)
+        engine = db.engine
+    counter = QueryCounter()
+    db.event.listen(engine, 'before_cursor_execute', counter)
+
+    clients = {}
+    user_ids = {'customer': data['customer_ids'][0], 'staff': data['staff_id'],
+                'admin': data['admin_id'], 'organizer': data['organizer_id']}
+    for role, user_id in user_ids.items():
+        clients[role] = app.test_client()
+        login(app, clients[role], user_id)
+    clients[None] = app.test_client()
+
+    results, state = {}, {}
+    selected = [name for name in SCENARIOS if not args.only or name in args.only]
+    if 'vnpay_redirect' in selected and 'booking' not in selected:
+        selected.insert(selected.index('vnpay_redirect'), 'booking')
+    cloudinary = media.cloudinary_sdk()
+    if not cloudinary.config().cloud_name:
+        # URL building only needs a cloud name
+        cloudinary.config(cloud_name='benchmark')
+    stubs = [
+        mock.patch.object(cloudinary.uploader, 'upload', stub_upload),
+        mock.patch.object(cloudinary.uploader, 'destroy', stub_destroy),
+        mock.patch('eventapp.utils.send_ticket_email', lambda *a, **kw: None),
+    ]
+    with contextlib.ExitStack() as stack:
+        for stub in stubs:
+            stack.enter_context(stub)
+        # The app logs every request and booking; keep the report readable
+        devnull = stack.enter_context(open(os.devnull, 'w'))
+        stack.enter_context(contextlib.redirect_stdout(devnull))
+        stack.enter_context(contextlib.redirect_stderr(devnull))
+        # Request logs are written by a background thread: drain it before stdout is restored
+        stack.callback(logging_config.pipeline.stop)
+        for name in selected:
+            requests = build_requests(name, data, args.requests, state)
+            if not requests:
+                continue
+            client = clients[ROLES[name]]
+            if name not in WRITE_SCENARIOS:
+                for method, url, kwargs in requests[:args.warmup]:
+                    client.open(url, method=method, **kwargs)
+            is_error = _json_error if name in JSON_SCENARIOS else _http_error
+            results[name], responses = measure(client, counter, requests, is_error)
+            if name == 'booking':
+                # The VNPay scenario replays these bookings; timing rejected ones would measure nothing
+                failed = [r for r in responses if _json_error(r)]
+                if failed:
+                    raise RuntimeError(f'{len(failed)} of {len(responses)} benchmark bookings failed, first: '
+                                       f'{failed[0].status_code} {failed[0].get_data(as_text=True)[:200]}')
+                state['txn_refs'] = [
+                    parse_qs(urlparse(r.get_json()['payment_url']).query)['vnp_TxnRef'][0]
+                    for r in responses if (r.get_json(silent=True) or {}).get('payment_url')
+                ]
+    db.event.remove(engine, 'before_cursor_execute', counter)
+    return {'dataset': {key: getattr(args, key) for key in ('users', 'events', 'tickets', 'reviews',
+                                                             'notifications', 'seed')},
+            'seed_seconds': data['seed_seconds'], 'requests_per_scenario': args.requests,
+            'scenarios': results}
+
+
+def compare(current, baseline, tolerance):
+    """Rows of (scenario, metric, baseline, current, change, regressed)"""
+    rows = []
+    for name, stats in current['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if not base:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'queries_mean', 'rps'):
+            old, new = base.get(metric), stats.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            # Lower is better everywhere except throughput
+            worse = -change if metric == 'rps' else change
+            regressed = metric in ('p95_ms', 'queries_mean') and worse > tolerance
+            rows.append((name, metric, old, new, change, regressed))
+    return rows
+
+
+def print_report(report):
+    print(f"dataset {report['dataset']}  seeded in {report['seed_seconds']} s")
+    print(f"{'scenario':<18} {'n':>5} {'err':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'rps':>8} {'queries':>8} {'max q':>6}")
+    for name, s in report['scenarios'].items():
+        print(f"{name:<18} {s['requests']:>5} {s['errors']:>4} {s['p50_ms']:>9.2f} {s['p95_ms']:>9.2f} "
+              f"{s['p99_ms']:>9.2f} {s['rps']:>8.1f} {s['queries_mean']:>8.1f} {s['queries_max']:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--events', type=int, default=100)
+    parser.add_argument('--tickets', type=int, default=2000)
+    parser.add_argument('--reviews', type=int, default=300)
+    parser.add_argument('--notifications', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=42, help='random seed for the generated dataset')
+    parser.add_argument('-n', '--requests', type=int, default=100, help='requests per scenario')
+    parser.add_argument('--warmup', type=int, default=5, help='unmeasured requests for read-only scenarios')
+    parser.add_argument('--only', nargs='+', choices=SCENARIOS)
+    parser.add_argument('--database-url', help='defaults to a temporary SQLite file')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    parser.add_argument('--save-baseline', metavar='PATH')
+    parser.add_argument('--baseline', metavar='PATH')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed relative growth of p95 latency and queries per request')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='eventapp-bench-')
+    _configure_environment(args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    try:
+        report = run(args)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'baseline saved to {args.save_baseline}', file=sys.stderr)
+    if args.baseline:
+        with open(args.baseline) as f:
+            rows = compare(report, json.load(f), args.tolerance)
+        print(f"\n{'scenario':<18} {'metric':<13} {'baseline':>10} {'current':>10} {'change':>8}")
+        for name, metric, old, new, change, regressed in rows:
+            print(f"{name:<18} {metric:<13} {old:>10} {new:>10} {change:>+8.1%}{'  REGRESSION' if regressed else ''}")
+        if any(row[-1] for row in rows):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,122 @@
+"""
+Startup benchmark: import time, create_app() time and first-request latency.
+
+Each run happens in a fresh interpreter so nothing is cached between runs:
+
+    python benchmarks/startup.py                 # 5 runs, GET /
+    python benchmarks/startup.py -n 10 --path /events --top 15
+    python benchmarks/startup.py --json > startup.json
+
+``--top N`` also lists the N slowest modules (cumulative, from
+``python -X importtime``) so regressions in the import graph are easy to spot.
+``--max-import-ms`` makes the script exit 1 when the median import time is
+above the budget, for use in CI.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def child(path):
+    """Run inside the fresh interpreter; prints one JSON line of timings"""
+    sys.path.insert(0, ROOT)
+    started = time.perf_counter()
+    import eventapp
+    imported = time.perf_counter()
+    app = eventapp.create_app()
+    created = time.perf_counter()
+    client = app.test_client()
+    first_status = client.get(path).status_code
+    first = time.perf_counter()
+    client.get(path)
+    second = time.perf_counter()
+    print(json.dumps({
+        'import_ms': (imported - started) * 1000,
+        'create_app_ms': (created - imported) * 1000,
+        'first_request_ms': (first - created) * 1000,
+        'second_request_ms': (second - first) * 1000,
+        'status': first_status,
+    }))
+
+
+def _env():
+    # No background upload thread in the measured process
+    return dict(os.environ, MEDIA_UPLOAD_WORKER='0')
+
+
+def run_once(path):
+    output = subprocess.run([sys.executable, __file__, '--child', '--path', path], cwd=ROOT, env=_env(),
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def slowest_imports(limit):
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import eventapp; eventapp.create_app()'],
+                            cwd=ROOT, env=_env(), capture_output=True, text=True, check=True).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        # Direct imports only, otherwise parents and children are counted twice
+        if depth > 1 or name.strip() == 'eventapp':
+            continue
+        rows.append((int(cumulative) / 1000, name.strip()))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-n', '--runs', type=int, default=5)
+    parser.add_argument('--path', default='/')
+    parser.add_argument('--top', type=int, default=0, help='list the N slowest direct imports')
+    parser.add_argument('--json', action='store_true')
+    parser.add_argument('--max-import-ms', type=float)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.path)
+        return 0
+
+    runs = [run_once(args.path) for _ in range(args.runs)]
+    metrics = ('import_ms', 'create_app_ms', 'first_request_ms', 'second_request_ms')
+    summary = {
+        name: {
+            'median': round(statistics.median(run[name] for run in runs), 1),
+            'min': round(min(run[name] for run in runs), 1),
+            'max': round(max(run[name] for run in runs), 1),
+        }
+        for name in metrics
+    }
+    summary['status'] = runs[0]['status']
+    summary['runs'] = args.runs
+    if args.top:
+        summary['slowest_imports'] = [{'module': name, 'ms': round(ms, 1)} for ms, name in slowest_imports(args.top)]
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print(f"{args.runs} runs, GET {args.path} -> {summary['status']}")
+        for name in metrics:
+            print(f"  {name:<18} median {summary[name]['median']:8.1f}  "
+                  f"min {summary[name]['min']:8.1f}  max {summary[name]['max']:8.1f}")
+        for row in summary.get('slowest_imports', []):
+            print(f"  {row['ms']:8.1f} ms  {row['module']}")
+
+    if args.max_import_ms is not None and summary['import_ms']['median'] > args.max_import_ms:
+        print(f"import time {summary['import_ms']['median']} ms is over budget {args.max_import_ms} ms",
+              file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
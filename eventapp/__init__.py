@@ -2,7 +2,6 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_login import LoginManager, current_user
-import cloudinary
 import os
 from dotenv import load_dotenv
 
@@ -14,8 +13,36 @@ app = Flask(__name__)
 # Cấu hình database từ environment variables
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///eventapp.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Pool kết nối theo môi trường (pool_size, pre-ping, recycle, statement timeout, PgBouncer): xem db_config.py
+from eventapp import db_config, db_routing
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = db_config.engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+# Read replica (phân tách bằng dấu phẩy); sau khi ghi, user đọc từ primary trong DB_REPLICA_STICKY_SECONDS giây
+app.config['DATABASE_REPLICA_URLS'] = os.getenv('DATABASE_REPLICA_URLS', '')
+app.config['DB_REPLICA_STICKY_SECONDS'] = int(os.getenv('DB_REPLICA_STICKY_SECONDS', 5))
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 's1f7@N0pb6$Yz!Fq3Zx#Mle*2d@9Kq')
 
+# Upload poster/avatar chạy nền: file được lưu tạm rồi worker đẩy lên storage (cloudinary hoặc local)
+app.config['MEDIA_STORAGE'] = os.getenv('MEDIA_STORAGE', 'cloudinary' if os.getenv('CLOUDINARY_CLOUD_NAME') else 'local')
+app.config['MEDIA_ROOT'] = os.getenv('MEDIA_ROOT', os.path.join(app.instance_path, 'media'))
+app.config['MEDIA_STAGING_DIR'] = os.getenv('MEDIA_STAGING_DIR', os.path.join(app.instance_path, 'media_staging'))
+# Poster resize thành nhiều kích thước/định dạng (WebP, AVIF, JPEG) lưu local, tên theo hash nội dung
+app.config['MEDIA_VARIANTS_DIR'] = os.getenv('MEDIA_VARIANTS_DIR', os.path.join(app.instance_path, 'media_variants'))
+app.config['MEDIA_UPLOAD_WORKER'] = os.getenv('MEDIA_UPLOAD_WORKER', '1') == '1'
+app.config['MEDIA_UPLOAD_MAX_ATTEMPTS'] = int(os.getenv('MEDIA_UPLOAD_MAX_ATTEMPTS', 5))
+app.config['MEDIA_DELETE_GRACE_SECONDS'] = int(os.getenv('MEDIA_DELETE_GRACE_SECONDS', 600))
+# Dọn ảnh cũ đã bị thay thế và job upload đã xong (mỗi worker), không chạy ở mỗi vòng poll hàng đợi
+app.config['MEDIA_PURGE_INTERVAL_SECONDS'] = int(os.getenv('MEDIA_PURGE_INTERVAL_SECONDS', 300))
+
+# Trang CRUD Flask-Admin (/admin) chỉ được đăng ký trong create_app() vì import rất chậm
+app.config['ADMIN_ENABLED'] = os.getenv('ADMIN_ENABLED', '1') == '1'
+
+# Cache user đăng nhập theo process (snapshot chỉ đọc), tự xoá khi user bị sửa/xoá; 0 = tắt cache
+app.config['USER_CACHE_TTL_SECONDS'] = int(os.getenv('USER_CACHE_TTL_SECONDS', 30))
+app.config['USER_CACHE_MAX_SIZE'] = int(os.getenv('USER_CACHE_MAX_SIZE', 10000))
+
+# Token bảo vệ /metrics (Prometheus gửi "Authorization: Bearer <token>"); để trống = không yêu cầu
+app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN', '')
+
 # Cấu hình session chi tiết hơn
 app.config['SESSION_COOKIE_NAME'] = 'eventapp_session'
 app.config['SESSION_COOKIE_HTTPONLY'] = True
@@ -25,29 +52,35 @@ app.config['SESSION_COOKIE_DOMAIN'] = None  # Cho phép subdomain
 app.config['SESSION_COOKIE_PATH'] = '/'
 app.config['PERMANENT_SESSION_LIFETIME'] = 86400  # 24 giờ thay vì 30 phút
 
+# Số proxy phía trước app (Render: 1) được tin X-Forwarded-For/-Proto; 0 = dùng địa chỉ kết nối trực tiếp.
+# Cần để giới hạn tần suất theo IP thấy IP thật của khách thay vì IP của proxy
+app.config['PROXY_FIX_HOPS'] = int(os.getenv('PROXY_FIX_HOPS', 0))
+if app.config['PROXY_FIX_HOPS']:
+    from werkzeug.middleware.proxy_fix import ProxyFix
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_HOPS'], x_proto=app.config['PROXY_FIX_HOPS'])
+
+# Log có cấu trúc (JSON) ghi qua hàng đợi bởi thread nền, không chặn request
+from eventapp import logging_config
+app.config['LOG_LEVEL'] = os.getenv('LOG_LEVEL', 'INFO').upper()
+app.config['LOG_LEVELS'] = logging_config.parse_mapping(os.getenv('LOG_LEVELS'), str.upper)
+app.config['LOG_SAMPLE_RATES'] = logging_config.parse_mapping(os.getenv('LOG_SAMPLE_RATES'), float)
+app.config['LOG_FORMAT'] = os.getenv('LOG_FORMAT', 'json')
+logging_config.init_app(app)
+
 # Khởi tạo ORM và Migrate
-db = SQLAlchemy(app)
+db = SQLAlchemy(app, session_options={'class_': db_routing.RoutingSession})
 migrate = Migrate(app, db)
+with app.app_context():
+    db_config.pool_metrics.attach(db.engine)
+db_routing.init_app(app, db_config.engine_options)
 
-# Flask-Admin
-from flask_admin import Admin
-from flask_admin.contrib.sqla import ModelView
-from eventapp.models import User, Event, Ticket, TicketType, DiscountCode, Payment, EventTrendingLog, Review, Notification, UserNotification, Translation
-from flask_admin.base import MenuLink
-
-admin = Admin(app, name='EventHub Admin', template_mode='bootstrap4')
-admin.add_view(ModelView(User, db.session))
-admin.add_view(ModelView(Event, db.session))
-admin.add_view(ModelView(Ticket, db.session))
-admin.add_view(ModelView(TicketType, db.session))
-admin.add_view(ModelView(DiscountCode, db.session))
-admin.add_view(ModelView(Payment, db.session))
-admin.add_view(ModelView(EventTrendingLog, db.session))
-admin.add_view(ModelView(Review, db.session))
-admin.add_view(ModelView(Notification, db.session))
-admin.add_view(ModelView(UserNotification, db.session))
-admin.add_view(ModelView(Translation, db.session))
-admin.add_link(MenuLink(name='Quay lại Admin Dashboard', url='/admin/dashboard'))
+# Đếm số truy vấn / thời gian DB theo request (Server-Timing khi debug, log khi vượt ngưỡng)
+from eventapp import query_stats
+app.config['QUERY_STATS_HEADERS'] = os.getenv('QUERY_STATS_HEADERS') == '1'
+app.config['SLOW_REQUEST_QUERIES'] = int(os.getenv('SLOW_REQUEST_QUERIES', 30))
+app.config['SLOW_REQUEST_DB_MS'] = int(os.getenv('SLOW_REQUEST_DB_MS', 500))
+app.config['SLOW_QUERY_MS'] = int(os.getenv('SLOW_QUERY_MS', 200))
+query_stats.init_app(app)
 
 # Khởi tạo Flask-Login
 login_manager = LoginManager()
@@ -59,11 +92,69 @@ login_manager.session_protection = 'strong'
 login_manager.refresh_view = 'auth.login'
 login_manager.needs_refresh_message = 'Vui lòng đăng nhập lại để tiếp tục.'
 
+from eventapp import user_cache
+user_cache.init_app(app)
+
+# Job định kỳ cập nhật users.customer_group (hết hạn nhóm 'new' sau 7 ngày): flask refresh-customer-groups
+from eventapp import customer_groups
+customer_groups.init_app(app)
+
+# Danh mục mã giảm giá giữ trong bộ nhớ theo nhóm khách hàng, làm mới khi có thay đổi hoặc sau TTL
+from eventapp import discount_index
+app.config['DISCOUNT_INDEX_TTL_SECONDS'] = int(os.getenv('DISCOUNT_INDEX_TTL_SECONDS', 60))
+discount_index.init_app(app)
+
+# Bảng giá vé theo sự kiện (cache) cho báo giá /booking/quote; worker sửa giá tự làm mới, worker khác sau TTL.
+# Số tiền thu khi đặt vé luôn đọc giá từ CSDL
+from eventapp import pricing
+app.config['PRICE_TABLE_TTL_SECONDS'] = int(os.getenv('PRICE_TABLE_TTL_SECONDS', 30))
+pricing.init_app(app)
+
+# Đếm vé bán trên nhiều dòng shard cho loại vé bán rất chạy: flask inventory shard/rebalance/merge/merge-closed
+from eventapp import inventory
+inventory.init_app(app)
+
+# Phòng chờ ảo khi mở bán: chỉ cho rate_per_minute khách/phút vào trang đặt vé (flask waiting-room open/close)
+from eventapp import waiting_room
+app.config['WAITING_ROOM_SECRET'] = os.getenv('WAITING_ROOM_SECRET', app.config['SECRET_KEY'])
+app.config['WAITING_ROOM_ADMISSION_SECONDS'] = int(os.getenv('WAITING_ROOM_ADMISSION_SECONDS', 600))
+app.config['WAITING_ROOM_POLL_SECONDS'] = int(os.getenv('WAITING_ROOM_POLL_SECONDS', 5))
+app.config['WAITING_ROOM_CACHE_SECONDS'] = int(os.getenv('WAITING_ROOM_CACHE_SECONDS', 5))
+waiting_room.init_app(app)
+
+# Idempotency-Key cho /booking/process và callback VNPay: yêu cầu lặp lại nhận response đã lưu (flask idempotency purge)
+from eventapp import idempotency
+app.config['IDEMPOTENCY_TTL_SECONDS'] = int(os.getenv('IDEMPOTENCY_TTL_SECONDS', 86400))
+app.config['IDEMPOTENCY_LOCK_SECONDS'] = int(os.getenv('IDEMPOTENCY_LOCK_SECONDS', 120))
+idempotency.init_app(app)
+
+# Chống bot: giới hạn số vé mỗi tài khoản cho một sự kiện (đã mua + đang giữ) và tần suất gửi /booking/process
+from eventapp import rate_limit
+app.config['MAX_TICKETS_PER_USER_PER_EVENT'] = int(os.getenv('MAX_TICKETS_PER_USER_PER_EVENT', 10))
+app.config['RATE_LIMIT_BACKEND'] = os.getenv('RATE_LIMIT_BACKEND', 'memory')  # memory | database
+app.config['RATE_LIMITS'] = {
+    'booking': logging_config.parse_mapping(os.getenv('RATE_LIMIT_BOOKING', 'user=10/60,ip=30/60'),
+                                            rate_limit.parse_rule),
+}
+rate_limit.init_app(app)
+
+# Danh sách chờ loại vé đã hết: mời khách theo thứ tự khi có vé (tăng số lượng, dọn vé giữ chỗ hết hạn),
+# lời mời hết hạn sau WAITLIST_OFFER_MINUTES phút (cron `flask waitlist allocate` trong render.yaml thu hồi mỗi phút)
+from eventapp import waitlist
+app.config['WAITLIST_OFFER_MINUTES'] = int(os.getenv('WAITLIST_OFFER_MINUTES', 15))
+waitlist.init_app(app)
+
+# Manifest vé cho máy quét offline được ký Ed25519: thiết bị chỉ giữ public key, không giữ bí mật nào của server.
+# Tạo khóa: flask gate-manifest keygen; để trống = tắt tải manifest (503)
+from eventapp import manifest
+app.config['GATE_MANIFEST_SIGNING_KEY'] = os.getenv('GATE_MANIFEST_SIGNING_KEY', '')
+manifest.init_app(app)
+
 @login_manager.user_loader
 def load_user(user_id):
-    from eventapp.models import User
+    # Trả về UserSnapshot từ cache để phần lớn request không phải truy vấn bảng users
     try:
-        return User.query.get(int(user_id))
+        return user_cache.cache.load(int(user_id))
     except:
         return None
 
@@ -72,6 +163,20 @@ def load_user(user_id):
 def inject_user():
     return dict(current_user=current_user)
 
+# Helper dựng URL ảnh (có cache) dùng chung cho mọi template: image_url(public_id, preset)
+from eventapp import media, variants
+app.add_template_global(media.image_url, 'image_url')
+app.add_template_global(variants.poster_sources, 'poster_sources')
+app.add_template_global(variants.jpeg_srcset, 'jpeg_srcset')
+app.add_template_global(variants.variant_url, 'variant_url')
+
+# Worker upload ảnh được khởi động lười ở request đầu tiên của mỗi process (sau khi gunicorn fork)
+from eventapp import uploads
+
+@app.before_request
+def start_media_upload_worker():
+    uploads.worker.ensure_started()
+
 # Middleware để debug session
 # @app.before_request
 # def log_session_info():
@@ -83,16 +188,23 @@ def inject_user():
 #         if '_user_id' in session:
 #             print(f"[SESSION DEBUG] User ID in session: {session['_user_id']}")
 
-# Cấu hình Cloudinary từ environment variables
-cloudinary.config(
-    cloud_name=os.getenv('CLOUDINARY_CLOUD_NAME'),
-    api_key=os.getenv('CLOUDINARY_API_KEY'),
-    api_secret=os.getenv('CLOUDINARY_API_SECRET')
-)
+# Cloudinary được import và cấu hình (CLOUDINARY_*) ở lần dùng đầu tiên: xem media.cloudinary_sdk()
 
 # Import routes sau khi khởi tạo app
 from eventapp import routes
 
 # Import và đăng ký auth blueprint
 from eventapp.auth import auth_bp
-app.register_blueprint(auth_bp, url_prefix='/auth')
\ No newline at end of file
+app.register_blueprint(auth_bp, url_prefix='/auth')
+
+# Giữ tham chiếu tới Flask app: sau khi import eventapp.app, tên `app` của package trỏ tới module đó
+_app = app
+
+
+def create_app():
+    """Điểm khởi động cho gunicorn / server chạy thật: đăng ký thêm các phần tuỳ chọn (Flask-Admin).
+    Import `eventapp` trực tiếp (test, script) không phải trả chi phí này."""
+    if _app.config['ADMIN_ENABLED']:
+        from eventapp import admin_site
+        admin_site.init_app(_app)
+    return _app
@@ -0,0 +1,31 @@
+"""
+Flask-Admin CRUD views under ``/admin``.
+
+Flask-Admin (with WTForms, Pillow and pkg_resources behind its SQLAlchemy
+contrib package) is the slowest part of importing the app, and only the
+admin CRUD pages need it. ``create_app()`` registers it when ``ADMIN_ENABLED``
+is on; tests and scripts that import ``eventapp`` directly skip it.
+"""
+from flask_admin import Admin
+from flask_admin.base import MenuLink
+from flask_admin.contrib.sqla import ModelView
+
+from eventapp import db
+from eventapp.models import (
+    User, Event, Ticket, TicketType, DiscountCode, Payment, EventTrendingLog, Review, Notification,
+    UserNotification, Translation
+)
+
+MODELS = (User, Event, Ticket, TicketType, DiscountCode, Payment, EventTrendingLog, Review, Notification,
+          UserNotification, Translation)
+
+
+def init_app(app):
+    """Register the admin views once; returns the ``Admin`` instance"""
+    if 'admin' in app.blueprints:
+        return app.extensions['admin'][0]
+    admin = Admin(app, name='EventHub Admin', template_mode='bootstrap4')
+    for model in MODELS:
+        admin.add_view(ModelView(model, db.session))
+    admin.add_link(MenuLink(name='Quay lại Admin Dashboard', url='/admin/dashboard'))
+    return admin
@@ -1,4 +1,4 @@
-from eventapp import app, db
+from eventapp import app, create_app, db
 
 if __name__ == '__main__':
     with app.app_context():
@@ -6,5 +6,5 @@ if __name__ == '__main__':
         db.create_all()
         print("Tạo bảng cơ sở dữ liệu thành công!")
     
-    # Chạy ứng dụng
-    app.run(debug=True)
\ No newline at end of file
+    # Chạy ứng dụng (create_app đăng ký thêm trang Flask-Admin)
+    create_app().run(debug=True)
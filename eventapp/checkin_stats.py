@@ -0,0 +1,145 @@
+"""
+Live per-event check-in counters for the organizer gate dashboard.
+
+Each worker keeps a DB baseline per event (checked-in count per ticket type
+and arrivals per minute over a sliding window) plus the check-ins it recorded
+itself since the last reconciliation. The baseline is refreshed from the
+database at most every ``reconcile_interval`` seconds, so check-ins handled by
+other gunicorn workers show up within that interval and dashboard refreshes
+never trigger a full COUNT over ``tickets``. Recorded check-ins older than
+``reconcile_interval`` are dropped on the next ``record``: any snapshot that
+could still need them reconciles first, so a worker that scans tickets but
+never serves the dashboard does not accumulate them.
+"""
+import os
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, case
+
+
+def _minute(value):
+    return value.replace(second=0, microsecond=0)
+
+
+class CheckinCounters:
+    def __init__(self, reconcile_interval=30, window_minutes=60):
+        self.reconcile_interval = reconcile_interval
+        self.window_minutes = window_minutes
+        self._lock = threading.Lock()
+        self._events = {}
+
+    def _state(self, event_id):
+        state = self._events.get(event_id)
+        if state is None:
+            state = self._events[event_id] = {
+                'reconciled_at': 0.0,
+                'reconciled_on': None,
+                'paid': Counter(),
+                'checked_in': Counter(),
+                'minutes': Counter(),
+                'pending': deque(),
+            }
+        return state
+
+    def record(self, event_id, ticket_type_id, when=None, count=1):
+        """Register committed check-ins; call after the transaction commits"""
+        when = when or datetime.utcnow()
+        now = time.time()
+        with self._lock:
+            pending = self._state(event_id)['pending']
+            # A baseline older than reconcile_interval is reloaded before use, which covers these entries
+            while pending and pending[0][0] <= now - self.reconcile_interval:
+                pending.popleft()
+            pending.append((now, ticket_type_id, _minute(when), count))
+
+    def reset(self, event_id=None):
+        with self._lock:
+            if event_id is None:
+                self._events.clear()
+            else:
+                self._events.pop(event_id, None)
+
+    def reconcile(self, event_id):
+        """Reload the baseline for one event from the database"""
+        from eventapp import db
+        from eventapp.models import Ticket
+
+        started = time.time()
+        now = datetime.utcnow()
+        window_start = _minute(now) - timedelta(minutes=self.window_minutes - 1)
+
+        per_type = db.session.query(
+            Ticket.ticket_type_id,
+            func.count(Ticket.id),
+            func.sum(case((Ticket.is_checked_in == True, 1), else_=0))
+        ).filter(
+            Ticket.event_id == event_id,
+            Ticket.is_paid == True
+        ).group_by(Ticket.ticket_type_id).all()
+
+        recent = db.session.query(Ticket.check_in_date).filter(
+            Ticket.event_id == event_id,
+            Ticket.check_in_date >= window_start
+        ).all()
+
+        paid = Counter({tt_id: int(total) for tt_id, total, _ in per_type})
+        checked_in = Counter({tt_id: int(checked or 0) for tt_id, _, checked in per_type})
+        minutes = Counter(_minute(row[0]) for row in recent)
+
+        with self._lock:
+            state = self._state(event_id)
+            state.update(
+                reconciled_at=started,
+                reconciled_on=now,
+                paid=paid,
+                checked_in=checked_in,
+                minutes=minutes,
+                # check-ins recorded before the query started are already in the baseline
+                pending=deque(p for p in state['pending'] if p[0] > started),
+            )
+
+    def snapshot(self, event_id):
+        """Current counters for an event, reconciling first if the baseline is stale"""
+        with self._lock:
+            stale = time.time() - self._state(event_id)['reconciled_at'] >= self.reconcile_interval
+        if stale:
+            self.reconcile(event_id)
+
+        now = _minute(datetime.utcnow())
+        window_start = now - timedelta(minutes=self.window_minutes - 1)
+        with self._lock:
+            state = self._state(event_id)
+            checked_in = Counter(state['checked_in'])
+            minutes = Counter(state['minutes'])
+            for _, ticket_type_id, minute, count in state['pending']:
+                checked_in[ticket_type_id] += count
+                minutes[minute] += count
+            paid = Counter(state['paid'])
+            reconciled_on = state['reconciled_on']
+
+        arrivals = []
+        minute = window_start
+        while minute <= now:
+            arrivals.append({'minute': minute.isoformat(), 'count': minutes.get(minute, 0)})
+            minute += timedelta(minutes=1)
+
+        return {
+            'event_id': event_id,
+            'checked_in': sum(checked_in.values()),
+            'paid_tickets': sum(paid.values()),
+            'by_ticket_type': {
+                tt_id: {'checked_in': checked_in.get(tt_id, 0), 'paid': paid.get(tt_id, 0)}
+                for tt_id in set(paid) | set(checked_in)
+            },
+            'arrivals_per_minute': arrivals,
+            'last_reconciled': reconciled_on.isoformat() if reconciled_on else None,
+        }
+
+
+counters = CheckinCounters(
+    reconcile_interval=int(os.getenv('GATE_STATS_RECONCILE_SECONDS', 30)),
+    window_minutes=int(os.getenv('GATE_STATS_WINDOW_MINUTES', 60))
+)
@@ -0,0 +1,89 @@
+"""
+Atomic counter updates.
+
+Counters (``users.total_spent``, ``ticket_types.sold_quantity``,
+``discount_codes.used_count``) used to be changed in Python
+(``obj.counter += 1``): two concurrent payments read the same value and one
+update is lost, and every ticket issued its own UPDATE. Every increment now
+goes through this module and runs as a single SQL expression:
+
+    UPDATE ticket_types SET sold_quantity = COALESCE(sold_quantity, 0) + CASE id WHEN 3 THEN 2 WHEN 4 THEN 1 END
+    WHERE id IN (3, 4)
+
+The statements run in the caller's transaction. Copies of the rows already
+loaded in the session get the counter expired, so the next read sees the
+database value.
+"""
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import case, func, update
+from sqlalchemy.orm.util import identity_key
+
+from eventapp import customer_groups, db, user_cache
+from eventapp.models import DiscountCode, TicketType, User
+
+
+def _expire(model, keys, *attributes):
+    for key in keys:
+        obj = db.session.identity_map.get(identity_key(model, key))
+        if obj is not None:
+            db.session.expire(obj, list(attributes))
+
+
+def increment(column, amounts, where=(), values=None):
+    """Add ``amounts[key]`` to ``column`` of each row ``key`` in one UPDATE.
+
+    ``column`` is a model attribute (``TicketType.sold_quantity``); ``where``
+    adds conditions (the increment is skipped for rows failing them) and
+    ``values`` extra SET clauses. Returns the number of rows updated."""
+    amounts = {key: amount for key, amount in amounts.items() if amount}
+    if not amounts:
+        return 0
+    model = column.class_
+    if len(amounts) == 1:
+        (key, amount), = amounts.items()
+        delta, condition = amount, model.id == key
+    else:
+        delta, condition = case(amounts, value=model.id), model.id.in_(amounts)
+    result = db.session.execute(
+        update(model)
+        .where(condition, *where)
+        .values({column.key: func.coalesce(column, 0) + delta, **(values or {})})
+        .execution_options(synchronize_session=False)
+    )
+    _expire(model, amounts, column.key, *(values or {}))
+    return result.rowcount
+
+
+def add_sold(tickets):
+    """Count ``tickets`` as sold, one UPDATE for all their ticket types.
+
+    Sharded ticket types (``shard_count`` > 0) are counted on their shard
+    rows instead; raises inventory.InventoryError when those are full."""
+    from eventapp import inventory
+    amounts = Counter(t.ticket_type_id for t in tickets if t.ticket_type_id)
+    sharded = {tt_id for tt_id, in db.session.query(TicketType.id).filter(
+        TicketType.id.in_(amounts), TicketType.shard_count > 0)} if amounts else set()
+    for tt_id in sharded:
+        inventory.take(tt_id, amounts.pop(tt_id))
+    return increment(TicketType.sold_quantity, amounts) + len(sharded)
+
+
+def add_spent(user_id, amount, now=None):
+    """Add a payment to the user's total_spent and move them to the matching customer group"""
+    if not user_id or not amount:
+        return 0
+    spent = func.coalesce(User.total_spent, 0) + amount
+    updated = increment(User.total_spent, {user_id: amount},
+                        values={'customer_group': customer_groups.group_expression(now or datetime.utcnow(), spent)})
+    user_cache.invalidate_after_commit(db.session, user_id)
+    return updated
+
+
+def redeem_discount(code_id):
+    """One use of a discount code, only while it is active and under max_uses (NULL = unlimited)"""
+    return increment(DiscountCode.used_count, {code_id: 1}, where=(
+        DiscountCode.is_active == True,
+        (DiscountCode.max_uses.is_(None)) | (DiscountCode.used_count < DiscountCode.max_uses),
+    )) == 1
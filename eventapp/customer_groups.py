@@ -0,0 +1,58 @@
+"""
+Batch refresh of the stored ``users.customer_group`` column.
+
+Payments update the group of the paying user right away, in the same SQL
+UPDATE that adds to ``total_spent`` (``counters.add_spent`` with
+``group_expression``); what changes without any write is the 7-day "new"
+period running out. ``refresh()`` re-evaluates every user with a
+single UPDATE ... SET customer_group = CASE ... that only touches rows whose
+group actually changes. Run it periodically (e.g. hourly from cron):
+
+    flask --app eventapp refresh-customer-groups
+
+The CASE expression mirrors ``models.customer_group_for``.
+"""
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import case, func, literal, or_, update
+
+from eventapp import db, user_cache
+from eventapp.models import CUSTOMER_GROUP_THRESHOLDS, NEW_CUSTOMER_DAYS, CustomerGroup, User
+
+
+def _group(value):
+    return literal(value, User.customer_group.type)
+
+
+def group_expression(now, spent=None):
+    """SQL CASE computing the customer group of each users row at ``now``;
+    ``spent`` replaces the total_spent column (e.g. total_spent + amount)"""
+    spent = func.coalesce(User.total_spent, 0) if spent is None else spent
+    whens = [(or_(User.created_at.is_(None), User.created_at >= now - timedelta(days=NEW_CUSTOMER_DAYS)),
+              _group(CustomerGroup.new))]
+    whens += [(spent < limit, _group(group)) for limit, group in CUSTOMER_GROUP_THRESHOLDS]
+    return case(*whens, else_=_group(CustomerGroup.super_vip))
+
+
+def refresh(now=None):
+    """Recompute the customer group of all users; returns the number of rows changed"""
+    expression = group_expression(now or datetime.utcnow())
+    result = db.session.execute(
+        update(User)
+        .where(or_(User.customer_group.is_(None), User.customer_group != expression))
+        .values(customer_group=expression)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    if result.rowcount:
+        # Bulk UPDATE bypasses the session events that invalidate cached users
+        user_cache.cache.clear()
+    return result.rowcount
+
+
+def init_app(app):
+    @app.cli.command('refresh-customer-groups')
+    def refresh_customer_groups_command():
+        """Recompute users.customer_group (7-day new-customer expiry)."""
+        click.echo(f'{refresh()} users moved to a new customer group')
@@ -1,20 +1,24 @@
-from sqlalchemy import or_
+from sqlalchemy import case, or_, func, insert, literal, select, union_all
 from sqlalchemy.orm import joinedload
 from eventapp.models import (
     User, UserRole, Event, TicketType, Review, EventCategory, 
     EventTrendingLog, DiscountCode, Ticket, Payment, 
-    UserNotification, CustomerGroup, PaymentMethod, Notification
+    UserNotification, CustomerGroup, PaymentMethod, Notification, event_staff, load_shard_sold
 )
 from flask import render_template_string
-from eventapp import db
-from datetime import datetime, timedelta
+from eventapp import db, checkin_stats, counters, discount_index, inventory, metrics, waitlist
+from eventapp.db_routing import read_only
+from datetime import datetime, timedelta, timezone
 from wtforms.validators import ValidationError
 import uuid
 import os
 import hmac
 import hashlib
+import logging
 from flask import request
-import pytz
+
+logger = logging.getLogger('eventapp.dao')
+payment_logger = logging.getLogger('eventapp.payment')
 
 # User related functions
 def check_user(username):
@@ -25,6 +29,10 @@ def check_email(email):
     """Kiểm tra người dùng theo email"""
     return User.query.filter(User.email == email).first()
 
+def get_user_by_id(user_id):
+    """Lấy model User theo id (current_user chỉ là snapshot chỉ đọc)"""
+    return db.session.get(User, user_id)
+
 def get_user_by_username(username):
     """Lấy ID người dùng theo username"""
     user = User.query.filter(User.username == username).first()
@@ -34,6 +42,46 @@ def get_user_tickets(user_id):
     """Lấy vé của người dùng"""
     return Ticket.query.filter_by(user_id=user_id).all()
 
+def get_paid_tickets(user_id, limit=None):
+    """Lấy vé đã thanh toán của người dùng, mới nhất trước (nạp sẵn sự kiện và loại vé)"""
+    query = Ticket.query.options(
+        joinedload(Ticket.event),
+        joinedload(Ticket.ticket_type)
+    ).filter_by(user_id=user_id, is_paid=True).order_by(Ticket.purchase_date.desc())
+    if limit:
+        query = query.limit(limit)
+    return query.all()
+
+def get_ticket_wallet(user_id, page=1, per_page=10, now=None):
+    """Ví vé của người dùng: vé đã thanh toán nhóm theo sự kiện, phân trang theo sự kiện
+    (một sự kiện không bị tách qua hai trang).
+
+    Sự kiện chưa kết thúc đứng trước, sự kiện sắp diễn ra gần nhất trước hết; sau đó là
+    sự kiện đã qua, mới nhất trước. Một truy vấn cho trang sự kiện và một truy vấn nạp vé
+    (kèm loại vé) của các sự kiện đó, không phụ thuộc số vé. Trả về (pagination, groups)
+    với groups là danh sách (event, [tickets]).
+    """
+    now = now or datetime.utcnow()
+    is_past = case((Event.end_time < now, 1), else_=0)
+    owned_events = select(Ticket.event_id).where(Ticket.user_id == user_id, Ticket.is_paid == True)
+    pagination = Event.query.filter(Event.id.in_(owned_events)).order_by(
+        is_past,
+        case((Event.end_time >= now, Event.start_time)).asc(),  # sắp diễn ra: gần nhất trước
+        Event.start_time.desc(),                                 # đã qua: mới nhất trước
+        Event.id
+    ).paginate(page=page, per_page=per_page, error_out=False)
+
+    tickets_by_event = {event.id: [] for event in pagination.items}
+    if tickets_by_event:
+        tickets = Ticket.query.options(joinedload(Ticket.ticket_type)).filter(
+            Ticket.user_id == user_id,
+            Ticket.is_paid == True,
+            Ticket.event_id.in_(list(tickets_by_event))
+        ).order_by(Ticket.purchase_date.desc(), Ticket.id)
+        for ticket in tickets:
+            tickets_by_event[ticket.event_id].append(ticket)
+    return pagination, [(event, tickets_by_event[event.id]) for event in pagination.items]
+
 def get_user_events(user_id, page=1, per_page=10):
     """Lấy sự kiện của organizer với phân trang"""
     return Event.query.filter_by(organizer_id=user_id).order_by(Event.start_time.desc()).paginate(
@@ -44,18 +92,22 @@ def get_user_payments(user_id):
     """Lấy thanh toán của người dùng"""
     return Payment.query.filter_by(user_id=user_id).all()
 
+@read_only()
 def get_user_notifications(user_id):
     """Lấy toàn bộ thông báo của người dùng (không phân trang, dùng cho trang profile hoặc debug)"""
     return UserNotification.query.filter_by(user_id=user_id).order_by(UserNotification.created_at.desc()).all()
 
+@read_only()
 def get_user_notifications_paginated(user_id, offset=0, limit=5):
     """Lấy thông báo của người dùng, phân trang (dùng cho dropdown/infinite scroll)"""
     return UserNotification.query.filter_by(user_id=user_id).order_by(UserNotification.created_at.desc()).offset(offset).limit(limit).all()
 
+@read_only()
 def count_unread_notifications(user_id):
     """Đếm số lượng thông báo chưa đọc của user (dùng cho badge)"""
     return UserNotification.query.filter_by(user_id=user_id, is_read=False).count()
 
+@read_only()
 def get_unread_notifications(user_id, limit=5):
     """Lấy các thông báo chưa đọc mới nhất (dùng cho dropdown nếu muốn ưu tiên unread)"""
     return UserNotification.query.filter_by(user_id=user_id, is_read=False).order_by(UserNotification.created_at.desc()).limit(limit).all()
@@ -64,15 +116,17 @@ def get_user_customer_group(user):
     """Lấy nhóm khách hàng của người dùng"""
     try:
         return user.get_customer_group()
-    except Exception as e:
-        print(f"Error getting user group: {e}")
+    except Exception:
+        logger.exception('loading customer group failed', extra={'user_id': getattr(user, 'id', None)})
         return CustomerGroup.new
 
 # Event related functions
+@read_only()
 def get_featured_events(limit=3):
     """Lấy các sự kiện nổi bật"""
     return Event.query.filter_by(is_active=True).limit(limit).all()
 
+@read_only()
 def get_event_detail(event_id):
     """Lấy chi tiết sự kiện"""
     return db.session.query(Event).options(
@@ -86,6 +140,7 @@ def get_active_ticket_types(event_id):
         is_active=True
     ).all()
 
+@read_only()
 def get_event_reviews(event_id, limit=5):
     """Lấy reviews của sự kiện"""
     return db.session.query(Review).options(
@@ -95,16 +150,18 @@ def get_event_reviews(event_id, limit=5):
         parent_review_id=None
     ).order_by(Review.created_at.desc()).limit(limit).all()
 
+@read_only()
 def get_all_event_reviews(event_id):
     """Lấy tất cả reviews của sự kiện để tính rating"""
     return Review.query.filter_by(event_id=event_id, parent_review_id=None).all()
 
 def calculate_event_stats(active_ticket_types, all_reviews):
     """Tính toán thống kê sự kiện"""
+    load_shard_sold(active_ticket_types)
     total_tickets = sum(tt.total_quantity for tt in active_ticket_types) if active_ticket_types else 0
-    sold_tickets = sum(tt.sold_quantity for tt in active_ticket_types) if active_ticket_types else 0
+    sold_tickets = sum(tt.sold_total for tt in active_ticket_types) if active_ticket_types else 0
     available_tickets = total_tickets - sold_tickets
-    revenue = sum(tt.price * tt.sold_quantity for tt in active_ticket_types) if active_ticket_types else 0
+    revenue = sum(tt.price * tt.sold_total for tt in active_ticket_types) if active_ticket_types else 0
     average_rating = sum(r.rating for r in all_reviews) / len(all_reviews) if all_reviews else 0
     
     return {
@@ -116,6 +173,7 @@ def calculate_event_stats(active_ticket_types, all_reviews):
         'review_count': len(all_reviews)
     }
 
+@read_only()
 def get_all_events_revenue_stats():
     """Lấy thống kê doanh thu cho tất cả sự kiện"""
     events = db.session.query(Event).options(
@@ -138,13 +196,14 @@ def get_all_events_revenue_stats():
                 'name': tt.name,
                 'price': float(tt.price),
                 'total_quantity': tt.total_quantity,
-                'sold_quantity': tt.sold_quantity
+                'sold_quantity': tt.sold_total
             } for tt in active_ticket_types]
         })
         total_revenue += stat['revenue']
     
     return stats, total_revenue
 
+@read_only()
 def search_events(page=1, per_page=12, category='', search='', start_date='', end_date='', location='', min_price=None, max_price=None):
     """Tìm kiếm và lọc sự kiện"""
     query = Event.query.filter_by(is_active=True)
@@ -181,14 +240,16 @@ def search_events(page=1, per_page=12, category='', search='', start_date='', en
         page=page, per_page=per_page, error_out=False
     )
 
+@read_only()
 def get_trending_events(limit=10):
     """Lấy sự kiện trending"""
     try:
         return Event.query.join(EventTrendingLog).order_by(EventTrendingLog.trending_score.desc()).limit(limit).all()
-    except Exception as e:
-        print(f"Error in get_trending_events: {e}")
+    except Exception:
+        logger.exception('loading trending events failed')
         return Event.query.filter_by(is_active=True).order_by(Event.start_time.desc()).limit(limit).all()
 
+@read_only()
 def get_events_by_category(category):
     """Lấy sự kiện theo danh mục"""
     try:
@@ -204,7 +265,7 @@ def get_category_title(category):
         EventCategory(category_value)
         return category_value.title()
     except ValueError:
-        print(f"Invalid category: {category_value}")
+        logger.warning('invalid event category', extra={'category': category_value})
         return 'Unknown'
 
 # Booking related functions
@@ -216,31 +277,28 @@ def get_all_ticket_types_for_event(event_id):
     """Lấy tất cả loại vé của sự kiện"""
     return TicketType.query.filter_by(event_id=event_id).all()
 
-def get_available_ticket_types(all_ticket_types):
-    """Lọc loại vé còn khả dụng"""
+def get_available_ticket_types(all_ticket_types, user_id=None):
+    """Lọc loại vé còn khả dụng (trừ số vé đang dành cho người khác trong danh sách chờ)"""
+    load_shard_sold(all_ticket_types)
+    offered = waitlist.offered_quantities([tt.id for tt in all_ticket_types], exclude_user_id=user_id)
     return [tt for tt in all_ticket_types 
-            if tt.is_active and tt.sold_quantity < tt.total_quantity]
+            if tt.is_active and tt.available_quantity - offered.get(tt.id, 0) > 0]
 
 def get_user_discount_codes(user_group):
-    """Lấy mã giảm giá khả dụng cho người dùng"""
+    """Lấy mã giảm giá khả dụng cho người dùng (từ discount_index, mã không giới hạn max_uses cũng được tính)"""
     try:
-        current_time = datetime.now()
-        return DiscountCode.query.filter(
-            DiscountCode.user_group == user_group,
-            DiscountCode.is_active == True,
-            DiscountCode.valid_from <= current_time,
-            DiscountCode.valid_to >= current_time,
-            DiscountCode.used_count < DiscountCode.max_uses
-        ).all()
-    except Exception as e:
-        print(f"Error loading discount codes: {e}")
+        return discount_index.index.for_group(user_group)
+    except Exception:
+        logger.exception('loading discount codes failed', extra={'customer_group': str(user_group)})
         return []
 
-def validate_ticket_availability(tickets_data):
-    """Kiểm tra tồn kho vé"""
+def validate_ticket_availability(tickets_data, user_id=None):
+    """Kiểm tra tồn kho vé (vé đang mời khách khác trong danh sách chờ không được tính)"""
+    offered = waitlist.offered_quantities([ticket['ticket_type_id'] for ticket in tickets_data],
+                                          exclude_user_id=user_id)
     for ticket in tickets_data:
         ticket_type = TicketType.query.get(ticket['ticket_type_id'])
-        if not ticket_type or ticket['quantity'] > (ticket_type.total_quantity - ticket_type.sold_quantity):
+        if not ticket_type or ticket['quantity'] > ticket_type.available_quantity - offered.get(ticket_type.id, 0):
             return False, f'Không đủ vé loại {ticket_type.name if ticket_type else "Unknown"}'
     return True, None
 
@@ -256,7 +314,7 @@ def validate_ticket_types(ticket_types, event_id=None):
             raise ValidationError(f'Số lượng vé "{ticket["name"]}" phải ít nhất là 1')
         if event_id and ticket.get('id'):
             existing = TicketType.query.get(ticket['id'])
-            if existing and existing.event_id == event_id and ticket['total_quantity'] < existing.sold_quantity:
+            if existing and existing.event_id == event_id and ticket['total_quantity'] < existing.sold_total:
                 raise ValidationError(f'Không thể giảm số lượng vé dưới số vé đã bán cho "{ticket["name"]}"')
         names.add(ticket['name'])
     return True
@@ -287,7 +345,7 @@ def create_event(data, user_id):
     )
     db.session.add(ticket_type)
 
-    # Upload poster if provided
+    # Poster được lưu tạm và upload nền sau khi commit
     if data['poster']:
         event.upload_poster(data['poster'])
 
@@ -354,11 +412,17 @@ def update_event(event_id, data, user_id):
         if 'price' in data and data['price'] is not None:
             ticket_type.price = data['price']
         if 'ticket_quantity' in data and data['ticket_quantity'] is not None:
-            if data['ticket_quantity'] < ticket_type.sold_quantity:
+            if data['ticket_quantity'] < ticket_type.sold_total:
                 raise ValueError('Cannot reduce quantity below sold tickets')
             ticket_type.total_quantity = data['ticket_quantity']
 
     db.session.commit()
+    if ticket_type and ticket_type.shard_count:
+        # Chia lại sức chứa mới cho các shard
+        inventory.rebalance(ticket_type)
+    if ticket_type:
+        # Số lượng tăng thì mời khách trong danh sách chờ
+        waitlist.allocate([ticket_type.id])
     return event
 
 def update_event_with_tickets(event_id, data, user_id):
@@ -393,7 +457,7 @@ def update_event_with_tickets(event_id, data, user_id):
             ticket = existing_ticket_ids[ticket_id]
             ticket.name = ticket_data['name']
             ticket.price = ticket_data['price']
-            if ticket_data['total_quantity'] < ticket.sold_quantity:
+            if ticket_data['total_quantity'] < ticket.sold_total:
                 raise ValidationError(f'Không thể giảm số lượng vé dưới số vé đã bán cho {ticket.name}')
             ticket.total_quantity = ticket_data['total_quantity']
             new_ticket_ids.add(ticket_id)
@@ -414,6 +478,13 @@ def update_event_with_tickets(event_id, data, user_id):
             db.session.delete(ticket)
 
     db.session.commit()
+    # Chia lại sức chứa mới cho các shard
+    for ticket_id in new_ticket_ids:
+        if existing_ticket_ids[ticket_id].shard_count:
+            inventory.rebalance(existing_ticket_ids[ticket_id])
+    # Số lượng tăng thì mời khách trong danh sách chờ
+    if new_ticket_ids:
+        waitlist.allocate(new_ticket_ids)
     return event
 
 def delete_event(event_id, user_id):
@@ -430,45 +501,48 @@ def bulk_delete_events(event_ids, user_id):
         delete_event(event_id, user_id)
 
 # Payment and ticket cleanup functions
-def create_payment(user_id, amount, payment_method, status, transaction_id, discount_code=None):
-    """
-    Tạo một đối tượng Payment mới.
-    """
-    payment = Payment(
-        user_id=user_id,
-        amount=amount,
-        payment_method=PaymentMethod(payment_method),
-        status=status,
-        transaction_id=transaction_id
+def claim_payment(payment, now=None):
+    """Đánh dấu payment đã thanh toán bằng một câu UPDATE có điều kiện status = False;
+    False nếu payment đã được đánh dấu trước đó (callback lặp lại)"""
+    now = now or datetime.utcnow()
+    claimed = Payment.query.filter_by(id=payment.id, status=False).update(
+        {'status': True, 'paid_at': now}, synchronize_session=False) == 1
+    db.session.expire(payment, ['status', 'paid_at'])
+    return claimed
+
+def hold_tickets(user_id, event_id, payment_id, lines, max_per_user, now=None):
+    """Giữ chỗ vé (chưa thanh toán) cho payment, chỉ khi tổng vé của user cho sự kiện (đã mua + đang giữ)
+    không vượt max_per_user. Điều kiện và INSERT nằm trong cùng một câu lệnh:
+
+        INSERT INTO tickets (...) SELECT ... WHERE (SELECT count(*) FROM tickets WHERE user/event) + n <= max
+
+    Trả về False (không thêm vé nào) nếu vượt giới hạn."""
+    now = now or datetime.utcnow()
+    quantity = sum(line.quantity for line in lines)
+    # Khoá dòng user để hai yêu cầu song song của cùng tài khoản không cùng vượt qua điều kiện
+    db.session.query(User.id).filter_by(id=user_id).with_for_update().scalar()
+    columns = {
+        'user_id': user_id, 'event_id': event_id, 'payment_id': payment_id, 'is_paid': False,
+        'is_checked_in': False, 'created_at': now,
+    }
+    rows = union_all(*[
+        select(*(literal(value, getattr(Ticket, name).type).label(name) for name, value in columns.items()),
+               literal(line.ticket_type_id, Ticket.ticket_type_id.type).label('ticket_type_id'),
+               literal(str(uuid.uuid4()), Ticket.uuid.type).label('uuid'))
+        for line in lines for _ in range(line.quantity)
+    ]).subquery()
+    owned = (select(func.count(Ticket.id)).where(Ticket.user_id == user_id, Ticket.event_id == event_id)
+             .scalar_subquery())
+    names = [*columns, 'ticket_type_id', 'uuid']
+    result = db.session.execute(
+        insert(Ticket).from_select(names, select(*(rows.c[name] for name in names))
+                                   .where(owned + quantity <= max_per_user))
     )
-    if discount_code:
-        dc = DiscountCode.query.filter_by(code=discount_code).first()
-        if dc:
-            payment.discount_code = dc
-    db.session.add(payment)
-    return payment
+    return result.rowcount == quantity
 
-def update_user_and_event_after_payment(user_id, event_id, amount):
-    """Cập nhật tổng chi tiêu của user và tính lại điểm trending cho event"""
-    user = User.query.get(user_id)
-    event = Event.query.get(event_id)
-    if user and amount:
-        user.total_spent = (user.total_spent or 0) + amount
-    if event and event.trending_log:
-        event.trending_log.calculate_score()
-    db.session.commit()
-
-def cleanup_unpaid_tickets(timeout_minutes=1):
-    """Xóa các vé chưa thanh toán sau thời gian quy định"""
-    expire_time = datetime.utcnow() - timedelta(minutes=timeout_minutes)
-    tickets = Ticket.query.filter(
-        Ticket.is_paid == False,
-        Ticket.purchase_date == None,
-        Ticket.created_at < expire_time
-    ).all()
-    for ticket in tickets:
-        db.session.delete(ticket)
-    db.session.commit()
+def get_unpaid_tickets_for_payment(payment_id, user_id):
+    """Lấy các vé đang giữ chỗ (chưa thanh toán) của một payment"""
+    return Ticket.query.filter_by(payment_id=payment_id, user_id=user_id, is_paid=False).all()
 
 # VNPay functions
 def vnpay_encode(value):
@@ -476,6 +550,7 @@ def vnpay_encode(value):
     return quote_plus(str(value), safe='')
 
 def create_payment_url_flask(amount, txn_ref):
+    import pytz
     tz = pytz.timezone("Asia/Ho_Chi_Minh")
     host_url=request.host_url.rstrip('/')
     vnp_TmnCode = os.environ.get('VNPAY_TMN_CODE')
@@ -540,22 +615,34 @@ def vnpay_response_message(code):
     }
     return mapping.get(code, "Lỗi không xác định.")
 
+@metrics.payment_callback_seconds.time()
 def vnpay_redirect_flask():
     vnp_ResponseCode = request.args.get('vnp_ResponseCode')
     vnp_TxnRef = request.args.get('vnp_TxnRef')
 
     if vnp_ResponseCode is None:
+        metrics.payment_callbacks.labels(result='invalid').inc()
         return "Thiếu tham số vnp_ResponseCode.", 400
 
     message = vnpay_response_message(vnp_ResponseCode)
     payment_success = vnp_ResponseCode == '00'
 
     payment = Payment.query.filter_by(transaction_id=vnp_TxnRef).first()
+    if payment is None:
+        metrics.payment_callbacks.labels(result='unknown_payment').inc()
+        payment_logger.warning('VNPay callback for unknown transaction',
+                               extra={'transaction_id': vnp_TxnRef, 'response_code': vnp_ResponseCode})
+    else:
+        metrics.payment_callbacks.labels(result='paid' if payment_success else 'failed').inc()
+        payment_logger.info('VNPay callback', extra={
+            'payment_id': payment.id, 'transaction_id': vnp_TxnRef, 'response_code': vnp_ResponseCode})
 
-    if payment and payment_success:
-        payment.status = True
-        payment.paid_at = datetime.utcnow()
-        tickets = Ticket.query.filter_by(payment_id=payment.id, user_id=payment.user_id, is_paid=False).all()
+    if payment and payment_success and not claim_payment(payment):
+        # Callback lặp lại sau khi đơn đã được xử lý (hoặc đang xử lý ở worker khác)
+        payment_logger.info('VNPay callback replayed for paid transaction', extra={
+            'payment_id': payment.id, 'transaction_id': vnp_TxnRef})
+    elif payment and payment_success:
+        tickets = get_unpaid_tickets_for_payment(payment.id, payment.user_id)
 
         if tickets:
             event_id = tickets[0].event_id
@@ -563,10 +650,13 @@ def vnpay_redirect_flask():
             ticket.is_paid = True
             ticket.purchase_date = datetime.utcnow()
             ticket.generate_qr_code()
-            if ticket.ticket_type:
-                ticket.ticket_type.sold_quantity += 1
-        if payment.discount_code:
-            payment.discount_code.used_count += 1
+        counters.add_sold(tickets)
+        # Vé đã bán xong: lời mời danh sách chờ của khách (nếu có) không cần giữ vé nữa
+        waitlist.claim(payment.user_id, {ticket.ticket_type_id for ticket in tickets})
+        if payment.discount_code_id and not discount_index.redeem(payment.discount_code_id):
+            # Khách đã thanh toán theo giá giảm nên vẫn ghi nhận vé, chỉ cảnh báo mã đã hết lượt
+            payment_logger.warning('discount code exhausted at payment time', extra={
+                'payment_id': payment.id, 'discount_code_id': payment.discount_code_id})
         notif = Notification(
             event_id=event_id,
             title="Thanh toán thành công",
@@ -623,15 +713,17 @@ def vnpay_redirect_flask():
         try:
             send_ticket_email(user.email, email_subject, html_body, tickets=ticket_infos)
         except Exception as e:
-            print(f"[EMAIL ERROR] Không gửi được vé: {e}")
+            payment_logger.exception('ticket email failed', extra={
+                'event_id': event_id, 'payment_id': payment.id, 'transaction_id': payment.transaction_id})
         update_user_and_event_after_payment(payment.user_id, event_id, payment.amount)
         db.session.add(notif)
         db.session.flush()
         notif.send_to_user(payment.user)
         db.session.commit()
     elif payment and not payment_success:
+        held = get_unpaid_tickets_for_payment(payment.id, payment.user_id)
         notif = Notification(
-            event_id=event_id,
+            event_id=held[0].event_id if held else None,
             title="Thanh toán thất bại",
             message=f"Thanh toán đơn hàng {payment.transaction_id} không thành công.",
             notification_type="payment"
@@ -639,6 +731,7 @@ def vnpay_redirect_flask():
         db.session.add(notif)
         db.session.flush()
         notif.send_to_user(payment.user)
+        db.session.commit()
 
     redirect_url = '/my-tickets'
     if payment_success:
@@ -680,9 +773,9 @@ def create_payment(user_id, amount, payment_method, status, transaction_id, disc
         transaction_id=transaction_id
     )
     if discount_code:
-        dc = DiscountCode.query.filter_by(code=discount_code).first()
+        dc = discount_index.index.get(discount_code)
         if dc:
-            payment.discount_code = dc
+            payment.discount_code_id = dc.id
     db.session.add(payment)
     return payment
 
@@ -690,24 +783,28 @@ def update_user_and_event_after_payment(user_id, event_id, amount):
     """
     Cập nhật tổng chi tiêu của user và tính lại điểm trending cho event sau khi thanh toán thành công.
     """
-    user = User.query.get(user_id)
+    counters.add_spent(user_id, amount)
     event = Event.query.get(event_id)
-    if user and amount:
-        user.total_spent = (user.total_spent or 0) + amount
     if event and event.trending_log:
         event.trending_log.calculate_score()
     db.session.commit()
 
+@metrics.cleanup_seconds.time()
 def cleanup_unpaid_tickets(timeout_minutes=1):
+    """Xóa các vé chưa thanh toán sau thời gian quy định và mời danh sách chờ của các loại vé đó"""
     expire_time = datetime.utcnow() - timedelta(minutes=timeout_minutes)
     tickets = Ticket.query.filter(
         Ticket.is_paid == False,
         Ticket.purchase_date == None,
         Ticket.created_at < expire_time
     ).all()
+    ticket_type_ids = {ticket.ticket_type_id for ticket in tickets}
     for ticket in tickets:
         db.session.delete(ticket)
     db.session.commit()
+    metrics.unpaid_tickets_released.inc(len(tickets))
+    if ticket_type_ids:
+        waitlist.allocate(ticket_type_ids)
 
 # ========== Review DAO ========== #
 def get_user_review(event_id, user_id):
@@ -808,3 +905,194 @@ def update_user_role(user_id, new_role, organizer_id=None):
                 event.staff.remove(user)
 
     db.session.commit()
+
+# ========== Gate / Offline check-in DAO ========== #
+def is_staff_assigned_to_event(staff_id, event_id):
+    """Kiểm tra nhân viên có được gán cho sự kiện (bảng event_staff)"""
+    return db.session.query(event_staff).filter_by(
+        event_id=event_id, staff_id=staff_id
+    ).first() is not None
+
+def get_ticket_manifest(event_id, since=None):
+    """Lấy uuid vé đã thanh toán của sự kiện, tách thành (chưa check-in, đã check-in).
+    Nếu có since thì chỉ lấy phần thay đổi: vé mua sau since hoặc check-in sau since."""
+    query = db.session.query(Ticket.uuid, Ticket.is_checked_in).filter(
+        Ticket.event_id == event_id,
+        Ticket.is_paid == True
+    )
+    if since:
+        query = query.filter(or_(Ticket.purchase_date > since, Ticket.check_in_date > since))
+    valid, checked = [], []
+    for ticket_uuid, is_checked_in in query:
+        (checked if is_checked_in else valid).append(ticket_uuid)
+    return valid, checked
+
+def _parse_checkin_time(value, now):
+    """Đọc thời điểm check-in offline (ISO hoặc unix timestamp), không cho phép ở tương lai"""
+    if value in (None, ''):
+        return now
+    if isinstance(value, (int, float)):
+        parsed = datetime.utcfromtimestamp(value)
+    else:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return min(parsed, now)
+
+def reconcile_offline_checkins(event_id, checkins, chunk_size=500):
+    """Đồng bộ hàng loạt các lượt check-in offline của một sự kiện.
+    checkins: list dict {'uuid', 'checked_in_at'}. Trả về dict uuid -> kết quả
+    ('ok', 'unknown', 'unpaid', 'already_checked_in', 'duplicate', 'invalid')."""
+    now = datetime.utcnow()
+    results = {}
+    pending = {}
+    for item in checkins:
+        ticket_uuid = str(item.get('uuid') or '').strip()
+        try:
+            checked_in_at = _parse_checkin_time(item.get('checked_in_at'), now)
+        except (TypeError, ValueError, OverflowError):
+            results[ticket_uuid] = {'status': 'invalid'}
+            continue
+        if not ticket_uuid:
+            continue
+        # Nhiều cổng cùng quét một vé: giữ lần quét sớm nhất
+        if ticket_uuid not in pending or checked_in_at < pending[ticket_uuid]:
+            pending[ticket_uuid] = checked_in_at
+
+    found = get_tickets_by_uuids(list(pending), event_id, chunk_size)
+    candidates = []
+    for ticket_uuid in pending:
+        row = found.get(ticket_uuid)
+        if row is None:
+            results[ticket_uuid] = {'status': 'unknown'}
+        elif not row.is_paid:
+            results[ticket_uuid] = {'status': 'unpaid'}
+        elif row.is_checked_in:
+            status = 'duplicate' if row.check_in_date == pending[ticket_uuid] else 'already_checked_in'
+            results[ticket_uuid] = {
+                'status': status,
+                'check_in_date': row.check_in_date.isoformat() if row.check_in_date else None
+            }
+        else:
+            candidates.append(row)
+
+    flipped = mark_checked_in({row.id: pending[row.uuid] for row in candidates}, chunk_size)
+    applied_rows = [row for row in candidates if row.id in flipped]
+    # Cổng/thiết bị khác đã check-in vé giữa lúc đọc và lúc ghi: báo xung đột với thời điểm đã lưu
+    lost = [row.id for row in candidates if row.id not in flipped]
+    stored = dict(db.session.query(Ticket.id, Ticket.check_in_date).filter(Ticket.id.in_(lost))) if lost else {}
+    for row in candidates:
+        if row.id in flipped:
+            results[row.uuid] = {'status': 'ok', 'check_in_date': pending[row.uuid].isoformat()}
+        else:
+            check_in_date = stored.get(row.id)
+            results[row.uuid] = {'status': 'already_checked_in',
+                                 'check_in_date': check_in_date.isoformat() if check_in_date else None}
+    if applied_rows:
+        send_checkin_notifications(applied_rows)
+    db.session.commit()
+    for row in applied_rows:
+        checkin_stats.counters.record(row.event_id, row.ticket_type_id, pending[row.uuid])
+    return results
+
+def bulk_check_in(uuids, event_id, chunk_size=500):
+    """Check-in hàng loạt cho cổng soát vé: một truy vấn IN để kiểm tra, một câu UPDATE để ghi.
+    Trả về dict uuid -> 'ok' | 'unknown' | 'unpaid' | 'already_checked_in'."""
+    now = datetime.utcnow()
+    found = get_tickets_by_uuids(uuids, event_id, chunk_size)
+    results = {}
+    candidates = []
+    for ticket_uuid in uuids:
+        if ticket_uuid in results:
+            # uuid lặp lại trong cùng một lô: giữ kết quả của lần quét đầu tiên
+            continue
+        row = found.get(ticket_uuid)
+        if row is None:
+            results[ticket_uuid] = 'unknown'
+        elif not row.is_paid:
+            results[ticket_uuid] = 'unpaid'
+        elif row.is_checked_in:
+            results[ticket_uuid] = 'already_checked_in'
+        else:
+            results[ticket_uuid] = 'ok'
+            candidates.append(row)
+
+    # Chỉ vé do chính lô này chuyển sang đã check-in mới được báo 'ok', gửi thông báo và đếm vào cổng
+    flipped = mark_checked_in({row.id: now for row in candidates}, chunk_size)
+    ok_rows = [row for row in candidates if row.id in flipped]
+    for row in candidates:
+        if row.id not in flipped:
+            results[row.uuid] = 'already_checked_in'
+    if ok_rows:
+        send_checkin_notifications(ok_rows, now)
+    db.session.commit()
+    for row in ok_rows:
+        checkin_stats.counters.record(row.event_id, row.ticket_type_id, now)
+    return results
+
+def mark_checked_in(checked_in_at_by_id, chunk_size=500):
+    """Ghi check-in cho các vé còn chưa check-in (điều kiện nằm trong câu UPDATE).
+    Trả về set id vé mà lần gọi này thực sự ghi được; vé đã bị cổng khác check-in trước thì bị bỏ qua.
+    Dùng UPDATE ... RETURNING khi CSDL hỗ trợ (PostgreSQL, SQLite), MySQL thì UPDATE từng vé và xem rowcount."""
+    tickets = Ticket.__table__
+    by_time = {}
+    for ticket_id, checked_in_at in checked_in_at_by_id.items():
+        by_time.setdefault(checked_in_at, []).append(ticket_id)
+    flipped = set()
+    for checked_in_at, ids in by_time.items():
+        values = {'is_checked_in': True, 'check_in_date': checked_in_at}
+        if db.engine.dialect.update_returning:
+            for start in range(0, len(ids), chunk_size):
+                flipped.update(db.session.execute(
+                    tickets.update()
+                    .where(tickets.c.id.in_(ids[start:start + chunk_size]), tickets.c.is_checked_in == False)
+                    .values(**values)
+                    .returning(tickets.c.id)
+                ).scalars())
+        else:
+            for ticket_id in ids:
+                if db.session.execute(
+                    tickets.update()
+                    .where(tickets.c.id == ticket_id, tickets.c.is_checked_in == False)
+                    .values(**values)
+                ).rowcount:
+                    flipped.add(ticket_id)
+    return flipped
+
+def get_tickets_by_uuids(uuids, event_id=None, chunk_size=500):
+    """Tra cứu vé theo danh sách uuid bằng truy vấn IN (chia lô), trả về dict uuid -> row"""
+    found = {}
+    uuids = list(dict.fromkeys(uuids))
+    for start in range(0, len(uuids), chunk_size):
+        query = db.session.query(
+            Ticket.id, Ticket.uuid, Ticket.user_id, Ticket.event_id, Ticket.ticket_type_id,
+            Ticket.is_paid, Ticket.is_checked_in, Ticket.check_in_date
+        ).filter(Ticket.uuid.in_(uuids[start:start + chunk_size]))
+        if event_id is not None:
+            query = query.filter(Ticket.event_id == event_id)
+        found.update({row.uuid: row for row in query})
+    return found
+
+def send_checkin_notifications(rows, checked_in_at=None):
+    """Gửi thông báo check-in theo lô: một Notification cho mỗi sự kiện, chèn UserNotification hàng loạt"""
+    users_by_event = {}
+    for row in rows:
+        users_by_event.setdefault(row.event_id, set()).add(row.user_id)
+    if not users_by_event:
+        return
+    titles = dict(db.session.query(Event.id, Event.title).filter(Event.id.in_(users_by_event)))
+    when = (checked_in_at or datetime.utcnow()).strftime("%H:%M %d/%m/%Y")
+    for event_id, user_ids in users_by_event.items():
+        notification = Notification(
+            event_id=event_id,
+            title='Check-in thành công',
+            message=f'Vé cho sự kiện "{titles.get(event_id, "")}" đã được check-in thành công lúc {when}. ',
+            notification_type='checkin'
+        )
+        db.session.add(notification)
+        db.session.flush()
+        db.session.execute(
+            UserNotification.__table__.insert(),
+            [{'user_id': user_id, 'notification_id': notification.id, 'is_read': False, 'created_at': datetime.utcnow()}
+             for user_id in user_ids]
+        )
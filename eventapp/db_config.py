@@ -0,0 +1,141 @@
+"""
+Database engine configuration and connection pool metrics.
+
+``engine_options`` builds ``SQLALCHEMY_ENGINE_OPTIONS`` from the database URL,
+the environment (``FLASK_ENV``) and ``DB_*`` overrides:
+
+    DB_POOL_SIZE, DB_MAX_OVERFLOW   connections kept / burst per worker process
+    DB_POOL_TIMEOUT                 seconds to wait for a free connection
+    DB_POOL_RECYCLE                 reconnect connections older than this
+    DB_STATEMENT_TIMEOUT_MS         server-side statement timeout (0 = none)
+    DB_PGBOUNCER=1                  PgBouncer transaction pooling: no app-side pool
+
+With PgBouncer in transaction mode the bouncer owns pooling, so the app uses
+``NullPool`` and sends no startup ``options`` (PgBouncer rejects them); set
+``statement_timeout`` on the database role instead.
+
+``TimedQueuePool`` records how long checkouts wait for a connection, exposed
+with the other pool counters through ``pool_metrics.snapshot()``.
+"""
+import os
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
+
+# gunicorn runs 2 workers and each also runs the media upload thread
+PROFILES = {
+    'production': {'pool_size': 5, 'max_overflow': 5, 'pool_timeout': 10, 'pool_recycle': 1800,
+                   'statement_timeout_ms': 15000},
+    'development': {'pool_size': 2, 'max_overflow': 3, 'pool_timeout': 30, 'pool_recycle': 3600,
+                    'statement_timeout_ms': 0},
+}
+
+
+class PoolMetrics:
+    """Process-wide counters for connection pool activity"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.engine = None
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.connects = 0
+            self.invalidations = 0
+            self.timeouts = 0
+            self.wait_seconds_total = 0.0
+            self.wait_seconds_max = 0.0
+
+    def observe_wait(self, seconds, timed_out=False):
+        with self._lock:
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+            if timed_out:
+                self.timeouts += 1
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def attach(self, engine):
+        """Listen to pool events of ``engine``; safe to call once per engine"""
+        self.engine = engine
+        event.listen(engine, 'checkout', lambda *args: self._count('checkouts'))
+        event.listen(engine, 'connect', lambda *args: self._count('connects'))
+        event.listen(engine, 'invalidate', lambda *args: self._count('invalidations'))
+
+    def snapshot(self):
+        pool = self.engine.pool if self.engine is not None else None
+        with self._lock:
+            data = {
+                'pool_class': type(pool).__name__ if pool is not None else None,
+                'checkouts': self.checkouts,
+                'connects': self.connects,
+                'invalidations': self.invalidations,
+                'timeouts': self.timeouts,
+                'wait_seconds_total': round(self.wait_seconds_total, 6),
+                'wait_seconds_avg': round(self.wait_seconds_total / self.checkouts, 6) if self.checkouts else 0.0,
+                'wait_seconds_max': round(self.wait_seconds_max, 6),
+            }
+        if isinstance(pool, QueuePool):
+            data.update(size=pool.size(), checked_out=pool.checkedout(),
+                        overflow=pool.overflow(), checked_in=pool.checkedin())
+        return data
+
+
+pool_metrics = PoolMetrics()
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that reports how long each checkout waited for a connection"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            pool_metrics.observe_wait(time.perf_counter() - started, timed_out=True)
+            raise
+        pool_metrics.observe_wait(time.perf_counter() - started)
+        return connection
+
+
+def _int_env(name, default):
+    value = os.getenv(name)
+    return int(value) if value not in (None, '') else default
+
+
+def engine_options(database_uri, environment=None):
+    """SQLAlchemy engine options for the given database and environment"""
+    url = make_url(database_uri)
+    if url.get_backend_name() == 'sqlite':
+        # No server connections to manage; keep SQLAlchemy's defaults
+        return {}
+
+    environment = environment or os.getenv('FLASK_ENV', 'production')
+    profile = PROFILES.get(environment, PROFILES['production'])
+    statement_timeout = _int_env('DB_STATEMENT_TIMEOUT_MS', profile['statement_timeout_ms'])
+    backend = url.get_backend_name()
+
+    if os.getenv('DB_PGBOUNCER') == '1':
+        return {'poolclass': NullPool}
+
+    options = {
+        'poolclass': TimedQueuePool,
+        'pool_size': _int_env('DB_POOL_SIZE', profile['pool_size']),
+        'max_overflow': _int_env('DB_MAX_OVERFLOW', profile['max_overflow']),
+        'pool_timeout': _int_env('DB_POOL_TIMEOUT', profile['pool_timeout']),
+        'pool_recycle': _int_env('DB_POOL_RECYCLE', profile['pool_recycle']),
+        'pool_pre_ping': True,
+    }
+    if statement_timeout and backend == 'postgresql':
+        options['connect_args'] = {'options': f'-c statement_timeout={statement_timeout}'}
+    elif statement_timeout and backend == 'mysql':
+        options['connect_args'] = {'init_command': f'SET SESSION max_execution_time={statement_timeout}'}
+    return options
@@ -0,0 +1,105 @@
+"""
+Read-replica routing for the Flask-SQLAlchemy session.
+
+Replicas are configured with ``DATABASE_REPLICA_URLS`` (comma separated). Code
+opts in to replica reads with ``read_only()``, used as a context manager or as
+a decorator (``@read_only()``) on DAO functions and report views. Inside that
+scope ``RoutingSession.get_bind`` picks a replica round-robin, except when:
+
+* the session is flushing, has pending changes or runs an UPDATE/DELETE/INSERT;
+* the request is not GET/HEAD (booking and payment flows read their own writes);
+* the user wrote recently: any write stores a "primary until" timestamp in the
+  Flask session cookie, so the next ``DB_REPLICA_STICKY_SECONDS`` of that
+  user's requests read from the primary while replicas catch up.
+
+Without replicas every query goes to the primary, exactly as before.
+"""
+import contextvars
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request, session as http_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine
+from sqlalchemy.sql.dml import UpdateBase
+
+STICKY_SESSION_KEY = '_db_primary_until'
+
+_read_only = contextvars.ContextVar('db_read_only', default=False)
+
+
+class ReplicaSet:
+    """Engines for the configured read replicas of this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.engines = []
+        self._cycle = None
+
+    def configure(self, urls, engine_options=None):
+        self.dispose()
+        engines = [create_engine(url, **(engine_options(url) if engine_options else {})) for url in urls]
+        with self._lock:
+            self.engines = engines
+            self._cycle = itertools.cycle(engines) if engines else None
+
+    def dispose(self):
+        with self._lock:
+            engines, self.engines, self._cycle = self.engines, [], None
+        for engine in engines:
+            engine.dispose()
+
+    def next(self):
+        with self._lock:
+            return next(self._cycle)
+
+
+replicas = ReplicaSet()
+
+
+@contextmanager
+def read_only():
+    """Allow queries in this scope to be served by a replica"""
+    token = _read_only.set(True)
+    try:
+        yield
+    finally:
+        _read_only.reset(token)
+
+
+def _mark_write():
+    if has_request_context():
+        g.db_wrote = True
+
+
+def primary_required():
+    """Whether the current request must read from the primary"""
+    if not has_request_context():
+        return False
+    if request.method not in ('GET', 'HEAD') or g.get('db_wrote'):
+        return True
+    return http_session.get(STICKY_SESSION_KEY, 0) > time.time()
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and replicas.engines:
+            if self._flushing or isinstance(clause, UpdateBase):
+                _mark_write()
+            elif _read_only.get() and not (self.new or self.dirty or self.deleted) and not primary_required():
+                return replicas.next()
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def init_app(app, engine_options=None):
+    """Create replica engines from config and keep writers sticky to the primary"""
+    urls = [url.strip() for url in app.config.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+    replicas.configure(urls, engine_options)
+
+    @app.after_request
+    def remember_primary_after_write(response):
+        if g.get('db_wrote'):
+            http_session[STICKY_SESSION_KEY] = time.time() + app.config.get('DB_REPLICA_STICKY_SECONDS', 5)
+        return response
@@ -0,0 +1,153 @@
+"""
+In-memory catalogue of discount codes and atomic redemption.
+
+The booking page lists the codes available to the customer's group and
+``create_payment`` looks a code up by its string; both used to query
+``discount_codes`` on every call. ``index`` keeps a per-process snapshot of
+the active, not yet expired codes grouped by ``CustomerGroup``:
+
+* ``index.for_group(group)`` - codes usable now, ordered by code
+* ``index.get(code)`` - the snapshot for one code string, or None
+
+The snapshot is rebuilt when it is older than ``DISCOUNT_INDEX_TTL_SECONDS``,
+when a loaded code starts or ends its validity window, and after any
+committed change to a ``DiscountCode`` in this process. Other workers pick up
+changes within the TTL.
+
+``redeem(code_id)`` increments ``used_count`` with a single conditional
+UPDATE, so concurrent payments cannot push a code past ``max_uses``. Codes
+with ``max_uses`` NULL are unlimited.
+"""
+import itertools
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from eventapp import counters, db
+from eventapp.models import DiscountCode
+
+_PENDING_KEY = 'discount_index_invalidate'
+
+
+class DiscountCodeSnapshot:
+    """Detached, read-only copy of a DiscountCode row"""
+
+    FIELDS = ('id', 'code', 'discount_percentage', 'valid_from', 'valid_to', 'user_group', 'max_uses',
+              'used_count', 'is_active')
+    __slots__ = FIELDS
+
+    def __init__(self, code):
+        for name in self.FIELDS:
+            object.__setattr__(self, name, getattr(code, name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('DiscountCodeSnapshot is read-only')
+
+    def __repr__(self):
+        return f'<DiscountCodeSnapshot {self.code}>'
+
+    def is_valid(self, now=None):
+        """Same rules as DiscountCode.is_valid, on the snapshot's used_count"""
+        now = now or datetime.now()
+        return (
+            self.is_active and
+            self.valid_from <= now <= self.valid_to and
+            (self.max_uses is None or self.used_count < self.max_uses)
+        )
+
+
+class DiscountIndex:
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._by_code = {}
+        self._by_group = {}
+        self._expires_at = 0.0    # time.monotonic() deadline from the TTL
+        self._next_change = None  # earliest valid_from/valid_to boundary after loading
+        self._generation = 0
+        self.loads = 0
+
+    def _stale(self, now):
+        return (time.monotonic() >= self._expires_at or
+                (self._next_change is not None and now >= self._next_change))
+
+    def _snapshot(self, now):
+        with self._lock:
+            if not self._stale(now):
+                return self._by_code, self._by_group
+            generation = self._generation
+
+        codes = DiscountCode.query.filter(
+            DiscountCode.is_active == True,
+            DiscountCode.valid_to >= now
+        ).order_by(DiscountCode.code).all()
+        by_code = {code.code: DiscountCodeSnapshot(code) for code in codes}
+        by_group = {}
+        for snapshot in by_code.values():
+            by_group.setdefault(snapshot.user_group, []).append(snapshot)
+        boundaries = [moment for snapshot in by_code.values()
+                      for moment in (snapshot.valid_from, snapshot.valid_to) if moment > now]
+
+        with self._lock:
+            self.loads += 1
+            # Skip the store if an invalidation raced with the query above
+            if self.ttl > 0 and generation == self._generation:
+                self._by_code, self._by_group = by_code, by_group
+                self._expires_at = time.monotonic() + self.ttl
+                self._next_change = min(boundaries, default=None)
+        return by_code, by_group
+
+    def for_group(self, user_group, now=None):
+        """Codes the group can use right now"""
+        now = now or datetime.now()
+        _, by_group = self._snapshot(now)
+        return [snapshot for snapshot in by_group.get(user_group, ()) if snapshot.is_valid(now)]
+
+    def get(self, code, now=None):
+        """Snapshot for a code string (valid or not), None if unknown, inactive or expired"""
+        if not code:
+            return None
+        by_code, _ = self._snapshot(now or datetime.now())
+        return by_code.get(code)
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._expires_at = 0.0
+
+
+index = DiscountIndex()
+
+
+def redeem(code_id):
+    """Count one use of a code; False when it is inactive or already at max_uses.
+
+    Runs in the caller's transaction; the index is refreshed after commit."""
+    redeemed = counters.redeem_discount(code_id)
+    db.session.info[_PENDING_KEY] = True
+    return redeemed
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_codes(session, flush_context):
+    if any(isinstance(obj, DiscountCode) for obj in itertools.chain(session.new, session.dirty, session.deleted)):
+        session.info[_PENDING_KEY] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed_codes(session):
+    if session.info.pop(_PENDING_KEY, False):
+        index.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back_codes(session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+def init_app(app):
+    index.ttl = app.config.get('DISCOUNT_INDEX_TTL_SECONDS', 60)
+    index.invalidate()
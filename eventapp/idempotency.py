@@ -0,0 +1,146 @@
+"""
+Idempotency keys for requests that create payments or fulfil them.
+
+A view decorated with ``@idempotent(scope)`` runs at most once per key:
+
+* The key comes from the ``Idempotency-Key`` header (``get_key`` can derive
+  it from the request instead, e.g. the VNPay transaction reference). Without
+  a key the view runs as before.
+* The first request stores a row in ``idempotency_keys`` holding the
+  request fingerprint (sha256 of method, path, query string and body), runs
+  the view and saves its status, content type and body on the row.
+* A repeat with the same key gets the stored response (header
+  ``Idempotent-Replayed: true``) after one SELECT: no view code, no writes.
+  While the first request is still running, repeats get 409. The same key
+  sent with a different query string or body gets 422.
+* Responses with status >= 500 or 429 (rate limited), responses the view's
+  ``store`` predicate rejects, and exceptions delete the row so the client
+  can retry. A row stuck "running" (worker killed) is taken over after
+  ``IDEMPOTENCY_LOCK_SECONDS``.
+
+Rows expire after ``IDEMPOTENCY_TTL_SECONDS`` (default one day); purge them
+periodically:
+
+    flask --app eventapp idempotency purge
+"""
+import functools
+import hashlib
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app, jsonify, make_response, request
+from flask_login import current_user
+from sqlalchemy.exc import IntegrityError
+
+from eventapp import db
+from eventapp.models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 200
+
+
+def fingerprint():
+    """Hash of the current request's method, path, query string and body"""
+    digest = hashlib.sha256(f'{request.method} {request.path}\n'.encode('utf-8'))
+    digest.update(request.query_string + b'\n')
+    digest.update(request.get_data(cache=True))
+    return digest.hexdigest()
+
+
+def _replay(record):
+    response = make_response(record.response_body, record.status_code)
+    response.content_type = record.content_type
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _error(message, status):
+    return jsonify({'success': False, 'message': message}), status
+
+
+def _claim(key, request_fingerprint, now):
+    """Insert the "running" row for ``key``; returns (record, None) or (None, response to send)"""
+    ttl = timedelta(seconds=current_app.config.get('IDEMPOTENCY_TTL_SECONDS', 86400))
+    lock = timedelta(seconds=current_app.config.get('IDEMPOTENCY_LOCK_SECONDS', 120))
+    record = IdempotencyKey.query.filter_by(key=key).first()
+    if record is not None and record.expires_at > now:
+        if record.fingerprint != request_fingerprint:
+            return None, _error('Idempotency-Key đã được dùng cho một yêu cầu khác.', 422)
+        if record.status_code is not None:
+            return None, _replay(record)
+        if record.created_at + lock > now:
+            return None, _error('Yêu cầu trước với cùng Idempotency-Key đang được xử lý.', 409)
+    if record is None:
+        record = IdempotencyKey(key=key)
+        db.session.add(record)
+    # New key, expired row, or an abandoned "running" row
+    record.fingerprint = request_fingerprint
+    record.status_code = record.content_type = record.response_body = None
+    record.created_at, record.expires_at = now, now + ttl
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another worker claimed the key between the SELECT and the INSERT
+        db.session.rollback()
+        return None, _error('Yêu cầu trước với cùng Idempotency-Key đang được xử lý.', 409)
+    return record, None
+
+
+def _release(record_id):
+    db.session.rollback()
+    IdempotencyKey.query.filter_by(id=record_id).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def idempotent(scope, get_key=None, per_user=True, store=None):
+    """Run the view once per (scope, user, key) and replay its response to repeats.
+    ``store(response)`` returning False keeps the response from being replayed (the key is released)."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            client_key = get_key() if get_key else request.headers.get(HEADER)
+            if not client_key:
+                return view(*args, **kwargs)
+            if len(client_key) > MAX_KEY_LENGTH:
+                return _error(f'{HEADER} dài tối đa {MAX_KEY_LENGTH} ký tự.', 400)
+            owner = current_user.get_id() if per_user and current_user.is_authenticated else ''
+            record, response = _claim(f'{scope}:{owner}:{client_key}', fingerprint(), datetime.utcnow())
+            if response is not None:
+                return response
+            record_id = record.id
+            try:
+                response = make_response(view(*args, **kwargs))
+            except Exception:
+                _release(record_id)
+                raise
+            if (response.status_code >= 500 or response.status_code == 429 or response.is_streamed
+                    or (store is not None and not store(response))):
+                _release(record_id)
+                return response
+            record = db.session.get(IdempotencyKey, record_id)
+            record.status_code = response.status_code
+            record.content_type = response.content_type
+            record.response_body = response.get_data()
+            db.session.commit()
+            return response
+        return wrapper
+    return decorator
+
+
+def purge_expired(now=None):
+    """Delete expired keys; returns the number of rows removed"""
+    deleted = IdempotencyKey.query.filter(IdempotencyKey.expires_at <= (now or datetime.utcnow())) \
+        .delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+def init_app(app):
+    @app.cli.group('idempotency')
+    def idempotency_command():
+        """Stored responses of idempotent requests."""
+
+    @idempotency_command.command('purge')
+    def purge_command():
+        """Delete expired idempotency keys."""
+        click.echo(f'{purge_expired()} expired idempotency keys deleted')
@@ -0,0 +1,178 @@
+"""
+Sharded sold-ticket counters for very popular ticket types.
+
+Every sale of a ticket type normally updates its one ``ticket_types`` row, so
+during a big on-sale all payments queue on that row lock. With sharding the
+unsold capacity is split over ``shard_count`` rows of ``ticket_type_shards``
+and a sale locks only one of them:
+
+* ``enable(ticket_type, shards)`` splits the remaining capacity evenly.
+* ``take(ticket_type_id, quantity)`` (called by ``counters.add_sold``) adds
+  the sale to a random shard with room for it; if none has, it scans the
+  shards and spreads the quantity over those that still have capacity.
+* ``rebalance(ticket_type)`` spreads the remaining capacity evenly again (a
+  few shards selling out while others have room, or ``total_quantity``
+  changed).
+* ``merge(ticket_type)`` adds the shard counts back into
+  ``ticket_types.sold_quantity`` and drops the shards; ``merge_closed()``
+  does that for every sharded type whose event has started.
+
+While sharded, ``TicketType.sold_quantity`` only holds the merged part; read
+``sold_total``/``available_quantity`` (``models.load_shard_sold`` loads the
+shard sums of many ticket types in one query).
+
+    flask --app eventapp inventory shard <ticket_type_id> --shards 16
+    flask --app eventapp inventory rebalance <ticket_type_id>
+    flask --app eventapp inventory merge <ticket_type_id>
+    flask --app eventapp inventory merge-closed
+"""
+import random
+from datetime import datetime
+
+import click
+from sqlalchemy import select
+from sqlalchemy.orm.util import identity_key
+
+from eventapp import counters, db
+from eventapp.models import Event, TicketType, TicketTypeShard
+
+
+class InventoryError(ValueError):
+    """Not enough capacity left, or the ticket type is not in the expected mode"""
+
+
+def _locked_shards(ticket_type_id):
+    return (TicketTypeShard.query.filter_by(ticket_type_id=ticket_type_id)
+            .order_by(TicketTypeShard.shard_no).with_for_update().all())
+
+
+def _split(total, parts):
+    base, extra = divmod(max(total, 0), parts)
+    return [base + (1 if i < extra else 0) for i in range(parts)]
+
+
+def _forget_cached_sum(ticket_type_id):
+    ticket_type = db.session.identity_map.get(identity_key(TicketType, ticket_type_id))
+    if ticket_type is not None:
+        ticket_type._shard_sold = None
+
+
+def enable(ticket_type, shards):
+    """Switch a ticket type to sharded counting over ``shards`` rows"""
+    if shards < 1:
+        raise InventoryError('Số shard phải lớn hơn 0.')
+    ticket_type = TicketType.query.filter_by(id=ticket_type.id).with_for_update().one()
+    if ticket_type.shard_count:
+        raise InventoryError(f'Loại vé {ticket_type.id} đã được chia shard.')
+    capacities = _split(ticket_type.total_quantity - ticket_type.sold_quantity, shards)
+    db.session.add_all(TicketTypeShard(ticket_type_id=ticket_type.id, shard_no=i, capacity=capacity, sold_quantity=0)
+                       for i, capacity in enumerate(capacities))
+    ticket_type.shard_count = shards
+    db.session.commit()
+    return ticket_type
+
+
+def take(ticket_type_id, quantity):
+    """Count ``quantity`` sold tickets on the shards of a ticket type (caller's transaction).
+
+    Raises InventoryError when the shards together do not have ``quantity``
+    left; the shards already updated are undone by the caller's rollback."""
+    rows = db.session.execute(
+        select(TicketTypeShard.id, TicketTypeShard.capacity - TicketTypeShard.sold_quantity)
+        .where(TicketTypeShard.ticket_type_id == ticket_type_id)
+    ).all()
+    random.shuffle(rows)
+    # Shards that can take the whole order first (in random order), the rest as fallback
+    rows.sort(key=lambda row: row[1] < quantity)
+    remaining = quantity
+    for shard_id, left in rows:
+        amount = min(left, remaining)
+        if amount <= 0:
+            continue
+        if counters.increment(TicketTypeShard.sold_quantity, {shard_id: amount},
+                              where=(TicketTypeShard.sold_quantity + amount <= TicketTypeShard.capacity,)):
+            remaining -= amount
+            if not remaining:
+                break
+    _forget_cached_sum(ticket_type_id)
+    if remaining:
+        raise InventoryError(f'Không đủ vé cho loại vé {ticket_type_id}.')
+
+
+def rebalance(ticket_type):
+    """Spread the unsold capacity evenly over the shards again"""
+    shards = _locked_shards(ticket_type.id)
+    if not shards:
+        raise InventoryError(f'Loại vé {ticket_type.id} chưa được chia shard.')
+    unsold = ticket_type.total_quantity - ticket_type.sold_quantity - sum(shard.sold_quantity for shard in shards)
+    for shard, share in zip(shards, _split(unsold, len(shards))):
+        shard.capacity = shard.sold_quantity + share
+    db.session.commit()
+    _forget_cached_sum(ticket_type.id)
+    return shards
+
+
+def merge(ticket_type):
+    """Fold the shard counts into ticket_types.sold_quantity and switch sharding off"""
+    shards = _locked_shards(ticket_type.id)
+    counters.increment(TicketType.sold_quantity, {ticket_type.id: sum(shard.sold_quantity for shard in shards)},
+                       values={'shard_count': 0})
+    for shard in shards:
+        db.session.delete(shard)
+    db.session.commit()
+    _forget_cached_sum(ticket_type.id)
+    return ticket_type
+
+
+def merge_closed(now=None):
+    """Merge the shards of every ticket type whose event has started (sales are closed)"""
+    ticket_types = (TicketType.query.join(Event)
+                    .filter(TicketType.shard_count > 0, Event.start_time <= (now or datetime.utcnow())).all())
+    for ticket_type in ticket_types:
+        merge(ticket_type)
+    return len(ticket_types)
+
+
+def init_app(app):
+    @app.cli.group('inventory')
+    def inventory_command():
+        """Sharded ticket counters."""
+
+    def get_ticket_type(ticket_type_id):
+        ticket_type = db.session.get(TicketType, ticket_type_id)
+        if ticket_type is None:
+            raise click.ClickException(f'TicketType {ticket_type_id} not found')
+        return ticket_type
+
+    @inventory_command.command('shard')
+    @click.argument('ticket_type_id', type=int)
+    @click.option('--shards', default=8, show_default=True, help='Number of counter rows')
+    def shard_command(ticket_type_id, shards):
+        """Count sales of a ticket type on sharded rows."""
+        try:
+            enable(get_ticket_type(ticket_type_id), shards)
+        except InventoryError as e:
+            raise click.ClickException(str(e))
+        click.echo(f'TicketType {ticket_type_id} split over {shards} shards')
+
+    @inventory_command.command('rebalance')
+    @click.argument('ticket_type_id', type=int)
+    def rebalance_command(ticket_type_id):
+        """Spread the unsold capacity evenly over the shards."""
+        try:
+            shards = rebalance(get_ticket_type(ticket_type_id))
+        except InventoryError as e:
+            raise click.ClickException(str(e))
+        click.echo(', '.join(f'{shard.shard_no}: {shard.sold_quantity}/{shard.capacity}' for shard in shards))
+
+    @inventory_command.command('merge')
+    @click.argument('ticket_type_id', type=int)
+    def merge_command(ticket_type_id):
+        """Fold the shards back into ticket_types.sold_quantity."""
+        merge(get_ticket_type(ticket_type_id))
+        click.echo(f'TicketType {ticket_type_id} merged')
+
+    @inventory_command.command('merge-closed')
+    def merge_closed_command():
+        """Merge the shards of ticket types whose event has started."""
+        click.echo(f'{merge_closed()} ticket types merged')
@@ -0,0 +1,229 @@
+"""
+Structured, non-blocking application logging.
+
+Records are put on an in-memory queue by a ``QueueHandler`` on the root logger
+and written by a ``QueueListener`` thread, so a request never waits on
+stdout. Each line is a JSON object:
+
+    {"time": "...", "level": "INFO", "logger": "eventapp.booking", "message": "booking received",
+     "request_id": "3f2c...", "user_id": 42, "method": "POST", "path": "/booking/process",
+     "event_id": 7, "duration_ms": 18.4}
+
+* ``request_id`` comes from the ``X-Request-ID`` header (or is generated) and
+  is echoed on the response; ``user_id`` is the logged-in user, if any.
+  Anything passed in ``extra=`` (``event_id``, ``duration_ms``, ...) becomes a
+  field.
+* ``LOG_LEVEL`` sets the root level, ``LOG_LEVELS`` per-logger levels
+  (``eventapp.sql=WARNING,eventapp.checkin=DEBUG``).
+* ``LOG_SAMPLE_RATES`` keeps only a fraction of DEBUG records per logger
+  (``eventapp.checkin=0.05``); the longest matching logger prefix wins.
+* ``LOG_FORMAT=text`` writes readable lines instead of JSON (development).
+* Every finished request is logged on ``eventapp.request`` with its status and
+  duration.
+
+Request fields are captured by a filter on the ``QueueHandler``, i.e. in the
+thread that logged, because the listener thread has no request context.
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from flask import g, has_request_context, request
+
+request_logger = logging.getLogger('eventapp.request')
+
+# Attributes every LogRecord has; anything else on a record came from extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime', 'taskName'}
+
+
+def parse_mapping(value, convert=str):
+    """``'a=1, b=2'`` -> ``{'a': convert('1'), 'b': convert('2')}``"""
+    mapping = {}
+    for item in (value or '').split(','):
+        name, sep, setting = item.partition('=')
+        if sep and name.strip():
+            mapping[name.strip()] = convert(setting.strip())
+    return mapping
+
+
+class RequestContextFilter(logging.Filter):
+    """Copies request id, user id, method and path onto the record"""
+
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = g.get('request_id')
+            # Only read a user Flask-Login has already loaded; never trigger a load from a log call
+            user = g.get('_login_user')
+            record.user_id = user.get_id() if user is not None and user.is_authenticated else None
+            record.method = request.method
+            record.path = request.path
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a fraction of DEBUG records for the configured loggers"""
+
+    def __init__(self, rates, level=logging.DEBUG):
+        super().__init__()
+        self.rates = dict(rates)
+        self.level = level
+        # Longest prefix first so 'eventapp.checkin.gate' beats 'eventapp.checkin'
+        self._prefixes = sorted(self.rates, key=len, reverse=True)
+        self._cache = {}
+
+    def rate_for(self, name):
+        if name not in self._cache:
+            self._cache[name] = next(
+                (self.rates[prefix] for prefix in self._prefixes if name == prefix or name.startswith(prefix + '.')),
+                1.0,
+            )
+        return self._cache[name]
+
+    def filter(self, record):
+        if record.levelno > self.level:
+            return True
+        rate = self.rate_for(record.name)
+        return rate >= 1 or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, extras included as fields"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s')
+
+    def format(self, record):
+        if not hasattr(record, 'request_id'):
+            record.request_id = '-'
+        return super().format(record)
+
+
+class StdoutHandler(logging.StreamHandler):
+    """Writes to whatever ``sys.stdout`` is when a record is emitted, not the one at import time,
+    so ``contextlib.redirect_stdout`` and pytest's output capture still apply"""
+
+    def __init__(self):
+        super().__init__(sys.stdout)
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Keep the record structured: the base class would fold the traceback into the message
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class LogPipeline:
+    """Queue handler on the root logger plus the listener thread that drains it"""
+
+    def __init__(self):
+        self.queue = queue.SimpleQueue()
+        self.handler = None
+        self.outputs = ()
+        self.listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def configure(self, output_handler, root_level, levels, sample_rates):
+        self.stop()
+        root = logging.getLogger()
+        if self.handler is not None:
+            root.removeHandler(self.handler)
+        self.handler = _QueueHandler(self.queue)
+        self.handler.addFilter(RequestContextFilter())
+        if sample_rates:
+            self.handler.addFilter(SamplingFilter(sample_rates))
+        root.addHandler(self.handler)
+        root.setLevel(root_level)
+        for name, level in levels.items():
+            logging.getLogger(name).setLevel(level)
+        self.outputs = (output_handler,)
+        self.ensure_started()
+
+    def ensure_started(self):
+        """(Re)start the listener in this process; threads do not survive a gunicorn fork"""
+        if not self.outputs or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self.listener = logging.handlers.QueueListener(self.queue, *self.outputs, respect_handler_level=True)
+                self.listener.start()
+                self._pid = os.getpid()
+
+    def stop(self):
+        if self.listener is not None and self._pid == os.getpid():
+            self.listener.stop()
+        self._pid = None
+
+
+pipeline = LogPipeline()
+atexit.register(pipeline.stop)
+
+
+def init_app(app):
+    app.config.setdefault('LOG_LEVEL', 'INFO')
+    app.config.setdefault('LOG_LEVELS', {})
+    app.config.setdefault('LOG_SAMPLE_RATES', {})
+    app.config.setdefault('LOG_FORMAT', 'json')
+
+    output = StdoutHandler()
+    output.setFormatter(TextFormatter() if app.config['LOG_FORMAT'] == 'text' else JsonFormatter())
+    pipeline.configure(output, app.config['LOG_LEVEL'], app.config['LOG_LEVELS'], app.config['LOG_SAMPLE_RATES'])
+
+    @app.before_request
+    def start_request_log():
+        pipeline.ensure_started()
+        g.request_id = request.headers.get('X-Request-ID', '')[:64] or uuid.uuid4().hex
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def finish_request_log(response):
+        response.headers.setdefault('X-Request-ID', g.get('request_id', ''))
+        started = g.get('request_started')
+        if started is not None and request_logger.isEnabledFor(logging.INFO):
+            duration_ms = round((time.perf_counter() - started) * 1000, 2)
+            request_logger.info('%s %s %s %.1f ms', request.method, request.path, response.status_code, duration_ms,
+                                extra={'route': request.endpoint, 'status': response.status_code,
+                                       'duration_ms': duration_ms})
+        return response
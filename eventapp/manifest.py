@@ -0,0 +1,159 @@
+"""
+Compact, signed ticket manifests for offline gate scanners.
+
+A manifest is a flat binary blob (big-endian) so scanners can keep it in
+memory and look tickets up with a binary search instead of a network call:
+
+    magic       4s   b'EHM2'
+    event_id    I
+    generated   d    UTC unix timestamp of the snapshot (next delta cursor)
+    since       d    0 for a full manifest, otherwise the delta cursor used
+    n_valid     I
+    n_checked   I
+    valid       n_valid   * 16 bytes, sorted uuid bytes (paid, not checked in)
+    checked     n_checked * 16 bytes, sorted uuid bytes (already checked in)
+    signature   64 bytes Ed25519 signature over everything above
+
+The server signs with the private key in ``GATE_MANIFEST_SIGNING_KEY``;
+scanners only ever hold the public key (``/staff/gate/manifest-key``), so a
+lost device cannot be used to forge manifests.
+Create a key pair with ``flask --app eventapp gate-manifest keygen``.
+"""
+import base64
+import struct
+import uuid
+from calendar import timegm
+from datetime import datetime
+from functools import lru_cache
+
+import click
+
+MAGIC = b'EHM2'
+HEADER = struct.Struct('>4sIddII')
+RECORD_SIZE = 16
+SIGNATURE_SIZE = 64
+
+
+def to_timestamp(value):
+    """Convert a naive UTC datetime to a unix timestamp"""
+    if value is None:
+        return 0.0
+    return timegm(value.utctimetuple()) + value.microsecond / 1e6
+
+
+def from_timestamp(value):
+    """Convert a unix timestamp back to a naive UTC datetime"""
+    if not value:
+        return None
+    return datetime.utcfromtimestamp(float(value))
+
+
+def _pack_uuids(uuids):
+    return b''.join(sorted(uuid.UUID(str(u)).bytes for u in uuids))
+
+
+@lru_cache(maxsize=4)
+def load_signing_key(value):
+    """Ed25519 private key from its base64 raw form, or None when no key is configured"""
+    if not value:
+        return None
+    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+    return Ed25519PrivateKey.from_private_bytes(base64.b64decode(value))
+
+
+def public_key(signing_key):
+    """Base64 raw public key handed to scanners"""
+    from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+    raw = signing_key.public_key().public_bytes(Encoding.Raw, PublicFormat.Raw)
+    return base64.b64encode(raw).decode('ascii')
+
+
+def generate_signing_key():
+    """New base64 raw Ed25519 private key for GATE_MANIFEST_SIGNING_KEY"""
+    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+    from cryptography.hazmat.primitives.serialization import Encoding, NoEncryption, PrivateFormat
+    raw = Ed25519PrivateKey.generate().private_bytes(Encoding.Raw, PrivateFormat.Raw, NoEncryption())
+    return base64.b64encode(raw).decode('ascii')
+
+
+def encode_manifest(event_id, valid_uuids, checked_uuids, signing_key, generated_at, since=None):
+    """Build a signed manifest blob for an event"""
+    valid = _pack_uuids(valid_uuids)
+    checked = _pack_uuids(checked_uuids)
+    header = HEADER.pack(
+        MAGIC,
+        event_id,
+        to_timestamp(generated_at),
+        to_timestamp(since),
+        len(valid) // RECORD_SIZE,
+        len(checked) // RECORD_SIZE
+    )
+    payload = header + valid + checked
+    return payload + signing_key.sign(payload)
+
+
+def decode_manifest(data, verify_key):
+    """Verify (with the base64 public key) and unpack a manifest blob, raising ValueError if it was tampered with"""
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PublicKey
+    if len(data) < HEADER.size + SIGNATURE_SIZE:
+        raise ValueError('Manifest is truncated')
+    payload, signature = data[:-SIGNATURE_SIZE], data[-SIGNATURE_SIZE:]
+    try:
+        Ed25519PublicKey.from_public_bytes(base64.b64decode(verify_key)).verify(signature, payload)
+    except InvalidSignature:
+        raise ValueError('Invalid manifest signature')
+
+    magic, event_id, generated, since, n_valid, n_checked = HEADER.unpack_from(payload)
+    if magic != MAGIC:
+        raise ValueError('Unknown manifest format')
+    expected = HEADER.size + (n_valid + n_checked) * RECORD_SIZE
+    if len(payload) != expected:
+        raise ValueError('Manifest size does not match its header')
+
+    valid_end = HEADER.size + n_valid * RECORD_SIZE
+    return {
+        'event_id': event_id,
+        'generated_at': from_timestamp(generated),
+        'since': from_timestamp(since),
+        'valid': payload[HEADER.size:valid_end],
+        'checked': payload[valid_end:expected],
+    }
+
+
+def contains(records, ticket_uuid):
+    """Binary search a sorted block of 16-byte uuid records"""
+    try:
+        needle = uuid.UUID(str(ticket_uuid)).bytes
+    except ValueError:
+        return False
+    lo, hi = 0, len(records) // RECORD_SIZE
+    while lo < hi:
+        mid = (lo + hi) // 2
+        current = records[mid * RECORD_SIZE:(mid + 1) * RECORD_SIZE]
+        if current < needle:
+            lo = mid + 1
+        elif current > needle:
+            hi = mid
+        else:
+            return True
+    return False
+
+
+def iter_uuids(records):
+    """Yield uuid strings from a block of 16-byte records"""
+    for offset in range(0, len(records), RECORD_SIZE):
+        yield str(uuid.UUID(bytes=bytes(records[offset:offset + RECORD_SIZE])))
+
+
+def init_app(app):
+    @app.cli.group('gate-manifest')
+    def gate_manifest_command():
+        """Signing keys for offline gate manifests."""
+
+    @gate_manifest_command.command('keygen')
+    def keygen_command():
+        """Print a new GATE_MANIFEST_SIGNING_KEY and the public key scanners verify with."""
+        key = generate_signing_key()
+        click.echo(f'GATE_MANIFEST_SIGNING_KEY={key}')
+        click.echo(f'public key: {public_key(load_signing_key(key))}')
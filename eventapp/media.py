@@ -0,0 +1,74 @@
+"""
+Memoized Cloudinary delivery URLs for posters, avatars and QR codes.
+
+Building a URL with ``CloudinaryImage(...).build_url(...)`` normalises the
+transformation options and formats the URL (and signs it when signed delivery
+is enabled) on every call. List pages render the same images over and over,
+so URLs are cached per ``(public_id, transformation)`` in a bounded LRU.
+
+Transformations are named presets; their option tuples are computed once so
+cache keys are cheap to hash. Templates use the ``image_url`` global.
+
+Images stored by the local filesystem backend (see ``eventapp.uploads``) have
+ids prefixed with ``local/`` and are served by the app under ``/media/``.
+
+The cloudinary SDK is imported on first use through ``cloudinary_sdk()``,
+which also applies the ``CLOUDINARY_*`` credentials from the environment.
+"""
+import os
+from functools import lru_cache
+
+PRESETS = {
+    'original': {},
+    'avatar': {'width': 200, 'height': 200, 'crop': 'fill', 'gravity': 'face'},
+    'avatar_thumbnail': {'width': 100, 'height': 100, 'crop': 'fill', 'gravity': 'face'},
+    'poster': {'width': 800, 'height': 600, 'crop': 'fill'},
+    'poster_thumbnail': {'width': 300, 'height': 200, 'crop': 'fill'},
+    'qr': {'width': 300, 'height': 300, 'crop': 'fit'},
+}
+
+LOCAL_PREFIX = 'local/'
+LOCAL_URL_PREFIX = '/media/'
+
+_TRANSFORMATIONS = {name: tuple(sorted(options.items())) for name, options in PRESETS.items()}
+
+_sdk_configured = False
+
+
+def cloudinary_sdk():
+    """The ``cloudinary`` package (with ``uploader``), configured on first call"""
+    global _sdk_configured
+    import cloudinary
+    import cloudinary.uploader
+    if not _sdk_configured:
+        settings = {
+            'cloud_name': os.getenv('CLOUDINARY_CLOUD_NAME'),
+            'api_key': os.getenv('CLOUDINARY_API_KEY'),
+            'api_secret': os.getenv('CLOUDINARY_API_SECRET'),
+        }
+        cloudinary.config(**{key: value for key, value in settings.items() if value})
+        _sdk_configured = True
+    return cloudinary
+
+
+@lru_cache(maxsize=int(os.getenv('MEDIA_URL_CACHE_SIZE', 4096)))
+def _build_url(public_id, transformation):
+    if public_id.startswith(LOCAL_PREFIX):
+        return LOCAL_URL_PREFIX + public_id[len(LOCAL_PREFIX):]
+    return cloudinary_sdk().CloudinaryImage(public_id).build_url(**dict(transformation))
+
+
+def image_url(public_id, preset='original'):
+    """Delivery URL for a stored image, or None when there is no image"""
+    if not public_id:
+        return None
+    return _build_url(public_id, _TRANSFORMATIONS[preset])
+
+
+def url_cache_info():
+    return _build_url.cache_info()
+
+
+def clear_url_cache():
+    """Drop cached URLs, e.g. after changing the Cloudinary configuration"""
+    _build_url.cache_clear()
@@ -0,0 +1,69 @@
+"""
+Prometheus metrics for the ticketing funnel, exposed on ``/metrics``.
+
+    booking          eventapp_bookings_total{payment_method,outcome}, eventapp_booking_seconds
+    payment callback eventapp_payment_callbacks_total{result}, eventapp_payment_callback_seconds
+    QR codes         eventapp_qr_codes_total{result}, eventapp_qr_generation_seconds
+    ticket e-mails   eventapp_ticket_emails_total{result}, eventapp_ticket_email_seconds
+    check-in         eventapp_checkins_total{result}, eventapp_checkin_seconds
+    hold cleanup     eventapp_unpaid_tickets_released_total, eventapp_cleanup_seconds
+
+gunicorn workers are separate processes, so in production every worker writes
+its samples to files in ``PROMETHEUS_MULTIPROC_DIR`` (set up by
+``gunicorn.conf.py``) and ``/metrics`` merges them. The variable must be set
+before ``prometheus_client`` is imported; without it the metrics are kept in
+process memory (development, tests).
+"""
+import os
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+
+# Calls to external services (Cloudinary, SMTP, VNPay round trip) take longer than a page render
+EXTERNAL_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+bookings = Counter('eventapp_bookings', 'Booking requests by payment method and outcome',
+                   ['payment_method', 'outcome'])
+booking_seconds = Histogram('eventapp_booking_seconds', 'Time to process a booking request')
+
+payment_callbacks = Counter('eventapp_payment_callbacks', 'VNPay return callbacks by result', ['result'])
+payment_callback_seconds = Histogram('eventapp_payment_callback_seconds', 'Time to process a VNPay callback',
+                                     buckets=EXTERNAL_BUCKETS)
+
+qr_codes = Counter('eventapp_qr_codes', 'Ticket QR code generations by result', ['result'])
+qr_generation_seconds = Histogram('eventapp_qr_generation_seconds', 'Time to render and upload a QR code',
+                                  buckets=EXTERNAL_BUCKETS)
+
+ticket_emails = Counter('eventapp_ticket_emails', 'Ticket e-mails by result', ['result'])
+ticket_email_seconds = Histogram('eventapp_ticket_email_seconds', 'Time to send a ticket e-mail',
+                                 buckets=EXTERNAL_BUCKETS)
+
+checkins = Counter('eventapp_checkins', 'Ticket scans by result', ['result'])
+checkin_seconds = Histogram('eventapp_checkin_seconds', 'Time to process a single ticket scan')
+
+unpaid_tickets_released = Counter('eventapp_unpaid_tickets_released', 'Expired unpaid ticket holds deleted')
+cleanup_seconds = Histogram('eventapp_cleanup_seconds', 'Time to clean up expired unpaid tickets')
+
+
+@contextmanager
+def track(histogram, counter):
+    """Time the block and count it as ``result="ok"`` or ``result="error"``;
+    also usable as a decorator"""
+    with histogram.time():
+        try:
+            yield
+        except Exception:
+            counter.labels(result='error').inc()
+            raise
+    counter.labels(result='ok').inc()
+
+
+def render():
+    """Body and content type for the ``/metrics`` endpoint"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
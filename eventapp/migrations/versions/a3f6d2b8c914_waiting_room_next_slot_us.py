@@ -0,0 +1,29 @@
+"""waiting room next slot in microseconds
+
+Revision ID: a3f6d2b8c914
+Revises: e58a0c3d7b62
+Create Date: 2026-10-19 21:12:40.318207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3f6d2b8c914'
+down_revision = 'e58a0c3d7b62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Open rooms restart their slot sequence at the next arrival
+    with op.batch_alter_table('waiting_rooms', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('next_slot_us', sa.BigInteger(), nullable=True))
+        batch_op.drop_column('next_slot_at')
+
+
+def downgrade():
+    with op.batch_alter_table('waiting_rooms', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('next_slot_at', sa.DateTime(), nullable=True))
+        batch_op.drop_column('next_slot_us')
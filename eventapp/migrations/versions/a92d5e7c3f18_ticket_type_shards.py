@@ -0,0 +1,39 @@
+"""ticket type shards
+
+Revision ID: a92d5e7c3f18
+Revises: f4b8c2d6e913
+Create Date: 2026-10-19 17:41:26.119804
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a92d5e7c3f18'
+down_revision = 'f4b8c2d6e913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('ticket_types', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('shard_count', sa.Integer(), nullable=False, server_default='0'))
+
+    op.create_table('ticket_type_shards',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('ticket_type_id', sa.Integer(), nullable=False),
+    sa.Column('shard_no', sa.Integer(), nullable=False),
+    sa.Column('capacity', sa.Integer(), nullable=False),
+    sa.Column('sold_quantity', sa.Integer(), nullable=False),
+    sa.CheckConstraint('sold_quantity <= capacity', name='shard_sold_not_exceed_capacity'),
+    sa.ForeignKeyConstraint(['ticket_type_id'], ['ticket_types.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('ticket_type_id', 'shard_no', name='uq_ticket_type_shard')
+    )
+
+
+def downgrade():
+    op.drop_table('ticket_type_shards')
+    with op.batch_alter_table('ticket_types', schema=None) as batch_op:
+        batch_op.drop_column('shard_count')
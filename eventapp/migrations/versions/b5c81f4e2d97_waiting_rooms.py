@@ -0,0 +1,51 @@
+"""waiting rooms
+
+Revision ID: b5c81f4e2d97
+Revises: a92d5e7c3f18
+Create Date: 2026-10-19 18:27:53.640912
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5c81f4e2d97'
+down_revision = 'a92d5e7c3f18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('waiting_rooms',
+    sa.Column('event_id', sa.Integer(), nullable=False),
+    sa.Column('rate_per_minute', sa.Integer(), nullable=False),
+    sa.Column('is_open', sa.Boolean(), nullable=False),
+    sa.Column('next_slot_at', sa.DateTime(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.CheckConstraint('rate_per_minute > 0', name='waiting_room_rate_positive'),
+    sa.ForeignKeyConstraint(['event_id'], ['events.id'], ),
+    sa.PrimaryKeyConstraint('event_id')
+    )
+    op.create_table('waiting_room_entries',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('event_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('admit_at', sa.DateTime(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['event_id'], ['events.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('event_id', 'user_id', name='uq_waiting_room_entry')
+    )
+    with op.batch_alter_table('waiting_room_entries', schema=None) as batch_op:
+        batch_op.create_index('ix_waiting_room_entry_event_admit', ['event_id', 'admit_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('waiting_room_entries', schema=None) as batch_op:
+        batch_op.drop_index('ix_waiting_room_entry_event_admit')
+
+    op.drop_table('waiting_room_entries')
+    op.drop_table('waiting_rooms')
@@ -0,0 +1,36 @@
+"""ticket hot path indexes
+
+Revision ID: c3a9d41f7b20
+Revises: b646ed0e13e5
+Create Date: 2026-10-19 09:12:40.118532
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3a9d41f7b20'
+down_revision = 'b646ed0e13e5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('tickets', schema=None) as batch_op:
+        batch_op.create_index('ix_ticket_payment_user_paid', ['payment_id', 'user_id', 'is_paid'], unique=False)
+        batch_op.create_index('ix_ticket_unpaid_hold', ['created_at'], unique=False,
+                              postgresql_where=sa.text('is_paid = false AND purchase_date IS NULL'),
+                              sqlite_where=sa.text('is_paid = 0 AND purchase_date IS NULL'))
+        batch_op.create_index('ix_ticket_user_paid_purchase', ['user_id', 'purchase_date'], unique=False,
+                              postgresql_where=sa.text('is_paid = true'),
+                              sqlite_where=sa.text('is_paid = 1'))
+        batch_op.create_index('ix_ticket_event_checkin', ['event_id', 'check_in_date'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('tickets', schema=None) as batch_op:
+        batch_op.drop_index('ix_ticket_event_checkin')
+        batch_op.drop_index('ix_ticket_user_paid_purchase')
+        batch_op.drop_index('ix_ticket_unpaid_hold')
+        batch_op.drop_index('ix_ticket_payment_user_paid')
@@ -0,0 +1,29 @@
+"""rate limit counters
+
+Revision ID: d13f6b8a2c45
+Revises: c7e24a9b6f31
+Create Date: 2026-10-19 19:58:40.913377
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd13f6b8a2c45'
+down_revision = 'c7e24a9b6f31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('rate_limit_counters',
+    sa.Column('key', sa.String(length=200), nullable=False),
+    sa.Column('window_start', sa.Integer(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('key', 'window_start')
+    )
+
+
+def downgrade():
+    op.drop_table('rate_limit_counters')
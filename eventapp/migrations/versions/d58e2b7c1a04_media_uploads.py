@@ -0,0 +1,48 @@
+"""media uploads queue
+
+Revision ID: d58e2b7c1a04
+Revises: c3a9d41f7b20
+Create Date: 2026-10-19 11:02:17.402913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd58e2b7c1a04'
+down_revision = 'c3a9d41f7b20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('media_uploads',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=30), nullable=False),
+    sa.Column('target_id', sa.Integer(), nullable=False),
+    sa.Column('staged_path', sa.String(length=500), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('public_id', sa.String(length=255), nullable=True),
+    sa.Column('replaced_public_id', sa.String(length=255), nullable=True),
+    sa.Column('delete_after', sa.DateTime(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('media_uploads', schema=None) as batch_op:
+        batch_op.create_index('ix_media_upload_delete_after', ['delete_after'], unique=False)
+        batch_op.create_index('ix_media_upload_status_next', ['status', 'next_attempt_at'], unique=False)
+        batch_op.create_index('ix_media_upload_target', ['kind', 'target_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('media_uploads', schema=None) as batch_op:
+        batch_op.drop_index('ix_media_upload_target')
+        batch_op.drop_index('ix_media_upload_status_next')
+        batch_op.drop_index('ix_media_upload_delete_after')
+
+    op.drop_table('media_uploads')
@@ -0,0 +1,46 @@
+"""waitlist entries
+
+Revision ID: e58a0c3d7b62
+Revises: d13f6b8a2c45
+Create Date: 2026-10-19 20:46:15.502318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e58a0c3d7b62'
+down_revision = 'd13f6b8a2c45'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('waitlist_entries',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('ticket_type_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('queued_at', sa.DateTime(), nullable=False),
+    sa.Column('offered_at', sa.DateTime(), nullable=True),
+    sa.Column('offer_expires_at', sa.DateTime(), nullable=True),
+    sa.Column('claimed_at', sa.DateTime(), nullable=True),
+    sa.CheckConstraint('quantity > 0', name='waitlist_quantity_positive'),
+    sa.ForeignKeyConstraint(['ticket_type_id'], ['ticket_types.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('ticket_type_id', 'user_id', name='uq_waitlist_ticket_type_user')
+    )
+    with op.batch_alter_table('waitlist_entries', schema=None) as batch_op:
+        batch_op.create_index('ix_waitlist_type_status_queued', ['ticket_type_id', 'status', 'queued_at'], unique=False)
+        batch_op.create_index('ix_waitlist_status_expires', ['status', 'offer_expires_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('waitlist_entries', schema=None) as batch_op:
+        batch_op.drop_index('ix_waitlist_status_expires')
+        batch_op.drop_index('ix_waitlist_type_status_queued')
+
+    op.drop_table('waitlist_entries')
@@ -0,0 +1,26 @@
+"""event poster variants
+
+Revision ID: e7f3a1c9b852
+Revises: d58e2b7c1a04
+Create Date: 2026-10-19 13:25:48.551207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7f3a1c9b852'
+down_revision = 'd58e2b7c1a04'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('events', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('poster_variants', sa.String(length=100), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('events', schema=None) as batch_op:
+        batch_op.drop_column('poster_variants')
@@ -0,0 +1,45 @@
+"""user customer group
+
+Revision ID: f4b8c2d6e913
+Revises: e7f3a1c9b852
+Create Date: 2026-10-19 16:02:11.408317
+
+"""
+from datetime import datetime, timedelta
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4b8c2d6e913'
+down_revision = 'e7f3a1c9b852'
+branch_labels = None
+depends_on = None
+
+# Kiểu enum 'customergroup' đã có từ bảng discount_codes
+customer_group = sa.Enum('new', 'regular', 'vip', 'super_vip', name='customergroup')
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('customer_group', customer_group, nullable=False, server_default='new'))
+        batch_op.create_index(batch_op.f('ix_users_customer_group'), ['customer_group'], unique=False)
+
+    # Xếp nhóm lần đầu cho user hiện có (cùng quy tắc với models.customer_group_for)
+    users = sa.table('users', sa.column('created_at', sa.DateTime), sa.column('total_spent', sa.Numeric(12, 2)),
+                     sa.column('customer_group', customer_group))
+    spent = sa.func.coalesce(users.c.total_spent, 0)
+    new_since = datetime.utcnow() - timedelta(days=7)
+    op.execute(users.update().values(customer_group=sa.case(
+        (sa.or_(users.c.created_at.is_(None), users.c.created_at >= new_since), 'new'),
+        (spent < 500000, 'regular'),
+        (spent < 2000000, 'vip'),
+        else_='super_vip',
+    )))
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_users_customer_group'))
+        batch_op.drop_column('customer_group')
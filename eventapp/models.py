@@ -1,14 +1,14 @@
 from datetime import datetime, timedelta
 from flask_login import UserMixin
 from sqlalchemy.orm import relationship
-from sqlalchemy import CheckConstraint, Index
+from sqlalchemy import CheckConstraint, Index, event
 import enum
 import uuid
 import math
-from eventapp import db
-import cloudinary
-import cloudinary.uploader
-from cloudinary import CloudinaryImage
+import logging
+from eventapp import db, media, metrics, uploads
+
+logger = logging.getLogger('eventapp.models')
 
 # User roles enum
 class UserRole(enum.Enum):
@@ -24,6 +24,23 @@ class CustomerGroup(enum.Enum):
     vip = 'vip'
     super_vip = 'super_vip'
 
+# Khách hàng mới trong NEW_CUSTOMER_DAYS ngày đầu, sau đó xếp nhóm theo total_spent (mức trên, không tính)
+NEW_CUSTOMER_DAYS = 7
+CUSTOMER_GROUP_THRESHOLDS = (
+    (500000, CustomerGroup.regular),    # < 500k
+    (2000000, CustomerGroup.vip),       # 500k - 2M
+)
+
+def customer_group_for(total_spent, created_at, now=None):
+    """Nhóm khách hàng theo tổng chi tiêu và tuổi tài khoản (nguồn duy nhất của quy tắc xếp nhóm)"""
+    now = now or datetime.utcnow()
+    if created_at is None or (now - created_at) <= timedelta(days=NEW_CUSTOMER_DAYS):
+        return CustomerGroup.new
+    for limit, group in CUSTOMER_GROUP_THRESHOLDS:
+        if (total_spent or 0) < limit:
+            return group
+    return CustomerGroup.super_vip
+
 # Association table for event-staff (many-to-many)
 event_staff = db.Table('event_staff',
     db.Column('event_id', db.Integer, db.ForeignKey('events.id'), primary_key=True),
@@ -44,6 +61,8 @@ class User(db.Model, UserMixin):
     avatar = db.Column(db.String(255), nullable=True)
 
     total_spent = db.Column(db.Numeric(12, 2), default=0)
+    # Nhóm khách hàng lưu sẵn: cập nhật khi thanh toán và bởi job `flask refresh-customer-groups`
+    customer_group = db.Column(db.Enum(CustomerGroup), default=CustomerGroup.new, nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     is_active = db.Column(db.Boolean, default=True, nullable=False)
@@ -73,65 +92,39 @@ class User(db.Model, UserMixin):
     def avatar_url(self):
         """Get avatar URL with default transformations"""
         if self.avatar:
-            return CloudinaryImage(self.avatar).build_url(
-                width=200, height=200, crop="fill", gravity="face"
-            )
+            return media.image_url(self.avatar, 'avatar')
         return None
 
     @property
     def avatar_thumbnail_url(self):
         """Get avatar thumbnail URL"""
         if self.avatar:
-            return CloudinaryImage(self.avatar).build_url(
-                width=100, height=100, crop="fill", gravity="face"
-            )
+            return media.image_url(self.avatar, 'avatar_thumbnail')
         return None
 
     def upload_avatar(self, file):
-        """Upload avatar file to Cloudinary"""
-        try:
-            # Delete old avatar if exists
-            if self.avatar:
-                cloudinary.uploader.destroy(self.avatar)
-            
-            # Upload new avatar
-            result = cloudinary.uploader.upload(
-                file,
-                folder='online-event-ticketing-system/users/avatars',
-                public_id=f"user_{self.id}_{uuid.uuid4().hex[:8]}",
-                overwrite=True,
-                resource_type='image'
-            )
-            
-            # Lưu public_id vào database
-            self.avatar = result['public_id']
-            return result
-        except Exception as e:
-            print(f"Error uploading avatar: {e}")
-            return None
+        """Stage an avatar upload; the worker swaps it in once stored"""
+        return uploads.enqueue('user_avatar', self, file)
 
     def delete_avatar(self):
-        """Delete avatar from Cloudinary"""
+        """Delete avatar from storage"""
         if self.avatar:
             try:
-                result = cloudinary.uploader.destroy(self.avatar)
+                result = uploads.storage_for(self.avatar).delete(self.avatar)
                 self.avatar = None
                 return result
             except Exception as e:
-                print(f"Error deleting avatar: {e}")
+                logger.warning('Error deleting avatar of user %s: %s', self.id, e)
                 return None
     
     def get_customer_group(self):
-        """Determine user group based on total_spent and account age"""
-        now = datetime.utcnow()
-        if (now - self.created_at) <= timedelta(days=7):
-            return CustomerGroup.new
-        elif self.total_spent < 500000:  # < 500k
-            return CustomerGroup.regular
-        elif self.total_spent < 2000000:  # 500k - 2M
-            return CustomerGroup.vip
-        else:  # >= 2M
-            return CustomerGroup.super_vip
+        """Stored customer group (see customer_group_for)"""
+        return self.customer_group or customer_group_for(self.total_spent, self.created_at)
+
+    def refresh_customer_group(self, now=None):
+        """Recompute the stored customer group, e.g. after total_spent changed"""
+        self.customer_group = customer_group_for(self.total_spent, self.created_at, now)
+        return self.customer_group
 
     def get_unread_notifications(self):
         """Get all unread notifications for this user"""
@@ -170,6 +163,7 @@ class Event(db.Model):
 
     # Chỉ lưu public_id dưới dạng string
     poster = db.Column(db.String(255), nullable=True)
+    poster_variants = db.Column(db.String(100), nullable=True)  # "<content hash>:<formats>:<source width>", xem eventapp.variants
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -197,52 +191,30 @@ class Event(db.Model):
     def poster_url(self):
         """Get poster URL"""
         if self.poster:
-            return CloudinaryImage(self.poster).build_url(
-                width=800, height=600, crop="fill"
-            )
+            return media.image_url(self.poster, 'poster')
         return None
 
     @property
     def poster_thumbnail_url(self):
         """Get poster thumbnail URL"""
         if self.poster:
-            return CloudinaryImage(self.poster).build_url(
-                width=300, height=200, crop="fill"
-            )
+            return media.image_url(self.poster, 'poster_thumbnail')
         return None
 
     def upload_poster(self, file):
-        """Upload poster file to Cloudinary"""
-        try:
-            # Delete old poster if exists
-            if self.poster:
-                cloudinary.uploader.destroy(self.poster)
-            
-            # Upload new poster
-            result = cloudinary.uploader.upload(
-                file,
-                folder='online-event-ticketing-system/events/posters',
-                public_id=f"event_{self.id}_{uuid.uuid4().hex[:8]}",
-                overwrite=True,
-                resource_type='image'
-            )
-            
-            # Lưu public_id vào database
-            self.poster = result['public_id']
-            return result
-        except Exception as e:
-            print(f"Error uploading poster: {e}")
-            return None
+        """Stage a poster upload; the worker swaps it in once stored"""
+        return uploads.enqueue('event_poster', self, file)
 
     def delete_poster(self):
-        """Delete poster from Cloudinary"""
+        """Delete poster from storage"""
         if self.poster:
             try:
-                result = cloudinary.uploader.destroy(self.poster)
+                result = uploads.storage_for(self.poster).delete(self.poster)
                 self.poster = None
+                self.poster_variants = None
                 return result
             except Exception as e:
-                print(f"Error deleting poster: {e}")
+                logger.warning('Error deleting poster of event %s: %s', self.id, e, extra={'event_id': self.id})
                 return None
 
     @property
@@ -253,7 +225,8 @@ class Event(db.Model):
     @property
     def sold_tickets(self):
         """Calculate total sold tickets from all ticket types"""
-        return sum(tt.sold_quantity for tt in self.ticket_types)
+        load_shard_sold(self.ticket_types)
+        return sum(tt.sold_total for tt in self.ticket_types)
 
     @property
     def available_tickets(self):
@@ -279,7 +252,8 @@ class Event(db.Model):
     @property
     def revenue(self):
         """Calculate total revenue from sold tickets"""
-        return sum(tt.sold_quantity * tt.price for tt in self.ticket_types)
+        load_shard_sold(self.ticket_types)
+        return sum(tt.sold_total * tt.price for tt in self.ticket_types)
 
     @property 
     def is_upcoming(self):
@@ -312,6 +286,9 @@ class TicketType(db.Model):
     total_quantity = db.Column(db.Integer, nullable=False)
     sold_quantity = db.Column(db.Integer, default=0, nullable=False)
     is_active = db.Column(db.Boolean, default=True, nullable=False)
+    # > 0: vé bán ra được đếm trên shard_count dòng ticket_type_shards (xem inventory.py), sold_quantity
+    # chỉ giữ phần đã gộp; 0 = đếm trực tiếp trên sold_quantity
+    shard_count = db.Column(db.Integer, default=0, nullable=False)
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -319,6 +296,8 @@ class TicketType(db.Model):
     # Relationships
     event = relationship('Event', back_populates='ticket_types')
     tickets = relationship('Ticket', back_populates='ticket_type', lazy='dynamic')
+    shards = relationship('TicketTypeShard', back_populates='ticket_type', cascade='all, delete-orphan',
+                          order_by='TicketTypeShard.shard_no')
 
     __table_args__ = (
         CheckConstraint('sold_quantity <= total_quantity', name='sold_not_exceed_total'),
@@ -329,13 +308,53 @@ class TicketType(db.Model):
     def __repr__(self):
         return f'<TicketType {self.name} for Event {self.event_id}>'
 
+    @property
+    def sold_total(self):
+        """Sold tickets, including the sharded counters"""
+        if not self.shard_count:
+            return self.sold_quantity
+        if getattr(self, '_shard_sold', None) is None:
+            load_shard_sold([self])
+        return self.sold_quantity + self._shard_sold
+
     @property
     def available_quantity(self):
-        return self.total_quantity - self.sold_quantity
+        return self.total_quantity - self.sold_total
 
     @property
     def is_sold_out(self):
-        return self.sold_quantity >= self.total_quantity
+        return self.sold_total >= self.total_quantity
+
+class TicketTypeShard(db.Model):
+    """Một phần sức chứa của loại vé bán rất chạy; mỗi lượt bán chỉ khoá một dòng shard"""
+    __tablename__ = 'ticket_type_shards'
+
+    id = db.Column(db.Integer, primary_key=True)
+    ticket_type_id = db.Column(db.Integer, db.ForeignKey('ticket_types.id'), nullable=False)
+    shard_no = db.Column(db.Integer, nullable=False)
+    capacity = db.Column(db.Integer, nullable=False)
+    sold_quantity = db.Column(db.Integer, default=0, nullable=False)
+
+    ticket_type = relationship('TicketType', back_populates='shards')
+
+    __table_args__ = (
+        CheckConstraint('sold_quantity <= capacity', name='shard_sold_not_exceed_capacity'),
+        db.UniqueConstraint('ticket_type_id', 'shard_no', name='uq_ticket_type_shard'),
+    )
+
+    def __repr__(self):
+        return f'<TicketTypeShard {self.shard_no} of TicketType {self.ticket_type_id}>'
+
+def load_shard_sold(ticket_types):
+    """Sum the shard counters of the sharded ticket types with one query (cached on each instance)"""
+    sharded = {tt.id: tt for tt in ticket_types if tt.shard_count}
+    if not sharded:
+        return
+    totals = dict(db.session.query(TicketTypeShard.ticket_type_id, db.func.sum(TicketTypeShard.sold_quantity))
+                  .filter(TicketTypeShard.ticket_type_id.in_(sharded))
+                  .group_by(TicketTypeShard.ticket_type_id).all())
+    for ticket_type_id, ticket_type in sharded.items():
+        ticket_type._shard_sold = int(totals.get(ticket_type_id) or 0)
 
 class Ticket(db.Model):
     __tablename__ = 'tickets'
@@ -368,6 +387,18 @@ class Ticket(db.Model):
         Index('ix_ticket_user_event', 'user_id', 'event_id'),
         Index('ix_ticket_type', 'ticket_type_id'),
         Index('ix_ticket_qr_code', 'qr_code'),
+        # Callback VNPay: vé chưa thanh toán của một payment
+        Index('ix_ticket_payment_user_paid', 'payment_id', 'user_id', 'is_paid'),
+        # cleanup_unpaid_tickets: chỉ index các vé đang giữ chỗ (partial index trên PostgreSQL/SQLite)
+        Index('ix_ticket_unpaid_hold', 'created_at',
+              postgresql_where=db.and_(is_paid == False, purchase_date == None),
+              sqlite_where=db.and_(is_paid == False, purchase_date == None)),
+        # Vé đã thanh toán của user, sắp xếp theo ngày mua (MyTickets, Profile)
+        Index('ix_ticket_user_paid_purchase', 'user_id', 'purchase_date',
+              postgresql_where=(is_paid == True),
+              sqlite_where=(is_paid == True)),
+        # Manifest cổng, đồng bộ delta và bộ đếm check-in theo sự kiện
+        Index('ix_ticket_event_checkin', 'event_id', 'check_in_date'),
     )
 
     def __repr__(self):
@@ -377,11 +408,10 @@ class Ticket(db.Model):
     def qr_code_url(self):
         """Get QR code URL"""
         if self.qr_code:
-            return CloudinaryImage(self.qr_code).build_url(
-                width=300, height=300, crop="fit"
-            )
+            return media.image_url(self.qr_code, 'qr')
         return None
 
+    @metrics.qr_generation_seconds.time()
     def generate_qr_code(self, qr_code_data=None):
         """Generate and upload QR code to Cloudinary using uuid"""
         try:
@@ -407,12 +437,11 @@ class Ticket(db.Model):
             buffer.seek(0)
 
             # Remove old QR code if exists
+            cloudinary = media.cloudinary_sdk()
             if self.qr_code:
-                import cloudinary.uploader
                 cloudinary.uploader.destroy(self.qr_code)
 
             # Upload to Cloudinary
-            import cloudinary.uploader
             result = cloudinary.uploader.upload(
                 buffer.getvalue(),
                 folder="online-event-ticketing-system/tickets/qr_codes",
@@ -421,20 +450,22 @@ class Ticket(db.Model):
                 resource_type="image"
             )
             self.qr_code = result["public_id"]
+            metrics.qr_codes.labels(result='ok').inc()
             return result
         except Exception as e:
-            print(f"Error generating QR code for ticket {self.id}: {e}")
+            metrics.qr_codes.labels(result='error').inc()
+            logger.exception('Error generating QR code for ticket %s', self.id, extra={'event_id': self.event_id})
             return None
 
     def delete_qr_code(self):
         """Delete QR code from Cloudinary"""
         if self.qr_code:
             try:
-                result = cloudinary.uploader.destroy(self.qr_code)
+                result = media.cloudinary_sdk().uploader.destroy(self.qr_code)
                 self.qr_code = None
                 return result
             except Exception as e:
-                print(f"Error deleting QR code: {e}")
+                logger.warning('Error deleting QR code of ticket %s: %s', self.id, e)
                 return None
 
     def mark_as_paid(self, paid_at):
@@ -507,19 +538,11 @@ class DiscountCode(db.Model):
         return user_group == self.user_group
 
     def get_user_group(self, user):
-        """Determine user group based on total_spent - should match User.get_customer_group()"""
+        """Customer group of the user, as stored on the user"""
         try:
-            now = datetime.utcnow()
-            if (now - user.created_at) <= timedelta(days=7):
-                return CustomerGroup.new
-            elif user.total_spent < 500000:
-                return CustomerGroup.regular
-            elif user.total_spent < 2000000:
-                return CustomerGroup.vip
-            else:
-                return CustomerGroup.super_vip
+            return user.get_customer_group()
         except Exception as e:
-            print(f"Error in get_user_group: {e}")
+            logger.warning('Error in get_user_group for user %s: %s', getattr(user, 'id', None), e)
             return CustomerGroup.new
 
 class Payment(db.Model):
@@ -556,15 +579,12 @@ class Payment(db.Model):
         db.session.add(self)
         db.session.flush()  # Ensure payment ID is available
         
-        # Mark tickets as paid
-        for ticket in self.tickets:
-            if not ticket.is_paid:
-                ticket.mark_as_paid(self.paid_at)
-        
-        # Update ticket type sold quantities
-        for ticket in self.tickets:
-            if ticket.ticket_type and not ticket.is_paid:
-                ticket.ticket_type.sold_quantity += 1
+        # Mark tickets as paid and count them as sold (one UPDATE for all ticket types)
+        from eventapp import counters
+        newly_paid = [ticket for ticket in self.tickets if not ticket.is_paid]
+        for ticket in newly_paid:
+            ticket.mark_as_paid(self.paid_at)
+        counters.add_sold(newly_paid)
         
         db.session.commit()
 
@@ -587,7 +607,8 @@ class EventTrendingLog(db.Model):
     def calculate_score(self):
         today = datetime.utcnow().date()
         # Calculate total sold tickets from all ticket types
-        sold_tickets = sum(tt.sold_quantity for tt in self.event.ticket_types)
+        load_shard_sold(self.event.ticket_types)
+        sold_tickets = sum(tt.sold_total for tt in self.event.ticket_types)
         total_tickets = sum(tt.total_quantity for tt in self.event.ticket_types)
         # Get review count from reviews relationship
         review_count = self.event.reviews.count() if self.event.reviews else 0
@@ -760,4 +781,136 @@ class Translation(db.Model):
     )
 
     def __repr__(self):
-        return f'<Translation {self.key}:{self.language}>'
\ No newline at end of file
+        return f'<Translation {self.key}:{self.language}>'
+
+class MediaUpload(db.Model):
+    """Staged poster/avatar upload handled by the background upload worker"""
+    __tablename__ = 'media_uploads'
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(30), nullable=False)  # event_poster, user_avatar
+    target_id = db.Column(db.Integer, nullable=False)
+    staged_path = db.Column(db.String(500), nullable=False)
+    status = db.Column(db.String(20), default='pending', nullable=False)  # pending, uploading, done, failed, superseded
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    last_error = db.Column(db.Text, nullable=True)
+    public_id = db.Column(db.String(255), nullable=True)
+    # Asset replaced by this upload, deleted once delete_after has passed
+    replaced_public_id = db.Column(db.String(255), nullable=True)
+    delete_after = db.Column(db.DateTime, nullable=True)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        Index('ix_media_upload_status_next', 'status', 'next_attempt_at'),
+        Index('ix_media_upload_target', 'kind', 'target_id'),
+        Index('ix_media_upload_delete_after', 'delete_after'),
+    )
+
+    def __repr__(self):
+        return f'<MediaUpload {self.kind}:{self.target_id} {self.status}>'
+
+
+class WaitingRoom(db.Model):
+    """Virtual waiting room of an event: admits rate_per_minute customers to the booking pages"""
+    __tablename__ = 'waiting_rooms'
+
+    event_id = db.Column(db.Integer, db.ForeignKey('events.id'), primary_key=True)
+    rate_per_minute = db.Column(db.Integer, nullable=False)
+    is_open = db.Column(db.Boolean, default=True, nullable=False)
+    # Admission time (UTC unix microseconds) handed to the next customer joining the queue; an integer so
+    # the slot can be taken with one UPDATE on every database
+    next_slot_us = db.Column(db.BigInteger, nullable=True)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        CheckConstraint('rate_per_minute > 0', name='waiting_room_rate_positive'),
+    )
+
+    def __repr__(self):
+        return f'<WaitingRoom {self.event_id} {self.rate_per_minute}/min>'
+
+
+class WaitingRoomEntry(db.Model):
+    """Place of a customer in an event's waiting room"""
+    __tablename__ = 'waiting_room_entries'
+
+    id = db.Column(db.Integer, primary_key=True)
+    event_id = db.Column(db.Integer, db.ForeignKey('events.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    admit_at = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('event_id', 'user_id', name='uq_waiting_room_entry'),
+        Index('ix_waiting_room_entry_event_admit', 'event_id', 'admit_at'),
+    )
+
+    def __repr__(self):
+        return f'<WaitingRoomEntry {self.user_id} for Event {self.event_id} at {self.admit_at}>'
+
+
+class IdempotencyKey(db.Model):
+    """Stored response of a request sent with an idempotency key (see idempotency.py)"""
+    __tablename__ = 'idempotency_keys'
+
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(255), unique=True, nullable=False)  # <scope>:<user id>:<client key>
+    fingerprint = db.Column(db.String(64), nullable=False)  # sha256 of method, path and body
+    status_code = db.Column(db.SmallInteger, nullable=True)  # NULL while the first request is running
+    content_type = db.Column(db.String(100), nullable=True)
+    response_body = db.Column(db.LargeBinary, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<IdempotencyKey {self.key} {self.status_code}>'
+
+
+class RateLimitCounter(db.Model):
+    """Requests of one rate limit key in one fixed window (database backend of rate_limit.py)"""
+    __tablename__ = 'rate_limit_counters'
+
+    key = db.Column(db.String(200), primary_key=True)  # <scope>:<user|ip>:<value>
+    window_start = db.Column(db.Integer, primary_key=True)  # unix time, multiple of the window length
+    count = db.Column(db.Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return f'<RateLimitCounter {self.key}@{self.window_start} {self.count}>'
+
+
+class WaitlistEntry(db.Model):
+    """Khách chờ vé của một loại vé đã hết; được mời mua theo thứ tự queued_at (xem waitlist.py)"""
+    __tablename__ = 'waitlist_entries'
+
+    id = db.Column(db.Integer, primary_key=True)
+    ticket_type_id = db.Column(db.Integer, db.ForeignKey('ticket_types.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    quantity = db.Column(db.Integer, default=1, nullable=False)
+    status = db.Column(db.String(20), default='waiting', nullable=False)  # waiting, offered, claimed, expired, cancelled
+    queued_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    offered_at = db.Column(db.DateTime, nullable=True)
+    offer_expires_at = db.Column(db.DateTime, nullable=True)
+    claimed_at = db.Column(db.DateTime, nullable=True)
+
+    ticket_type = relationship('TicketType')
+
+    __table_args__ = (
+        CheckConstraint('quantity > 0', name='waitlist_quantity_positive'),
+        db.UniqueConstraint('ticket_type_id', 'user_id', name='uq_waitlist_ticket_type_user'),
+        Index('ix_waitlist_type_status_queued', 'ticket_type_id', 'status', 'queued_at'),
+        Index('ix_waitlist_status_expires', 'status', 'offer_expires_at'),
+    )
+
+    def __repr__(self):
+        return f'<WaitlistEntry {self.user_id} x{self.quantity} for TicketType {self.ticket_type_id} {self.status}>'
+
+
+@event.listens_for(User, 'before_insert')
+def _set_initial_customer_group(mapper, connection, user):
+    # User tạo sẵn với created_at/total_spent (seed, import) được xếp nhóm đúng ngay từ đầu
+    user.customer_group = customer_group_for(user.total_spent, user.created_at or datetime.utcnow())
@@ -0,0 +1,208 @@
+"""
+Server-side pricing for bookings.
+
+``quote(event_id, tickets, discount_code, user_group)`` prices an order from
+``TicketType.price`` and the discount code percentage; the amounts the
+browser sends are never trusted. The result is a ``Quote`` with one line per
+ticket type, the subtotal, the discount and the total (whole dong, VND has
+no minor unit). ``process_booking`` uses it for the payment record, the
+tickets and the VNPay amount, and returns it to the booking page.
+
+Prices come from a per-event price table (ticket type id -> name, price,
+active flag) cached for ``PRICE_TABLE_TTL_SECONDS`` and dropped when a
+committed flush changes a ticket type's price, name, active flag or event,
+so a quote costs no queries on a warm cache. That invalidation only reaches
+the worker that committed the change, so other workers may show an old price
+until the TTL runs out; the price actually charged (``process_booking``) is
+quoted with ``fresh=True`` and always read from the database. Discount codes come from
+``discount_index``. Availability is not part of the price table and is
+still checked against the database.
+"""
+import itertools
+import threading
+import time
+from decimal import ROUND_HALF_UP, Decimal
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from eventapp import discount_index
+from eventapp.models import TicketType
+
+_PENDING_KEY = 'price_table_invalidate'
+_PRICED_ATTRS = ('price', 'name', 'is_active', 'event_id')
+WHOLE_DONG = Decimal('1')
+
+
+class PricingError(ValueError):
+    """The order cannot be priced; the message is shown to the customer"""
+
+
+class PriceEntry:
+    __slots__ = ('ticket_type_id', 'name', 'price', 'is_active')
+
+    def __init__(self, ticket_type):
+        self.ticket_type_id = ticket_type.id
+        self.name = ticket_type.name
+        self.price = Decimal(ticket_type.price)
+        self.is_active = ticket_type.is_active
+
+
+class PriceTables:
+    """TTL cache of event id -> {ticket type id: PriceEntry}"""
+
+    def __init__(self, ttl=30):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._tables = {}
+        self._generation = 0
+        self.loads = 0
+
+    def get(self, event_id, fresh=False):
+        """Cached table for the event; ``fresh`` reads it from the database (and refreshes the cache)"""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._tables.get(event_id)
+            if cached is not None and cached[0] > now and not fresh:
+                return cached[1]
+            generation = self._generation
+
+        table = {tt.id: PriceEntry(tt) for tt in TicketType.query.filter_by(event_id=event_id).all()}
+        with self._lock:
+            self.loads += 1
+            # Skip the store if an invalidation raced with the query above
+            if self.ttl > 0 and generation == self._generation:
+                self._tables[event_id] = (now + self.ttl, table)
+        return table
+
+    def invalidate(self, event_id):
+        with self._lock:
+            self._generation += 1
+            self._tables.pop(event_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._tables.clear()
+
+
+price_tables = PriceTables()
+
+
+class QuoteLine:
+    __slots__ = ('ticket_type_id', 'name', 'unit_price', 'quantity', 'amount')
+
+    def __init__(self, entry, quantity):
+        self.ticket_type_id = entry.ticket_type_id
+        self.name = entry.name
+        self.unit_price = entry.price
+        self.quantity = quantity
+        self.amount = entry.price * quantity
+
+    def to_dict(self):
+        return {'ticket_type_id': self.ticket_type_id, 'name': self.name, 'unit_price': float(self.unit_price),
+                'quantity': self.quantity, 'amount': float(self.amount)}
+
+
+class Quote:
+    """Itemized price of one order"""
+
+    def __init__(self, event_id, lines, discount=None):
+        self.event_id = event_id
+        self.lines = lines
+        self.discount = discount
+        self.subtotal = sum((line.amount for line in lines), Decimal(0)).quantize(WHOLE_DONG, ROUND_HALF_UP)
+        percentage = Decimal(discount.discount_percentage) if discount else Decimal(0)
+        self.discount_amount = (self.subtotal * percentage / 100).quantize(WHOLE_DONG, ROUND_HALF_UP)
+        self.total = self.subtotal - self.discount_amount
+
+    @property
+    def discount_code(self):
+        return self.discount.code if self.discount else None
+
+    def differs_from(self, client_total):
+        """True when the total the browser computed does not match this quote"""
+        try:
+            return Decimal(str(client_total)).quantize(WHOLE_DONG, ROUND_HALF_UP) != self.total
+        except ArithmeticError:
+            return True
+
+    def to_dict(self):
+        return {
+            'event_id': self.event_id,
+            'lines': [line.to_dict() for line in self.lines],
+            'subtotal': float(self.subtotal),
+            'discount_code': self.discount_code,
+            'discount_percentage': float(self.discount.discount_percentage) if self.discount else 0.0,
+            'discount_amount': float(self.discount_amount),
+            'total_amount': float(self.total),
+        }
+
+
+def quote(event_id, tickets, discount_code=None, user_group=None, fresh=False):
+    """Price ``tickets`` (``[{'ticket_type_id': .., 'quantity': ..}]``) for an event.
+    ``fresh`` skips the cached price table: use it for the amount that is charged.
+
+    Raises PricingError for ticket types of another event, inactive ticket
+    types, bad quantities, or a discount code the customer cannot use."""
+    try:
+        event_id = int(event_id)
+    except (TypeError, ValueError):
+        raise PricingError('Sự kiện không hợp lệ.')
+    table = price_tables.get(event_id, fresh=fresh)
+    quantities = {}
+    for item in tickets or ():
+        try:
+            ticket_type_id, quantity = int(item['ticket_type_id']), int(item['quantity'])
+        except (KeyError, TypeError, ValueError):
+            raise PricingError('Dữ liệu vé không hợp lệ.')
+        if quantity < 0:
+            raise PricingError('Số lượng vé không hợp lệ.')
+        entry = table.get(ticket_type_id)
+        if entry is None or not entry.is_active:
+            raise PricingError('Loại vé không tồn tại hoặc đã ngừng bán.')
+        if quantity:
+            quantities[ticket_type_id] = quantities.get(ticket_type_id, 0) + quantity
+    if not quantities:
+        raise PricingError('Vui lòng chọn ít nhất một vé.')
+
+    discount = None
+    if discount_code:
+        discount = discount_index.index.get(discount_code)
+        if discount is None or not discount.is_valid() or (user_group is not None and discount.user_group != user_group):
+            raise PricingError('Mã giảm giá không hợp lệ hoặc đã hết hạn.')
+
+    lines = [QuoteLine(table[ticket_type_id], quantity) for ticket_type_id, quantity in quantities.items()]
+    return Quote(event_id, lines, discount)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_repriced_events(session, flush_context):
+    event_ids = set()
+    for obj in itertools.chain(session.new, session.dirty, session.deleted):
+        if not isinstance(obj, TicketType):
+            continue
+        state = inspect(obj)
+        # sold_quantity changes on every payment and does not affect prices
+        if obj in session.dirty and not any(state.attrs[name].history.has_changes() for name in _PRICED_ATTRS):
+            continue
+        event_ids.add(obj.event_id)
+        event_ids.update(state.attrs.event_id.history.deleted or ())
+    if event_ids:
+        session.info.setdefault(_PENDING_KEY, set()).update(event_ids)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed_prices(session):
+    for event_id in session.info.pop(_PENDING_KEY, ()):
+        price_tables.invalidate(event_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back_prices(session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+def init_app(app):
+    price_tables.ttl = app.config.get('PRICE_TABLE_TTL_SECONDS', 30)
+    price_tables.clear()
@@ -0,0 +1,111 @@
+"""
+Per-request SQL instrumentation.
+
+Every statement run while handling a request (on the primary or a replica) is
+timed with ``before_cursor_execute``/``after_cursor_execute`` and added to
+``g.query_stats``: query count, total DB time and the slowest statements.
+
+* In debug mode, or with ``QUERY_STATS_HEADERS`` on, responses carry
+  ``Server-Timing: db;dur=<ms>;desc="<n> queries"`` and ``X-DB-Query-Count``
+  so N+1 patterns show up in the browser's network panel.
+* A request running more than ``SLOW_REQUEST_QUERIES`` statements or spending
+  more than ``SLOW_REQUEST_DB_MS`` in the database is logged on the
+  ``eventapp.sql`` logger with its route and slowest statements.
+* A single statement slower than ``SLOW_QUERY_MS`` is logged as it finishes.
+
+Statements are logged without their parameters.
+"""
+import heapq
+import logging
+import time
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger('eventapp.sql')
+
+SLOWEST_KEPT = 5
+
+
+class RequestQueryStats:
+    """Query count, DB time and slowest statements of one request"""
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self._slowest = []  # min-heap of (ms, sequence, statement)
+
+    def record(self, statement, ms):
+        self.count += 1
+        self.total_ms += ms
+        entry = (ms, self.count, statement)
+        if len(self._slowest) < SLOWEST_KEPT:
+            heapq.heappush(self._slowest, entry)
+        else:
+            heapq.heappushpop(self._slowest, entry)
+
+    @property
+    def slowest(self):
+        return [(round(ms, 2), statement) for ms, _, statement in sorted(self._slowest, reverse=True)]
+
+    def server_timing(self):
+        return f'db;dur={self.total_ms:.2f};desc="{self.count} queries"'
+
+
+def _current_stats():
+    return g.get('query_stats') if has_request_context() else None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_timer(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the statement's execution context, not the pooled connection: a failing statement
+    # never reaches after_cursor_execute and must not leave its start time behind
+    if context is not None:
+        context._query_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _stop_timer(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_query_start', None)
+    if started is None:
+        return
+    ms = (time.perf_counter() - started) * 1000
+    stats = _current_stats()
+    if stats is None:
+        return
+    stats.record(statement, ms)
+    if ms > current_app.config['SLOW_QUERY_MS']:
+        logger.warning('slow query %.1f ms on %s: %s', ms, request.endpoint, statement,
+                       extra={'route': request.endpoint, 'duration_ms': round(ms, 2), 'statement': statement})
+
+
+def init_app(app):
+    app.config.setdefault('QUERY_STATS_HEADERS', False)
+    app.config.setdefault('SLOW_REQUEST_QUERIES', 30)
+    app.config.setdefault('SLOW_REQUEST_DB_MS', 500)
+    app.config.setdefault('SLOW_QUERY_MS', 200)
+
+    @app.before_request
+    def start_query_stats():
+        g.query_stats = RequestQueryStats()
+
+    @app.after_request
+    def report_query_stats(response):
+        stats = g.pop('query_stats', None)
+        if stats is None:
+            return response
+        if app.debug or app.config['QUERY_STATS_HEADERS']:
+            timing = stats.server_timing()
+            if response.headers.get('Server-Timing'):
+                timing = f"{response.headers['Server-Timing']}, {timing}"
+            response.headers['Server-Timing'] = timing
+            response.headers['X-DB-Query-Count'] = str(stats.count)
+        if stats.count > app.config['SLOW_REQUEST_QUERIES'] or stats.total_ms > app.config['SLOW_REQUEST_DB_MS']:
+            logger.warning(
+                '%s %s ran %d queries in %.1f ms', request.method, request.path, stats.count, stats.total_ms,
+                extra={'route': request.endpoint, 'method': request.method, 'path': request.path,
+                       'query_count': stats.count, 'db_ms': round(stats.total_ms, 2),
+                       'slowest_statements': stats.slowest},
+            )
+        return response
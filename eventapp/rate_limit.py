@@ -0,0 +1,154 @@
+"""
+Sliding-window rate limits keyed by user and client IP.
+
+``@limit('booking')`` checks the rules in ``RATE_LIMITS['booking']`` before
+the view runs, e.g. ``{'user': (10, 60), 'ip': (30, 60)}``: at most 10
+requests per user and 30 per IP address in any 60 seconds. Over the limit
+the view is not called; the client gets 429 with ``Retry-After``. Every
+attempt counts, so a client that keeps hammering stays blocked. Put it
+inside ``@idempotency.idempotent`` so replays of a stored response are free.
+
+Two backends (``RATE_LIMIT_BACKEND``):
+
+* ``memory`` (default) - exact sliding log per key in this process. With N
+  gunicorn workers a client can get up to N times the limit.
+* ``database`` - shared by all workers through ``rate_limit_counters``: one
+  row per key and fixed window; the sliding count is estimated from the
+  current and previous window (previous weighted by how much of it still
+  overlaps). Costs one upsert and one read on a separate connection per
+  request; ``flask --app eventapp rate-limit purge`` deletes old windows.
+"""
+import functools
+import threading
+import time
+from collections import OrderedDict, deque
+
+import click
+from flask import current_app, jsonify, request
+from flask_login import current_user
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from eventapp import db
+from eventapp.models import RateLimitCounter
+
+
+def parse_rule(value):
+    """``'10/60'`` -> (10, 60): 10 requests per 60 seconds"""
+    count, _, seconds = value.partition('/')
+    return int(count), int(seconds or 60)
+
+
+class MemoryBackend:
+    """Timestamps of the last ``limit`` hits per key (bounded LRU of keys)"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._hits = OrderedDict()
+
+    def hit(self, key, limit, window, now=None):
+        """Record a hit; returns 0 if allowed, else seconds until the next one would be"""
+        now = time.time() if now is None else now
+        with self._lock:
+            hits = self._hits.get(key)
+            if hits is None or hits.maxlen != limit:
+                hits = self._hits[key] = deque(hits or (), maxlen=limit)
+            self._hits.move_to_end(key)
+            if len(self._hits) > self.max_keys:
+                self._hits.popitem(last=False)
+            retry_after = 0 if len(hits) < limit or hits[0] <= now - window else hits[0] + window - now
+            hits.append(now)
+            return retry_after
+
+    def clear(self):
+        with self._lock:
+            self._hits.clear()
+
+
+class DatabaseBackend:
+    """Sliding-window counter over fixed windows stored in rate_limit_counters"""
+
+    def hit(self, key, limit, window, now=None):
+        now = time.time() if now is None else now
+        start = int(now // window) * window
+        table = RateLimitCounter.__table__
+        with db.engine.begin() as conn:
+            increment = (update(table).where(table.c.key == key, table.c.window_start == start)
+                         .values(count=table.c.count + 1))
+            if not conn.execute(increment).rowcount:
+                try:
+                    with conn.begin_nested():
+                        conn.execute(insert(table).values(key=key, window_start=start, count=1))
+                except IntegrityError:
+                    conn.execute(increment)
+            counts = dict(conn.execute(
+                select(table.c.window_start, table.c.count)
+                .where(table.c.key == key, table.c.window_start.in_((start - window, start)))
+            ).all())
+        remaining = 1 - (now - start) / window  # part of the previous window still inside the sliding one
+        estimate = counts.get(start - window, 0) * remaining + counts.get(start, 0)
+        return 0 if estimate <= limit else remaining * window
+
+    def purge(self, now=None, max_window=86400):
+        """Delete windows that no sliding window of up to ``max_window`` seconds overlaps"""
+        now = time.time() if now is None else now
+        deleted = RateLimitCounter.query.filter(RateLimitCounter.window_start < now - 2 * max_window) \
+            .delete(synchronize_session=False)
+        db.session.commit()
+        return deleted
+
+    def clear(self):
+        RateLimitCounter.query.delete(synchronize_session=False)
+        db.session.commit()
+
+
+BACKENDS = {'memory': MemoryBackend, 'database': DatabaseBackend}
+backend = MemoryBackend()
+
+
+def _subjects(rules):
+    if 'user' in rules and current_user.is_authenticated:
+        yield 'user', current_user.get_id()
+    if 'ip' in rules and request.remote_addr:
+        yield 'ip', request.remote_addr
+
+
+def check(scope):
+    """Count the current request against ``scope``; seconds to wait, 0 if allowed"""
+    rules = current_app.config.get('RATE_LIMITS', {}).get(scope, {})
+    retry_after = 0
+    for subject, value in _subjects(rules):
+        limit, window = rules[subject]
+        retry_after = max(retry_after, backend.hit(f'{scope}:{subject}:{value}', limit, window))
+    return retry_after
+
+
+def limit(scope):
+    """Reject the request with 429 when a rule of ``scope`` is exceeded"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            retry_after = check(scope)
+            if retry_after:
+                response = jsonify({'success': False, 'message': 'Bạn thao tác quá nhanh, vui lòng thử lại sau.'})
+                response.status_code = 429
+                response.headers['Retry-After'] = str(max(1, int(retry_after + 0.999)))
+                return response
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def init_app(app):
+    global backend
+    backend = BACKENDS[app.config.get('RATE_LIMIT_BACKEND', 'memory')]()
+
+    @app.cli.group('rate-limit')
+    def rate_limit_command():
+        """Rate limit counters."""
+
+    @rate_limit_command.command('purge')
+    def purge_command():
+        """Delete old rate_limit_counters windows (database backend)."""
+        click.echo(f'{DatabaseBackend().purge()} rate limit windows deleted')
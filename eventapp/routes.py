@@ -1,10 +1,11 @@
 from eventapp import app, db, login_manager
 from eventapp.dao import update_user_role
 
-from eventapp.models import PaymentMethod, EventCategory, Review, UserRole, User, Event, Ticket, TicketType
+from eventapp.models import PaymentMethod, EventCategory, Review, UserRole, User, Event, Ticket, TicketType, Notification, UserNotification, WaitlistEntry
 
-from eventapp import dao
-from flask import flash, jsonify, render_template, request, abort, session, redirect, url_for
+from eventapp import dao, idempotency, manifest, checkin_stats, db_config, metrics, pricing, rate_limit, waiting_room, waitlist
+from eventapp.db_routing import read_only
+from flask import flash, jsonify, render_template, request, abort, session, redirect, url_for, send_from_directory
 from flask_login import login_required, current_user
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileField, FileAllowed
@@ -13,13 +14,20 @@ from wtforms.validators import DataRequired, Length, NumberRange, Optional, Vali
 from datetime import datetime, timedelta
 
 from werkzeug.security import generate_password_hash, check_password_hash
-from flask import Blueprint, request, jsonify, redirect
 from eventapp.auth import validate_email, validate_password
 from eventapp.dao import create_payment_url_flask, vnpay_redirect_flask,cleanup_unpaid_tickets, get_staff_by_organizer, get_customers_for_upgrade, get_staff_assigned_to_event
+from sqlalchemy import text
 from sqlalchemy.orm import joinedload
+import hmac
+import json
 import logging
+import time
 import uuid
 
+booking_logger = logging.getLogger('eventapp.booking')
+checkin_logger = logging.getLogger('eventapp.checkin')
+routes_logger = logging.getLogger('eventapp.routes')
+
 # Đăng ký bộ lọc
 def get_category_title(category):
     """Bộ lọc để lấy tiêu đề danh mục từ giá trị enum"""
@@ -175,10 +183,8 @@ def event_detail(event_id):
                              can_reply=can_reply,
                              can_review=can_review,
                              my_review=my_review)
-    except Exception as e:
-        print(f"Error in event_detail: {str(e)}")
-        import traceback
-        traceback.print_exc()
+    except Exception:
+        routes_logger.exception('event detail failed', extra={'event_id': event_id})
         abort(500)
 
 # ========== Review Routes ========== #
@@ -294,17 +300,15 @@ def faq():
 @app.route('/profile')
 @login_required
 def profile():
-    from eventapp.models import Ticket
-    recent_tickets = Ticket.query.filter_by(user_id=current_user.id, is_paid=True).order_by(Ticket.purchase_date.desc()).limit(5).all()
-    return render_template('customer/Profile.html', user=current_user, recent_tickets=recent_tickets)
+    recent_tickets = dao.get_paid_tickets(current_user.id, limit=5)
+    return render_template('customer/Profile.html', user=dao.get_user_by_id(current_user.id), recent_tickets=recent_tickets)
 
 # Route chỉnh sửa thông tin hồ sơ
-from flask import request, redirect, flash, url_for
-
 @app.route('/profile/edit', methods=['GET', 'POST'])
 @login_required
 def edit_profile():
-    user = current_user
+    # current_user là snapshot chỉ đọc, cần model thật để cập nhật
+    user = dao.get_user_by_id(current_user.id)
     message = None
     if request.method == 'POST':
         username = request.form.get('username')
@@ -312,7 +316,6 @@ def edit_profile():
         phone = request.form.get('phone')
         avatar_file = request.files.get('avatar')
 
-        from eventapp.models import User
         # Kiểm tra trùng username
         if username and username != user.username:
             if User.query.filter(User.username==username, User.id!=user.id).first():
@@ -327,9 +330,11 @@ def edit_profile():
                 user.email = email
         if phone:
             user.phone = phone
+        avatar_queued = False
         if avatar_file and avatar_file.filename:
             try:
                 user.upload_avatar(avatar_file)
+                avatar_queued = True
             except Exception as e:
                 message = f'Lỗi cập nhật ảnh đại diện: {str(e)}'
 
@@ -349,11 +354,12 @@ def edit_profile():
             else:
                 user.password_hash = generate_password_hash(new_password)
 
-        from eventapp import db
         try:
             db.session.commit()
             if not message:
                 message = 'Cập nhật hồ sơ thành công!'
+                if avatar_queued:
+                    message += ' Ảnh đại diện mới sẽ hiển thị sau ít phút.'
         except Exception as e:
             db.session.rollback()
             message = f'Lỗi cập nhật hồ sơ: {str(e)}'
@@ -366,31 +372,71 @@ def edit_profile():
 @login_required
 def change_password():
     message = None
+    user = dao.get_user_by_id(current_user.id)
     if request.method == 'POST':
         old_password = request.form.get('old_password')
         new_password = request.form.get('new_password')
         confirm_password = request.form.get('confirm_password')
-        if not check_password_hash(current_user.password_hash, old_password):
+        if not check_password_hash(user.password_hash, old_password):
             message = 'Mật khẩu cũ không đúng!'
         elif new_password != confirm_password:
             message = 'Mật khẩu mới không khớp!'
         elif len(new_password) < 6:
             message = 'Mật khẩu mới phải từ 6 ký tự trở lên!'
         else:
-            current_user.password_hash = generate_password_hash(new_password)
+            user.password_hash = generate_password_hash(new_password)
             try:
                 db.session.commit()
                 message = 'Đổi mật khẩu thành công!'
             except Exception as e:
                 db.session.rollback()
                 message = f'Lỗi đổi mật khẩu: {str(e)}'
-    return render_template('customer/ChangePassword.html', user=current_user, message=message)
+    return render_template('customer/ChangePassword.html', user=user, message=message)
 
 @app.route('/my-tickets')
 @login_required
 def my_tickets():
-    tickets = Ticket.query.filter_by(user_id=current_user.id, is_paid=True).order_by(Ticket.purchase_date.desc()).all()
-    return render_template('customer/MyTickets.html', tickets=tickets)
+    page = request.args.get('page', 1, type=int)
+    pagination, ticket_groups = dao.get_ticket_wallet(current_user.id, page=page)
+    return render_template('customer/MyTickets.html', pagination=pagination, ticket_groups=ticket_groups)
+
+# Kiểm tra kết nối CSDL và trạng thái pool (dùng cho health check / giám sát)
+@app.route('/health/db')
+def health_db():
+    started = time.perf_counter()
+    try:
+        db.session.execute(text('SELECT 1'))
+        db.session.rollback()
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Health check CSDL thất bại: {e}")
+        return jsonify({'status': 'error', 'error': type(e).__name__, 'pool': db_config.pool_metrics.snapshot()}), 503
+    return jsonify({
+        'status': 'ok',
+        'latency_ms': round((time.perf_counter() - started) * 1000, 2),
+        'pool': db_config.pool_metrics.snapshot()
+    })
+
+# Metrics Prometheus (gộp từ mọi worker gunicorn khi chạy multiprocess, xem gunicorn.conf.py)
+@app.route('/metrics')
+def prometheus_metrics():
+    token = app.config.get('METRICS_TOKEN')
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        abort(401)
+    body, content_type = metrics.render()
+    return body, 200, {'Content-Type': content_type}
+
+# Ảnh lưu bằng storage local (MEDIA_STORAGE=local)
+@app.route('/media/<path:filename>')
+def media_file(filename):
+    return send_from_directory(app.config['MEDIA_ROOT'], filename)
+
+# Biến thể poster có tên theo hash nội dung nên không bao giờ thay đổi: cache dài hạn
+@app.route('/media/variants/<filename>')
+def media_variant(filename):
+    response = send_from_directory(app.config['MEDIA_VARIANTS_DIR'], filename, max_age=31536000)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
 
 @app.route('/my-events')
 @login_required
@@ -402,7 +448,7 @@ def my_events():
 @app.route('/settings')
 @login_required
 def settings():
-    return render_template('settings.html', user=current_user)
+    return render_template('settings.html', user=dao.get_user_by_id(current_user.id))
 
 
 # Trang tất cả thông báo (profile)
@@ -648,6 +694,7 @@ def bulk_delete_events():
 
 @app.route('/organizer/revenue-reports', methods=['GET'])
 @login_required
+@read_only()
 def organizer_revenue_reports():
     """Báo cáo doanh thu cho người tổ chức"""
     if current_user.role.value != 'organizer':
@@ -684,6 +731,39 @@ def organizer_revenue_reports():
         logging.error(f"Lỗi trong organizer_revenue_reports: {str(e)}")
         abort(500)
 
+def _get_gate_event_or_403(event_id):
+    """Sự kiện cho dashboard cổng: organizer sở hữu sự kiện hoặc admin"""
+    event = Event.query.get_or_404(event_id)
+    if current_user.role.value == 'admin':
+        return event
+    if current_user.role.value != 'organizer' or event.organizer_id != current_user.id:
+        abort(403)
+    return event
+
+def _gate_stats_payload(event):
+    stats = checkin_stats.counters.snapshot(event.id)
+    names = {tt.id: tt.name for tt in event.ticket_types}
+    stats['by_ticket_type'] = [
+        dict(ticket_type_id=tt_id, name=names.get(tt_id, str(tt_id)), **counts)
+        for tt_id, counts in sorted(stats['by_ticket_type'].items())
+    ]
+    return stats
+
+@app.route('/organizer/event/<int:event_id>/gate')
+@login_required
+def organizer_gate_dashboard(event_id):
+    """Dashboard theo dõi lượt vào cổng theo thời gian thực"""
+    event = _get_gate_event_or_403(event_id)
+    return render_template('organizer/GateDashboard.html', event=event,
+                           refresh_seconds=app.config.get('GATE_DASHBOARD_REFRESH_SECONDS', 5))
+
+@app.route('/organizer/event/<int:event_id>/gate/stats')
+@login_required
+def organizer_gate_stats(event_id):
+    """Số liệu check-in hiện tại (JSON, đọc từ bộ đếm trong bộ nhớ)"""
+    event = _get_gate_event_or_403(event_id)
+    return jsonify({'success': True, 'stats': _gate_stats_payload(event)})
+
 class RoleUpdateForm(FlaskForm):
     """Biểu mẫu đơn giản để cung cấp CSRF token"""
     new_role = HiddenField('new_role')
@@ -765,9 +845,9 @@ def organizer_update_role(user_id):
             flash(f'Đã {"nâng cấp" if new_role == "staff" else "hạ cấp"} người dùng thành công.', 'success')
         except ValueError as e:
             flash(str(e), 'error')
-        except Exception as e:
+        except Exception:
             flash('Đã xảy ra lỗi khi cập nhật vai trò.', 'error')
-            print(f"Error in organizer_update_role: {str(e)}")
+            routes_logger.exception('updating staff role failed', extra={'target_user_id': user_id})
     else:
         flash('Yêu cầu không hợp lệ.', 'error')
     
@@ -912,6 +992,7 @@ def get_assigned_staff(event_id):
 
 @app.route('/admin/dashboard')
 @login_required
+@read_only()
 def admin_dashboard():
     if current_user.role.value != 'admin':
         abort(403)
@@ -1028,10 +1109,59 @@ def event_detail_admin(event_id):
     event = Event.query.get_or_404(event_id)
     return render_template('admin/event_detail.html', event=event)
 
+def _admission_token(event_id):
+    """Token phòng chờ của khách cho sự kiện (header X-Admission-Token hoặc lưu trong session)"""
+    return request.headers.get('X-Admission-Token') or session.get('admission_tokens', {}).get(str(event_id))
+
+def _queue_slot(event_id):
+    """Thời điểm đến lượt (admit_at) của khách trong phòng chờ, lưu trong session đã ký để poll không truy vấn"""
+    user_id, admit_ts = session.get('queue_slots', {}).get(str(event_id), (None, None))
+    return manifest.from_timestamp(admit_ts) if user_id == current_user.id else None
+
+def _join_queue(event_id):
+    """Xếp hàng (hoặc lấy lại lượt đã có) và ghi admit_at vào session"""
+    entry = waiting_room.join(event_id, current_user.id)
+    session['queue_slots'] = {**session.get('queue_slots', {}),
+                              str(event_id): (current_user.id, manifest.to_timestamp(entry.admit_at))}
+    return entry.admit_at
+
+@app.route('/queue/event/<int:event_id>')
+@login_required
+def waiting_room_page(event_id):
+    """Phòng chờ ảo: khách xếp hàng đến lượt vào trang đặt vé"""
+    if waiting_room.is_admitted(event_id, current_user.id, _admission_token(event_id)):
+        return redirect(url_for('book_ticket', event_id=event_id))
+    event = Event.query.get_or_404(event_id)
+    status = waiting_room.status(event_id, current_user.id, _join_queue(event_id))
+    return render_template('customer/WaitingRoom.html', event=event, status=status,
+                           poll_seconds=app.config.get('WAITING_ROOM_POLL_SECONDS', 5))
+
+@app.route('/queue/event/<int:event_id>/status')
+@login_required
+def waiting_room_status(event_id):
+    """Vị trí trong hàng chờ (JSON); khi đến lượt, token vào cửa được lưu vào session"""
+    booking_url = url_for('book_ticket', event_id=event_id)
+    if waiting_room.is_admitted(event_id, current_user.id, _admission_token(event_id)):
+        return jsonify({'success': True, 'admitted': True, 'redirect': booking_url})
+    admit_at = _queue_slot(event_id)
+    if admit_at is None or admit_at <= datetime.utcnow():
+        # Chưa có lượt trong session, hoặc đã đến lượt: đọc lại hàng chờ một lần trước khi cấp token
+        admit_at = _join_queue(event_id)
+    status = waiting_room.status(event_id, current_user.id, admit_at)
+    token = status.pop('token')
+    if token:
+        session['admission_tokens'] = {**session.get('admission_tokens', {}), str(event_id): token}
+        status['redirect'] = booking_url
+    poll_seconds = app.config.get('WAITING_ROOM_POLL_SECONDS', 5)
+    status['retry_after'] = max(1, min(poll_seconds, status['wait_seconds']))
+    return jsonify({'success': True, **status})
+
 @app.route('/booking/event/<int:event_id>')
 @login_required
 def book_ticket(event_id):
     """Trang đặt vé cho sự kiện"""
+    if not waiting_room.is_admitted(event_id, current_user.id, _admission_token(event_id)):
+        return redirect(url_for('waiting_room_page', event_id=event_id))
     try:
         logging.debug(f"[BOOK_TICKET] User {current_user.username} accessing event {event_id}")
         
@@ -1047,13 +1177,13 @@ def book_ticket(event_id):
         all_ticket_types = dao.get_all_ticket_types_for_event(event_id)
         logging.debug(f"[BOOK_TICKET] Event has {len(all_ticket_types)} ticket types")
         
-        available_ticket_types = dao.get_available_ticket_types(all_ticket_types)
+        available_ticket_types = dao.get_available_ticket_types(all_ticket_types, current_user.id)
         logging.debug(f"[BOOK_TICKET] Available ticket types: {len(available_ticket_types)}")
         
         if not available_ticket_types:
             logging.debug(f"[BOOK_TICKET] No available tickets for event {event_id}")
-            flash('Sự kiện này hiện tại đã hết vé.', 'warning')
-            return redirect(url_for('event_detail', event_id=event_id))
+            flash('Sự kiện này hiện tại đã hết vé. Đăng ký danh sách chờ để được mời mua khi có vé.', 'warning')
+            return redirect(url_for('waitlist_page', event_id=event_id))
         
         user_group = dao.get_user_customer_group(current_user)
         logging.debug(f"[BOOK_TICKET] User group: {user_group}")
@@ -1077,38 +1207,66 @@ def book_ticket(event_id):
 
 @app.route('/booking/process', methods=['POST'])
 @login_required
+@metrics.booking_seconds.time()
+# Thứ tự quan trọng: gửi lại cùng Idempotency-Key nhận response đã lưu mà không bị tính vào hạn mức
+@idempotency.idempotent('booking')
+@rate_limit.limit('booking')
 def process_booking():
     """Xử lý đặt vé (AJAX)"""
     cleanup_unpaid_tickets() #lazy cleanup ticket chưa thanh toán
+    method_label = 'unknown'
     
     try:
         data = request.get_json()
         payment_method = data.get('payment_method')
         tickets_data = data.get('tickets')
+        # Giới hạn giá trị label để metrics không bị bùng nổ theo dữ liệu client gửi lên
+        method_label = payment_method if payment_method in PaymentMethod.__members__ else 'other'
         
-        # Log thông tin booking để kiểm tra
-        print("=== BOOKING INFORMATION ===")
-        print(f"User: {current_user.username} (ID: {current_user.id})")
-        print(f"Event ID: {data.get('event_id')}")
-        print(f"Tickets: {data.get('tickets')}")
-        print(f"Payment Method: {data.get('payment_method')}")
-        print(f"Discount Code: {data.get('discount_code', 'None')}")
-        print(f"Subtotal: {data.get('subtotal')}")
-        print(f"Discount Amount: {data.get('discount_amount')}")
-        print(f"Total Amount: {data.get('total_amount')}")
-        print("========================")
+        booking_logger.info('booking received', extra={
+            'event_id': data.get('event_id'),
+            'tickets': data.get('tickets'),
+            'payment_method': payment_method,
+            'discount_code': data.get('discount_code'),
+            'subtotal': data.get('subtotal'),
+            'discount_amount': data.get('discount_amount'),
+            'total_amount': data.get('total_amount'),
+        })
         
+        # Sự kiện đang mở phòng chờ: chỉ khách đã đến lượt (có token hợp lệ) mới được đặt
+        if not waiting_room.is_admitted(data.get('event_id'), current_user.id, _admission_token(data.get('event_id'))):
+            metrics.bookings.labels(payment_method=method_label, outcome='not_admitted').inc()
+            return jsonify({'success': False, 'message': 'Vui lòng chờ đến lượt trong phòng chờ.',
+                            'waiting_room_url': url_for('waiting_room_page', event_id=data.get('event_id'))}), 403
+
         # Validation
         if not data.get('tickets') or len(data.get('tickets')) == 0:
+            metrics.bookings.labels(payment_method=method_label, outcome='invalid').inc()
             return jsonify({'success': False, 'message': 'Vui lòng chọn ít nhất một loại vé.'})
         
         total_tickets = sum(ticket['quantity'] for ticket in data.get('tickets'))
         if total_tickets == 0:
+            metrics.bookings.labels(payment_method=method_label, outcome='invalid').inc()
             return jsonify({'success': False, 'message': 'Vui lòng chọn ít nhất một vé.'})
         
+        # Tính giá phía server từ giá hiện tại trong CSDL (không dùng bảng giá cache của worker này);
+        # số tiền client gửi lên chỉ dùng để đối chiếu
+        try:
+            quote = pricing.quote(data.get('event_id'), tickets_data, data.get('discount_code'),
+                                  dao.get_user_customer_group(current_user), fresh=True)
+        except pricing.PricingError as e:
+            metrics.bookings.labels(payment_method=method_label, outcome='invalid').inc()
+            return jsonify({'success': False, 'message': str(e)})
+        if data.get('total_amount') is not None and quote.differs_from(data['total_amount']):
+            booking_logger.warning('client total differs from server quote', extra={
+                'event_id': quote.event_id, 'client_total': data.get('total_amount'), 'total_amount': quote.total})
+
         # Kiểm tra tồn kho
-        is_valid, error_message = dao.validate_ticket_availability(data.get('tickets'))
+        is_valid, error_message = dao.validate_ticket_availability(
+            [{'ticket_type_id': line.ticket_type_id, 'quantity': line.quantity} for line in quote.lines],
+            current_user.id)
         if not is_valid:
+            metrics.bookings.labels(payment_method=method_label, outcome='unavailable').inc()
             return jsonify({'success': False, 'message': error_message})
 
 
@@ -1116,51 +1274,118 @@ def process_booking():
         # Nếu chọn VNPay
         if payment_method == 'vnpay':
             # Tạo transaction_id duy nhất
-            import uuid
             transaction_id = f"VNPAY_{uuid.uuid4().hex[:12]}"
             # Tạo bản ghi Payment (status=False)
             payment = dao.create_payment(
                 user_id=current_user.id,
-                amount=data['total_amount'],
+                amount=quote.total,
                 payment_method=payment_method,
                 status=False,
                 transaction_id=transaction_id,
-                discount_code=data.get('discount_code')
+                discount_code=quote.discount_code
             )
-            db.session.commit()
-
+            db.session.flush()
 
-            # Tạo các vé với is_paid=False
-            for ticket_info in tickets_data:
-                ticket_type = TicketType.query.get(ticket_info['ticket_type_id'])
-                event_id = ticket_type.event_id if ticket_type else None
-                for _ in range(ticket_info['quantity']):
-                    ticket = Ticket(
-                        user_id=current_user.id,
-                        event_id=event_id,
-                        ticket_type_id=ticket_info['ticket_type_id'],
-                        is_paid=False,
-                        purchase_date=None,
-                        payment_id=payment.id
-                    )
-                    db.session.add(ticket)
-                    # Cập nhật sold_quantity tạm thời nếu muốn (hoặc chỉ tăng khi thanh toán thành công)
+            # Tạo các vé với is_paid=False, trong giới hạn số vé mỗi tài khoản cho một sự kiện
+            max_per_user = app.config.get('MAX_TICKETS_PER_USER_PER_EVENT', 10)
+            if not dao.hold_tickets(current_user.id, quote.event_id, payment.id, quote.lines, max_per_user):
+                db.session.rollback()
+                metrics.bookings.labels(payment_method=method_label, outcome='limit').inc()
+                return jsonify({'success': False,
+                                'message': f'Mỗi tài khoản chỉ được mua tối đa {max_per_user} vé cho sự kiện này.'})
+            # Lời mời từ danh sách chờ (nếu có) vẫn giữ vé đến khi VNPay báo thanh toán thành công
             db.session.commit()
 
 
 
             # Tạo URL thanh toán VNPay
-            payment_url = dao.create_payment_url_flask(data['total_amount'], txn_ref=transaction_id)
-            return jsonify({'success': True, 'payment_url': payment_url})
+            payment_url = dao.create_payment_url_flask(quote.total, txn_ref=transaction_id)
+            booking_logger.info('booking awaiting VNPay payment', extra={
+                'event_id': quote.event_id, 'payment_id': payment.id, 'transaction_id': transaction_id,
+                'total_amount': quote.total})
+            metrics.bookings.labels(payment_method=method_label, outcome='pending_payment').inc()
+            return jsonify({'success': True, 'payment_url': payment_url, 'quote': quote.to_dict()})
         
 
         # Nếu là phương thức khác (COD, chuyển khoản, ...)
         # ...xử lý như cũ...
-        return jsonify({'success': True, 'message': 'Đặt vé thành công!'})
+        metrics.bookings.labels(payment_method=method_label, outcome='ok').inc()
+        return jsonify({'success': True, 'message': 'Đặt vé thành công!', 'quote': quote.to_dict()})
         
     except Exception as e:
-        print(f"Error in process_booking: {str(e)}")
-        return jsonify({'success': False, 'message': 'Đã xảy ra lỗi khi xử lý đặt vé.'})
+        db.session.rollback()
+        metrics.bookings.labels(payment_method=method_label, outcome='error').inc()
+        booking_logger.exception('booking failed', extra={'payment_method': method_label})
+        # 500 để Idempotency-Key được giải phóng: lỗi tạm thời (CSDL) không bị phát lại, gửi lại cùng key sẽ đặt vé
+        return jsonify({'success': False, 'message': 'Đã xảy ra lỗi khi xử lý đặt vé.'}), 500
+
+@app.route('/booking/quote', methods=['POST'])
+@login_required
+def booking_quote():
+    """Báo giá phía server cho trang đặt vé (không truy vấn CSDL khi bảng giá đã được cache)"""
+    data = request.get_json(silent=True) or {}
+    try:
+        quote = pricing.quote(data.get('event_id'), data.get('tickets'), data.get('discount_code'),
+                              dao.get_user_customer_group(current_user))
+    except pricing.PricingError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return jsonify({'success': True, 'quote': quote.to_dict()})
+
+@app.route('/waitlist/event/<int:event_id>')
+@login_required
+def waitlist_page(event_id):
+    """Danh sách chờ các loại vé đã hết của sự kiện"""
+    event = Event.query.get_or_404(event_id)
+    ticket_types = [tt for tt in dao.get_all_ticket_types_for_event(event_id) if tt.is_active]
+    available_ids = {tt.id for tt in dao.get_available_ticket_types(ticket_types, current_user.id)}
+    entries = {entry.ticket_type_id: entry for entry in
+               WaitlistEntry.query.filter(WaitlistEntry.user_id == current_user.id,
+                                          WaitlistEntry.ticket_type_id.in_([tt.id for tt in ticket_types]))}
+    positions = {tt_id: waitlist.position(entry) for tt_id, entry in entries.items()
+                 if entry.status == waitlist.WAITING}
+    return render_template('customer/Waitlist.html', event=event, ticket_types=ticket_types,
+                           available_ids=available_ids, entries=entries, positions=positions, now=datetime.utcnow(),
+                           max_quantity=app.config.get('MAX_TICKETS_PER_USER_PER_EVENT', 10))
+
+@app.route('/waitlist/join', methods=['POST'])
+@login_required
+def waitlist_join():
+    """Đăng ký chờ một loại vé đã hết"""
+    ticket_type = TicketType.query.get_or_404(request.form.get('ticket_type_id', type=int))
+    quantity = request.form.get('quantity', 1, type=int)
+    max_quantity = app.config.get('MAX_TICKETS_PER_USER_PER_EVENT', 10)
+    if not ticket_type.is_active or not 1 <= quantity <= max_quantity:
+        flash(f'Số lượng chờ phải từ 1 đến {max_quantity} vé.', 'error')
+    elif dao.get_available_ticket_types([ticket_type], current_user.id):
+        flash('Loại vé này vẫn còn, bạn có thể đặt vé ngay.', 'info')
+        return redirect(url_for('book_ticket', event_id=ticket_type.event_id))
+    else:
+        waitlist.join(ticket_type, current_user.id, quantity)
+        flash('Bạn đã vào danh sách chờ, chúng tôi sẽ thông báo khi có vé.', 'success')
+    return redirect(url_for('waitlist_page', event_id=ticket_type.event_id))
+
+@app.route('/waitlist/leave', methods=['POST'])
+@login_required
+def waitlist_leave():
+    """Rời danh sách chờ (vé đang được mời sẽ chuyển cho người kế tiếp)"""
+    ticket_type = TicketType.query.get_or_404(request.form.get('ticket_type_id', type=int))
+    if waitlist.leave(ticket_type.id, current_user.id):
+        waitlist.allocate([ticket_type.id])
+        flash('Bạn đã rời danh sách chờ.', 'info')
+    return redirect(url_for('waitlist_page', event_id=ticket_type.event_id))
+
+@app.route('/waitlist/claim/<int:ticket_type_id>')
+@login_required
+def waitlist_claim(ticket_type_id):
+    """Link trong thông báo mời mua: còn hạn thì vào thẳng trang đặt vé (kể cả khi sự kiện mở phòng chờ)"""
+    ticket_type = TicketType.query.get_or_404(ticket_type_id)
+    offer = waitlist.active_offer(ticket_type_id, current_user.id)
+    if offer is None:
+        flash('Lời mời mua vé đã hết hạn hoặc không tồn tại.', 'warning')
+        return redirect(url_for('waitlist_page', event_id=ticket_type.event_id))
+    token = waiting_room.make_token(ticket_type.event_id, current_user.id, offer.offer_expires_at)
+    session['admission_tokens'] = {**session.get('admission_tokens', {}), str(ticket_type.event_id): token}
+    return redirect(url_for('book_ticket', event_id=ticket_type.event_id))
 
 @app.route('/vnpay/create_payment', methods=['POST'])
 def vnpay_create_payment():
@@ -1171,6 +1396,10 @@ def vnpay_create_payment():
     return jsonify({'payment_url': payment_url})
 
 @app.route('/vnpay/redirect')
+# VNPay (hoặc trình duyệt) gọi lại cùng giao dịch: trả lại trang kết quả đã lưu, không xử lý thanh toán lần nữa.
+# Chỉ lưu trang của giao dịch thành công; claim_payment đã bảo đảm mỗi payment chỉ được xử lý một lần
+@idempotency.idempotent('vnpay', get_key=lambda: request.args.get('vnp_TxnRef'), per_user=False,
+                        store=lambda response: request.args.get('vnp_ResponseCode') == '00')
 def vnpay_redirect():
     return dao.vnpay_redirect_flask()
 
@@ -1182,7 +1411,6 @@ def cleanup():
 @app.route('/debug/session')
 def debug_session():
     """Debug session info"""
-    import json
     session_info = {
         'current_user_authenticated': current_user.is_authenticated,
         'current_user_id': current_user.id if current_user.is_authenticated else None,
@@ -1195,7 +1423,6 @@ def debug_session():
 @app.route('/debug/full-session')
 def debug_full_session():
     """Debug session info chi tiết"""
-    import json
     session_info = {
         'request_headers': dict(request.headers),
         'request_cookies': dict(request.cookies),
@@ -1254,34 +1481,37 @@ def page_not_found(e):
 def staff_scan_ticket():
     if current_user.role.value != 'staff':
         abort(403)
-    from eventapp.models import Ticket, UserNotification
-    from eventapp import db
-    from datetime import datetime
-    from flask import jsonify, request, render_template
-    import sys
     if request.method == 'GET':
         return render_template('staff/scan_ticket.html')
     # POST: xử lý quét QR
-    data = request.get_json()
+    with metrics.checkin_seconds.time():
+        result, response = _scan_ticket(request.get_json())
+    metrics.checkins.labels(result=result).inc()
+    return response
+
+
+def _scan_ticket(data):
+    """Check-in một vé theo dữ liệu QR, trả về (kết quả cho metrics, response)"""
     qr_data = data.get('qr_data') if data else None
     if not qr_data:
-        print('No qr_data received', file=sys.stderr)
-        return jsonify({'success': False, 'message': 'Không nhận được dữ liệu QR.'}), 400
+        checkin_logger.info('scan rejected: no QR data')
+        return 'missing_data', (jsonify({'success': False, 'message': 'Không nhận được dữ liệu QR.'}), 400)
     ticket = Ticket.query.filter_by(uuid=qr_data).first()
     if not ticket:
-        print('Ticket not found', file=sys.stderr)
-        return jsonify({'success': False, 'message': 'Vé không hợp lệ hoặc không tồn tại.'}), 404
+        checkin_logger.info('scan rejected: ticket not found')
+        return 'not_found', (jsonify({'success': False, 'message': 'Vé không hợp lệ hoặc không tồn tại.'}), 404)
     if not ticket.is_paid:
-        print('Ticket not paid', file=sys.stderr)
-        return jsonify({'success': False, 'message': 'Vé chưa được thanh toán.'}), 400
+        checkin_logger.info('scan rejected: ticket not paid', extra={'event_id': ticket.event_id, 'ticket_id': ticket.id})
+        return 'unpaid', (jsonify({'success': False, 'message': 'Vé chưa được thanh toán.'}), 400)
     if ticket.is_checked_in:
-        print('Ticket already checked in', file=sys.stderr)
-        return jsonify({'success': False, 'message': 'Vé đã được check-in trước đó.'}), 400
+        checkin_logger.info('scan rejected: ticket already checked in',
+                            extra={'event_id': ticket.event_id, 'ticket_id': ticket.id})
+        return 'already_checked_in', (jsonify({'success': False, 'message': 'Vé đã được check-in trước đó.'}), 400)
     # Cập nhật trạng thái check-in
     ticket.check_in()
     db.session.commit()
+    checkin_stats.counters.record(ticket.event_id, ticket.ticket_type_id, ticket.check_in_date)
     # Tạo Notification và gửi cho user
-    from eventapp.models import Notification
     notif_title = f'Check-in thành công'
     notif_msg = f'Vé cho sự kiện "{ticket.event.title}" đã được check-in thành công lúc {ticket.check_in_date.strftime("%H:%M %d/%m/%Y")}. '
     notification = Notification(
@@ -1292,17 +1522,107 @@ def staff_scan_ticket():
     )
     db.session.add(notification)
     db.session.flush()  # Đảm bảo notification.id có giá trị
-    print(f'[DEBUG] Đã tạo Notification id={notification.id} cho user_id={ticket.user_id}', file=sys.stderr)
     notification.send_to_user(ticket.user)
     db.session.commit()
-    print(f'[DEBUG] Đã gửi notification cho user_id={ticket.user_id}', file=sys.stderr)
-    print(f'Check-in thành công cho vé của {ticket.user.username}', file=sys.stderr)
-    return jsonify({'success': True, 'message': f'Check-in thành công cho vé của {ticket.user.username}.'})
+    # Mỗi lượt quét một dòng: ở mức DEBUG để có thể lấy mẫu bằng LOG_SAMPLE_RATES
+    checkin_logger.debug('ticket checked in', extra={
+        'event_id': ticket.event_id, 'ticket_id': ticket.id, 'ticket_owner_id': ticket.user_id,
+        'notification_id': notification.id})
+    return 'ok', jsonify({'success': True, 'message': f'Check-in thành công cho vé của {ticket.user.username}.'})
+
+@app.route('/staff/scan-ticket/batch', methods=['POST'])
+@login_required
+def staff_scan_ticket_batch():
+    """Check-in hàng loạt (dùng cho cổng soát vé tự động gửi theo lô).
+    Body: {"uuids": [...], "event_id": <sự kiện nhân viên được gán; vé của sự kiện khác trả về 'unknown'>}"""
+    if current_user.role.value != 'staff':
+        abort(403)
+    data = request.get_json(silent=True) or {}
+    uuids = data.get('uuids')
+    if not isinstance(uuids, list) or not uuids:
+        return jsonify({'success': False, 'message': 'Không nhận được danh sách vé.'}), 400
+    if len(uuids) > app.config.get('BATCH_CHECKIN_MAX', 1000):
+        return jsonify({'success': False, 'message': 'Quá nhiều vé trong một lô.'}), 413
+    try:
+        event_id = int(data['event_id'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Thiếu hoặc sai event_id.'}), 400
+    if not dao.is_staff_assigned_to_event(current_user.id, event_id):
+        abort(403)
+    results = dao.bulk_check_in([str(u).strip() for u in uuids], event_id)
+    summary = {}
+    for status in results.values():
+        summary[status] = summary.get(status, 0) + 1
+    return jsonify({'success': True, 'summary': summary, 'results': results})
+
+@app.route('/staff/event/<int:event_id>/manifest', methods=['GET'])
+@login_required
+def staff_ticket_manifest(event_id):
+    """Tải manifest vé (nhị phân, có chữ ký) cho chế độ quét offline.
+    ?since=<unix timestamp> để chỉ lấy phần thay đổi kể từ manifest trước."""
+    if current_user.role.value != 'staff':
+        abort(403)
+    if not dao.is_staff_assigned_to_event(current_user.id, event_id):
+        abort(403)
+    signing_key = manifest.load_signing_key(app.config['GATE_MANIFEST_SIGNING_KEY'])
+    if signing_key is None:
+        return jsonify({'success': False, 'message': 'Chưa cấu hình khóa ký manifest (GATE_MANIFEST_SIGNING_KEY).'}), 503
+    since = None
+    if request.args.get('since'):
+        try:
+            since = manifest.from_timestamp(float(request.args['since']))
+        except (TypeError, ValueError, OverflowError):
+            return jsonify({'success': False, 'message': 'Tham số since không hợp lệ.'}), 400
+    generated_at = datetime.utcnow()
+    valid, checked = dao.get_ticket_manifest(event_id, since)
+    blob = manifest.encode_manifest(
+        event_id, valid, checked,
+        signing_key=signing_key,
+        generated_at=generated_at,
+        since=since
+    )
+    response = app.response_class(blob, mimetype='application/octet-stream')
+    response.headers['X-Manifest-Generated-At'] = repr(manifest.to_timestamp(generated_at))
+    response.headers['Content-Disposition'] = f'attachment; filename=event_{event_id}_manifest.bin'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/staff/gate/manifest-key', methods=['GET'])
+@login_required
+def staff_manifest_key():
+    """Public key (Ed25519, base64) để máy quét kiểm tra chữ ký manifest"""
+    if current_user.role.value != 'staff':
+        abort(403)
+    signing_key = manifest.load_signing_key(app.config['GATE_MANIFEST_SIGNING_KEY'])
+    if signing_key is None:
+        return jsonify({'success': False, 'message': 'Chưa cấu hình khóa ký manifest (GATE_MANIFEST_SIGNING_KEY).'}), 503
+    return jsonify({'success': True, 'algorithm': 'Ed25519', 'public_key': manifest.public_key(signing_key)})
+
+@app.route('/staff/event/<int:event_id>/offline-checkins', methods=['POST'])
+@login_required
+def staff_offline_checkins(event_id):
+    """Đồng bộ hàng loạt các lượt check-in đã ghi nhận offline"""
+    if current_user.role.value != 'staff':
+        abort(403)
+    if not dao.is_staff_assigned_to_event(current_user.id, event_id):
+        abort(403)
+    data = request.get_json(silent=True) or {}
+    checkins = data.get('checkins')
+    if not isinstance(checkins, list) or not checkins:
+        return jsonify({'success': False, 'message': 'Không có dữ liệu check-in.'}), 400
+    if len(checkins) > app.config.get('OFFLINE_CHECKIN_MAX_BATCH', 5000):
+        return jsonify({'success': False, 'message': 'Quá nhiều lượt check-in trong một lần đồng bộ.'}), 413
+    results = dao.reconcile_offline_checkins(event_id, [c for c in checkins if isinstance(c, dict)])
+    summary = {}
+    for result in results.values():
+        summary[result['status']] = summary.get(result['status'], 0) + 1
+    conflicts = {u: r for u, r in results.items() if r['status'] not in ('ok', 'duplicate')}
+    logging.info(f"[OFFLINE_CHECKIN] staff={current_user.id} event={event_id} summary={summary}")
+    return jsonify({'success': True, 'summary': summary, 'results': results, 'conflicts': conflicts})
 
 @app.route('/notifications/mark-read/<int:noti_id>', methods=['POST'])
 @login_required
 def mark_notification_read(noti_id):
-    from eventapp.models import UserNotification
     noti = UserNotification.query.filter_by(id=noti_id, user_id=current_user.id).first()
     if not noti:
         return jsonify({'success': False, 'message': 'Notification not found'}), 404
@@ -1313,7 +1633,6 @@ def mark_notification_read(noti_id):
 @app.route('/notifications/mark-all-read', methods=['POST'])
 @login_required
 def mark_all_notifications_read():
-    from eventapp.models import UserNotification
     notis = UserNotification.query.filter_by(user_id=current_user.id, is_read=False).all()
     for n in notis:
         n.mark_as_read()
@@ -0,0 +1,26 @@
+import os
+import unittest
+from sqlalchemy.engine import make_url
+from eventapp.app import app
+from eventapp import db
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """Mỗi test bắt đầu với schema mới trên DB test do conftest.py cấu hình, xoá khi test kết thúc"""
+
+    def setUp(self):
+        super().setUp()
+        app.config['TESTING'] = True
+        with app.app_context():
+            test_database = os.environ.get('TEST_DATABASE_URL')
+            if not test_database or db.engine.url != make_url(test_database):
+                # Không chạy qua pytest (conftest.py): drop_all sẽ xoá DB đang cấu hình của app
+                raise unittest.SkipTest('Chạy bằng pytest hoặc đặt DATABASE_URL=TEST_DATABASE_URL trỏ tới DB test')
+            db.drop_all()
+            db.create_all()
+        self.addCleanup(self.drop_database)
+
+    def drop_database(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
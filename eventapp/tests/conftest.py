@@ -0,0 +1,16 @@
+"""Test chạy trên DB tạm thay vì DB phát triển (instance/eventapp.db).
+
+DATABASE_URL phải được đặt trước khi import eventapp vì engine được tạo lúc import.
+Đặt TEST_DATABASE_URL để chạy test trên một DB PostgreSQL/MySQL riêng cho test.
+"""
+import atexit
+import os
+import shutil
+import tempfile
+
+if not os.environ.get('TEST_DATABASE_URL'):
+    _tmp_dir = tempfile.mkdtemp(prefix='eventapp-tests-')
+    atexit.register(shutil.rmtree, _tmp_dir, ignore_errors=True)
+    os.environ['TEST_DATABASE_URL'] = 'sqlite:///' + os.path.join(_tmp_dir, 'eventapp.db')
+os.environ['DATABASE_URL'] = os.environ['TEST_DATABASE_URL']
+os.environ.pop('DATABASE_REPLICA_URLS', None)
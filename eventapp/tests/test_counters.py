@@ -0,0 +1,86 @@
+import unittest
+from datetime import datetime, timedelta
+from decimal import Decimal
+from sqlalchemy import event, text
+from eventapp.app import app
+from eventapp import db, counters
+from eventapp.models import CustomerGroup, Event, EventCategory, Payment, PaymentMethod, Ticket, TicketType, User, UserRole
+from base import DatabaseTestCase
+
+
+class TestCounters(DatabaseTestCase):
+    """Tăng counter bằng một câu UPDATE biểu thức (không mất cập nhật khi chạy song song)"""
+
+    def setUp(self):
+        super().setUp()
+        self.ctx = app.app_context()
+        self.ctx.push()
+        self.user = User(username='counter_user', email='counter_user@example.com', password_hash='x',
+                         role=UserRole.customer, total_spent=100000, created_at=datetime.utcnow() - timedelta(days=30))
+        db.session.add(self.user)
+        db.session.flush()
+        now = datetime.utcnow()
+        event_ = Event(organizer_id=self.user.id, title='Counter Event', description='...', category=EventCategory.music,
+                       location='HCM', is_active=True, start_time=now + timedelta(days=1), end_time=now + timedelta(days=2))
+        db.session.add(event_)
+        db.session.flush()
+        self.types = [TicketType(event_id=event_.id, name=f'T{i}', price=100000, total_quantity=10) for i in range(2)]
+        db.session.add_all(self.types)
+        db.session.flush()
+        self.event_id = event_.id
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        self.ctx.pop()
+
+    def count_updates(self):
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith('UPDATE'):
+                statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', record)
+        self.addCleanup(event.remove, db.engine, 'before_cursor_execute', record)
+        return statements
+
+    def make_tickets(self, counts, payment_id=None):
+        tickets = [Ticket(user_id=self.user.id, event_id=self.event_id, ticket_type_id=tt.id,
+                          payment_id=payment_id)
+                   for tt, n in zip(self.types, counts) for _ in range(n)]
+        db.session.add_all(tickets)
+        db.session.flush()
+        return tickets
+
+    def test_add_sold_is_one_statement_for_all_ticket_types(self):
+        tickets = self.make_tickets([2, 1])
+        updates = self.count_updates()
+        counters.add_sold(tickets)
+        self.assertEqual(len(updates), 1)
+        db.session.commit()
+        self.assertEqual([tt.sold_quantity for tt in self.types], [2, 1])
+
+    def test_add_spent_does_not_lose_concurrent_updates(self):
+        self.assertEqual(self.user.total_spent, Decimal('100000'))
+        # Một worker khác cộng tiền sau khi user đã được nạp vào session này
+        with db.engine.begin() as conn:
+            conn.execute(text('UPDATE users SET total_spent = total_spent + 300000 WHERE id = :id'), {'id': self.user.id})
+        counters.add_spent(self.user.id, Decimal('200000'))
+        db.session.commit()
+        self.assertEqual(self.user.total_spent, Decimal('600000'))
+        self.assertEqual(self.user.customer_group, CustomerGroup.vip)
+
+    def test_payment_save_counts_newly_paid_tickets(self):
+        payment = Payment(user_id=self.user.id, amount=300000, payment_method=PaymentMethod.vnpay, status=True,
+                          transaction_id='COUNTERS_1')
+        db.session.add(payment)
+        db.session.flush()
+        self.make_tickets([1, 2], payment_id=payment.id)
+        payment.save()
+        self.assertEqual([tt.sold_quantity for tt in self.types], [1, 2])
+        payment.save()
+        self.assertEqual([tt.sold_quantity for tt in self.types], [1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
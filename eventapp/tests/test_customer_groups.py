@@ -0,0 +1,59 @@
+import unittest
+from datetime import datetime, timedelta
+from eventapp.app import app
+from eventapp import db, dao, customer_groups
+from eventapp.models import CustomerGroup, DiscountCode, User, UserRole
+from base import DatabaseTestCase
+
+
+class TestCustomerGroups(DatabaseTestCase):
+    """Cột users.customer_group lưu sẵn và job cập nhật theo lô"""
+
+    def setUp(self):
+        super().setUp()
+        self.ctx = app.app_context()
+        self.ctx.push()
+
+    def tearDown(self):
+        db.session.remove()
+        self.ctx.pop()
+
+    def add_user(self, name, total_spent=0, days_old=None):
+        user = User(username=name, email=f'{name}@example.com', password_hash='x', role=UserRole.customer,
+                    total_spent=total_spent)
+        if days_old is not None:
+            user.created_at = datetime.utcnow() - timedelta(days=days_old)
+        db.session.add(user)
+        db.session.commit()
+        return user
+
+    def test_group_is_set_on_insert(self):
+        self.assertEqual(self.add_user('fresh').customer_group, CustomerGroup.new)
+        self.assertEqual(self.add_user('old', 0, days_old=30).customer_group, CustomerGroup.regular)
+        self.assertEqual(self.add_user('big', 600000, days_old=30).customer_group, CustomerGroup.vip)
+        self.assertEqual(self.add_user('huge', 2000000, days_old=30).customer_group, CustomerGroup.super_vip)
+
+    def test_refresh_expires_new_customers_in_one_statement(self):
+        fresh = self.add_user('fresh')
+        self.add_user('old', 0, days_old=30)
+        self.assertEqual(customer_groups.refresh(now=datetime.utcnow() + timedelta(days=1)), 0)
+        self.assertEqual(customer_groups.refresh(now=datetime.utcnow() + timedelta(days=8)), 1)
+        db.session.expire_all()
+        self.assertEqual(fresh.customer_group, CustomerGroup.regular)
+        self.assertEqual(User.query.filter_by(customer_group=CustomerGroup.new).count(), 0)
+
+    def test_payment_updates_group(self):
+        user = self.add_user('buyer', 400000, days_old=30)
+        dao.update_user_and_event_after_payment(user.id, None, 200000)
+        self.assertEqual(db.session.get(User, user.id).customer_group, CustomerGroup.vip)
+        self.assertEqual(DiscountCode().get_user_group(user), CustomerGroup.vip)
+
+    def test_cli_command(self):
+        self.add_user('old', 0, days_old=30)
+        result = app.test_cli_runner().invoke(args=['refresh-customer-groups'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('0 users moved', result.output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,12 @@
 import unittest
+from flask_testing import TestCase
+from sqlalchemy import event as sa_event
+from werkzeug.security import generate_password_hash
+from datetime import datetime, timedelta
 from eventapp.app import app
+from eventapp import dao, db
+from eventapp.models import User, UserRole, Event, EventCategory, TicketType, Ticket
+from base import DatabaseTestCase
 
 class TestCustomerTickets(unittest.TestCase):
     def setUp(self):
@@ -19,5 +26,107 @@ class TestCustomerTickets(unittest.TestCase):
                 self.assertEqual(response.status_code, 200)
                 self.assertIn(b'Ticket', response.data)
 
+
+class TestTicketWallet(DatabaseTestCase, TestCase):
+    """Ví vé: nhóm theo sự kiện và số truy vấn không tăng theo số vé"""
+
+    def create_app(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        return app
+
+    def setUp(self):
+        super().setUp()
+        self.client = self.app.test_client()
+        organizer = User(username='wallet_org', email='wallet_org@example.com',
+                         password_hash=generate_password_hash('Password@123'), role=UserRole.organizer)
+        self.customer = User(username='wallet_customer', email='wallet_customer@example.com',
+                             password_hash=generate_password_hash('Password@123'), role=UserRole.customer)
+        db.session.add_all([organizer, self.customer])
+        db.session.commit()
+        now = datetime.utcnow()
+        for i, title in enumerate(['Wallet Concert', 'Wallet Workshop']):
+            event = Event(organizer_id=organizer.id, title=title, description='...',
+                          category=EventCategory.music, location='HCM',
+                          start_time=now + timedelta(days=i + 1), end_time=now + timedelta(days=i + 1, hours=2))
+            db.session.add(event)
+            db.session.commit()
+            ticket_type = TicketType(event_id=event.id, name=f'VIP {i}', price=100000, total_quantity=100)
+            db.session.add(ticket_type)
+            db.session.commit()
+            for _ in range(15):
+                db.session.add(Ticket(user_id=self.customer.id, event_id=event.id, ticket_type_id=ticket_type.id,
+                                      is_paid=True, purchase_date=now))
+        db.session.commit()
+        self.client.post('/auth/login', data={'username_or_email': 'wallet_customer', 'password': 'Password@123'})
+
+    def tearDown(self):
+        db.session.remove()
+
+    def count_queries(self, url):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith('SELECT'):
+                statements.append(statement)
+
+        sa_event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            response = self.client.get(url)
+        finally:
+            sa_event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+        return response, len(statements)
+
+    def test_wallet_groups_tickets_by_event(self):
+        response, _ = self.count_queries('/my-tickets')
+        self.assertEqual(response.status_code, 200)
+        html = response.get_data(as_text=True)
+        self.assertIn('Wallet Concert', html)
+        self.assertIn('Wallet Workshop', html)
+        self.assertEqual(html.count('15 vé'), 2)
+        # Sự kiện sắp diễn ra gần nhất đứng trước
+        self.assertLess(html.index('Wallet Concert'), html.index('Wallet Workshop'))
+
+    def test_wallet_puts_past_events_last_and_pages_by_event(self):
+        now = datetime.utcnow()
+        for days_ago in (3, 1):
+            event = Event(organizer_id=Event.query.first().organizer_id, title=f'Past {days_ago}', description='...',
+                          category=EventCategory.music, location='HCM', start_time=now - timedelta(days=days_ago),
+                          end_time=now - timedelta(days=days_ago, hours=-2))
+            db.session.add(event)
+            db.session.commit()
+            ticket_type = TicketType(event_id=event.id, name='GA', price=100000, total_quantity=100)
+            db.session.add(ticket_type)
+            db.session.commit()
+            db.session.add(Ticket(user_id=self.customer.id, event_id=event.id, ticket_type_id=ticket_type.id,
+                                  is_paid=True, purchase_date=now))
+        db.session.commit()
+
+        _, groups = dao.get_ticket_wallet(self.customer.id, per_page=3)
+        self.assertEqual([event.title for event, _ in groups], ['Wallet Concert', 'Wallet Workshop', 'Past 1'])
+        self.assertEqual([len(tickets) for _, tickets in groups], [15, 15, 1])
+        pagination, groups = dao.get_ticket_wallet(self.customer.id, page=2, per_page=3)
+        self.assertEqual([event.title for event, _ in groups], ['Past 3'])
+        self.assertEqual(pagination.total, 4)
+
+    def test_wallet_query_count_is_constant(self):
+        _, before = self.count_queries('/my-tickets')
+        for ticket_type in TicketType.query.all():
+            for _ in range(20):
+                db.session.add(Ticket(user_id=self.customer.id, event_id=ticket_type.event_id,
+                                      ticket_type_id=ticket_type.id, is_paid=True, purchase_date=datetime.utcnow()))
+        db.session.commit()
+        self.client.get('/my-tickets')  # nạp lại user vào cache sau khi commit
+        _, after = self.count_queries('/my-tickets')
+        # Thêm 40 vé: số truy vấn phải như nhau
+        self.assertEqual(before, after)
+
+    def test_profile_preloads_recent_tickets(self):
+        response, queries = self.count_queries('/profile')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('VIP', response.get_data(as_text=True))
+        self.assertLess(queries, 10)
+
+
 if __name__ == '__main__':
     unittest.main()
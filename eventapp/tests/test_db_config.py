@@ -0,0 +1,75 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import NullPool
+from eventapp.app import app
+from eventapp import db, db_config
+
+
+class TestEngineOptions(unittest.TestCase):
+    def test_sqlite_keeps_defaults(self):
+        self.assertEqual(db_config.engine_options('sqlite:///eventapp.db'), {})
+
+    def test_production_postgres_profile(self):
+        with mock.patch.dict(os.environ, {}, clear=True):
+            options = db_config.engine_options('postgresql://u:p@db/eventhub', 'production')
+        self.assertIs(options['poolclass'], db_config.TimedQueuePool)
+        self.assertEqual(options['pool_size'], 5)
+        self.assertTrue(options['pool_pre_ping'])
+        self.assertEqual(options['pool_recycle'], 1800)
+        self.assertEqual(options['connect_args'], {'options': '-c statement_timeout=15000'})
+
+    def test_env_overrides_and_pgbouncer(self):
+        with mock.patch.dict(os.environ, {'DB_POOL_SIZE': '12', 'DB_STATEMENT_TIMEOUT_MS': '0'}, clear=True):
+            options = db_config.engine_options('postgresql://u:p@db/eventhub', 'development')
+        self.assertEqual(options['pool_size'], 12)
+        self.assertNotIn('connect_args', options)
+        with mock.patch.dict(os.environ, {'DB_PGBOUNCER': '1'}, clear=True):
+            self.assertEqual(db_config.engine_options('postgresql://u:p@db/eventhub'), {'poolclass': NullPool})
+
+
+class TestPoolMetrics(unittest.TestCase):
+    def test_checkout_wait_and_timeout_are_recorded(self):
+        path = os.path.join(tempfile.mkdtemp(), 'pool.db')
+        engine = create_engine(f'sqlite:///{path}', poolclass=db_config.TimedQueuePool,
+                               pool_size=1, max_overflow=0, pool_timeout=0.05)
+        metrics = db_config.pool_metrics
+        saved_engine = metrics.engine
+        metrics.reset()
+        metrics.attach(engine)
+        try:
+            held = engine.connect()
+            with self.assertRaises(PoolTimeoutError):
+                engine.connect()
+            snapshot = metrics.snapshot()
+            self.assertEqual(snapshot['checkouts'], 1)
+            self.assertEqual(snapshot['checked_out'], 1)
+            self.assertEqual(snapshot['timeouts'], 1)
+            self.assertGreaterEqual(snapshot['wait_seconds_max'], 0.05)
+            held.close()
+        finally:
+            metrics.engine = saved_engine
+            engine.dispose()
+
+
+class TestHealthEndpoint(unittest.TestCase):
+    def test_health_db_reports_pool(self):
+        client = app.test_client()
+        response = client.get('/health/db')
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(data['status'], 'ok')
+        self.assertIn('checkouts', data['pool'])
+
+    def test_health_db_failure_returns_503(self):
+        with mock.patch.object(db.session, 'execute', side_effect=RuntimeError('down')):
+            response = app.test_client().get('/health/db')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.get_json()['status'], 'error')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from datetime import datetime, timedelta
+from flask import g
+from flask_testing import TestCase
+from eventapp.app import app
+from eventapp import db, dao, db_routing
+from eventapp.models import Event, EventCategory
+from base import DatabaseTestCase
+
+
+class TestReplicaRouting(DatabaseTestCase, TestCase):
+    """Đọc từ replica (SQLite thứ hai) và giữ primary sau khi ghi"""
+
+    def create_app(self):
+        app.config['TESTING'] = True
+        return app
+
+    def setUp(self):
+        super().setUp()
+        row = dict(id=1, organizer_id=1, description='...', category=EventCategory.music, location='HCM',
+                   start_time=datetime.utcnow() + timedelta(days=1), end_time=datetime.utcnow() + timedelta(days=2),
+                   is_active=True)
+        # Ghi vào primary trước khi bật replica để request hiện tại không bị giữ ở primary
+        db.session.add(Event(title='Primary Event', **row))
+        db.session.commit()
+
+        self.replica_dir = tempfile.mkdtemp()
+        db_routing.replicas.configure([f"sqlite:///{os.path.join(self.replica_dir, 'replica.db')}"])
+        replica = db_routing.replicas.engines[0]
+        db.metadata.create_all(replica)
+        with replica.begin() as connection:
+            connection.execute(Event.__table__.insert(), [dict(title='Replica Event', **row)])
+        db.session.remove()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db_routing.replicas.dispose()
+        shutil.rmtree(self.replica_dir, ignore_errors=True)
+
+    def test_read_only_dao_uses_replica(self):
+        self.assertEqual(dao.get_featured_events()[0].title, 'Replica Event')
+        db.session.remove()
+        # Truy vấn ngoài phạm vi read_only vẫn đi primary
+        self.assertEqual(db.session.get(Event, 1).title, 'Primary Event')
+
+    def test_event_list_page_reads_replica(self):
+        html = self.client.get('/events').get_data(as_text=True)
+        self.assertIn('Replica Event', html)
+
+    def test_writes_pin_request_and_user_to_primary(self):
+        with app.test_request_context('/events'):
+            g.db_wrote = True
+            self.assertEqual(dao.get_featured_events()[0].title, 'Primary Event')
+        db.session.remove()
+
+        with app.test_request_context('/booking/process', method='POST'):
+            self.assertEqual(dao.get_featured_events()[0].title, 'Primary Event')
+        db.session.remove()
+
+        with self.client.session_transaction() as sess:
+            sess[db_routing.STICKY_SESSION_KEY] = time.time() + 60
+        html = self.client.get('/events').get_data(as_text=True)
+        self.assertIn('Primary Event', html)
+
+    def test_flush_marks_request_as_writer(self):
+        with app.test_request_context('/events'):
+            event = db.session.get(Event, 1)
+            event.title = 'Renamed'
+            db.session.commit()
+            self.assertTrue(g.get('db_wrote'))
+            response = app.process_response(app.response_class('ok'))
+            self.assertIn('Set-Cookie', response.headers)
+
+
+if __name__ == '__main__':
+    unittest.main()
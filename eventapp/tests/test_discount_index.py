@@ -0,0 +1,90 @@
+import unittest
+from datetime import datetime, timedelta
+from eventapp.app import app
+from eventapp import db, dao, discount_index
+from eventapp.models import CustomerGroup, DiscountCode
+from base import DatabaseTestCase
+
+
+class TestDiscountIndex(DatabaseTestCase):
+    """Danh mục mã giảm giá trong bộ nhớ và đổi mã bằng UPDATE có điều kiện"""
+
+    def setUp(self):
+        super().setUp()
+        self.ctx = app.app_context()
+        self.ctx.push()
+        self.index = discount_index.index
+        self.saved_ttl = self.index.ttl
+        self.index.ttl = 60
+        self.index.invalidate()
+        now = datetime.now()
+        self.now = now
+
+        def code(name, **kwargs):
+            values = dict(code=name, discount_percentage=10, valid_from=now - timedelta(days=1),
+                          valid_to=now + timedelta(days=1), user_group=CustomerGroup.regular, max_uses=10, used_count=0)
+            values.update(kwargs)
+            db.session.add(DiscountCode(**values))
+
+        code('LIMITED')
+        code('UNLIMITED', max_uses=None)
+        code('EXHAUSTED', max_uses=2, used_count=2)
+        code('EXPIRED', valid_to=now - timedelta(hours=1))
+        code('INACTIVE', is_active=False)
+        code('VIPONLY', user_group=CustomerGroup.vip)
+        code('LATER', valid_from=now + timedelta(hours=1))
+        db.session.commit()
+
+    def tearDown(self):
+        self.index.ttl = self.saved_ttl
+        self.index.invalidate()
+        db.session.remove()
+        self.ctx.pop()
+
+    def codes(self, group=CustomerGroup.regular, now=None):
+        return [snapshot.code for snapshot in self.index.for_group(group, now)]
+
+    def test_for_group_filters_and_includes_unlimited_codes(self):
+        self.assertEqual(self.codes(), ['LIMITED', 'UNLIMITED'])
+        self.assertEqual(self.codes(CustomerGroup.vip), ['VIPONLY'])
+        self.assertEqual([c.code for c in dao.get_user_discount_codes(CustomerGroup.regular)], ['LIMITED', 'UNLIMITED'])
+
+    def test_catalogue_is_cached_and_refreshed_on_change(self):
+        self.codes()
+        loads = self.index.loads
+        self.codes()
+        self.index.get('LIMITED')
+        self.assertEqual(self.index.loads, loads)
+
+        DiscountCode.query.filter_by(code='LIMITED').first().is_active = False
+        db.session.commit()
+        self.assertEqual(self.codes(), ['UNLIMITED'])
+        self.assertEqual(self.index.loads, loads + 1)
+
+    def test_catalogue_reloads_when_a_code_becomes_valid(self):
+        self.codes()
+        loads = self.index.loads
+        self.assertIn('LATER', self.codes(now=self.now + timedelta(hours=2)))
+        self.assertEqual(self.index.loads, loads + 1)
+
+    def test_redeem_enforces_max_uses(self):
+        limited = DiscountCode.query.filter_by(code='LIMITED').first()
+        limited.max_uses = 1
+        db.session.commit()
+        self.assertTrue(discount_index.redeem(limited.id))
+        self.assertFalse(discount_index.redeem(limited.id))
+        db.session.commit()
+        db.session.expire_all()
+        self.assertEqual(limited.used_count, 1)
+        self.assertNotIn('LIMITED', self.codes())
+
+        unlimited = DiscountCode.query.filter_by(code='UNLIMITED').first()
+        for _ in range(3):
+            self.assertTrue(discount_index.redeem(unlimited.id))
+        db.session.commit()
+        db.session.expire_all()
+        self.assertEqual(unlimited.used_count, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,241 @@
+import unittest
+from flask_testing import TestCase
+from eventapp.app import app
+from eventapp import dao, db, manifest, checkin_stats
+from eventapp.models import User, UserRole, Event, EventCategory, Notification, TicketType, Ticket
+from werkzeug.security import generate_password_hash
+from datetime import datetime, timedelta
+from unittest import mock
+import uuid
+from base import DatabaseTestCase
+
+
+class TestManifestFormat(unittest.TestCase):
+    """Unit tests for the binary manifest encoding."""
+
+    def test_round_trip_and_lookup(self):
+        valid = [str(uuid.uuid4()) for _ in range(50)]
+        checked = [str(uuid.uuid4()) for _ in range(5)]
+        now = datetime.utcnow().replace(microsecond=0)
+        key = manifest.load_signing_key(manifest.generate_signing_key())
+        blob = manifest.encode_manifest(7, valid, checked, signing_key=key, generated_at=now)
+        decoded = manifest.decode_manifest(blob, manifest.public_key(key))
+        self.assertEqual(decoded['event_id'], 7)
+        self.assertEqual(decoded['generated_at'], now)
+        self.assertIsNone(decoded['since'])
+        for ticket_uuid in valid:
+            self.assertTrue(manifest.contains(decoded['valid'], ticket_uuid))
+        self.assertFalse(manifest.contains(decoded['valid'], checked[0]))
+        self.assertTrue(manifest.contains(decoded['checked'], checked[0]))
+        self.assertFalse(manifest.contains(decoded['valid'], 'not-a-uuid'))
+        self.assertEqual(sorted(manifest.iter_uuids(decoded['checked'])), sorted(checked))
+
+    def test_tampered_manifest_is_rejected(self):
+        key = manifest.load_signing_key(manifest.generate_signing_key())
+        other = manifest.load_signing_key(manifest.generate_signing_key())
+        blob = manifest.encode_manifest(1, [str(uuid.uuid4())], [], signing_key=key, generated_at=datetime.utcnow())
+        tampered = blob[:-72] + bytes([blob[-72] ^ 1]) + blob[-71:]
+        with self.assertRaises(ValueError):
+            manifest.decode_manifest(tampered, manifest.public_key(key))
+        with self.assertRaises(ValueError):
+            manifest.decode_manifest(blob, manifest.public_key(other))
+
+
+class TestCheckinCounters(unittest.TestCase):
+    """Worker chỉ quét vé (không phục vụ dashboard) không giữ mãi các lượt check-in đã ghi"""
+
+    def test_record_drops_entries_older_than_reconcile_interval(self):
+        counters = checkin_stats.CheckinCounters(reconcile_interval=30)
+        with mock.patch.object(checkin_stats.time, 'time', return_value=1000.0):
+            for _ in range(100):
+                counters.record(1, 1)
+        with mock.patch.object(checkin_stats.time, 'time', return_value=1031.0):
+            counters.record(1, 1)
+        self.assertEqual(len(counters._events[1]['pending']), 1)
+
+
+class TestOfflineGate(DatabaseTestCase, TestCase):
+    """Integration tests for manifest download and offline check-in upload."""
+
+    def create_app(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        return app
+
+    def setUp(self):
+        super().setUp()
+        self.signing_key = app.config['GATE_MANIFEST_SIGNING_KEY']
+        app.config['GATE_MANIFEST_SIGNING_KEY'] = manifest.generate_signing_key()
+        self.client = self.app.test_client()
+        organizer = User(username='gate_org', email='gate_org@example.com',
+                         password_hash=generate_password_hash('Password@123'), role=UserRole.organizer)
+        self.staff = User(username='gate_staff', email='gate_staff@example.com',
+                          password_hash=generate_password_hash('Password@123'), role=UserRole.staff)
+        customer = User(username='gate_customer', email='gate_customer@example.com',
+                        password_hash=generate_password_hash('Password@123'), role=UserRole.customer)
+        db.session.add_all([organizer, self.staff, customer])
+        db.session.commit()
+        self.event = Event(organizer_id=organizer.id, title='Gate Event', description='...',
+                           category=EventCategory.music, location='Gate',
+                           start_time=datetime.utcnow() + timedelta(hours=1),
+                           end_time=datetime.utcnow() + timedelta(hours=3))
+        db.session.add(self.event)
+        db.session.commit()
+        self.event.staff.append(self.staff)
+        ticket_type = TicketType(event_id=self.event.id, name='GA', price=100, total_quantity=10)
+        db.session.add(ticket_type)
+        db.session.commit()
+        self.paid = Ticket(user_id=customer.id, event_id=self.event.id, ticket_type_id=ticket_type.id,
+                           is_paid=True, purchase_date=datetime.utcnow() - timedelta(days=1))
+        self.unpaid = Ticket(user_id=customer.id, event_id=self.event.id, ticket_type_id=ticket_type.id)
+        self.used = Ticket(user_id=customer.id, event_id=self.event.id, ticket_type_id=ticket_type.id,
+                           is_paid=True, purchase_date=datetime.utcnow() - timedelta(days=1),
+                           is_checked_in=True, check_in_date=datetime.utcnow() - timedelta(minutes=5))
+        db.session.add_all([self.paid, self.unpaid, self.used])
+        db.session.commit()
+        self.client.post('/auth/login', data={'username_or_email': 'gate_staff', 'password': 'Password@123'})
+
+    def tearDown(self):
+        app.config['GATE_MANIFEST_SIGNING_KEY'] = self.signing_key
+        db.session.remove()
+
+    def test_download_manifest(self):
+        public_key = self.client.get('/staff/gate/manifest-key').get_json()['public_key']
+        response = self.client.get(f'/staff/event/{self.event.id}/manifest')
+        self.assertEqual(response.status_code, 200)
+        decoded = manifest.decode_manifest(response.data, public_key)
+        self.assertTrue(manifest.contains(decoded['valid'], self.paid.uuid))
+        self.assertFalse(manifest.contains(decoded['valid'], self.unpaid.uuid))
+        self.assertTrue(manifest.contains(decoded['checked'], self.used.uuid))
+
+        since = response.headers['X-Manifest-Generated-At']
+        delta = self.client.get(f'/staff/event/{self.event.id}/manifest?since={since}')
+        decoded = manifest.decode_manifest(delta.data, public_key)
+        self.assertEqual(decoded['valid'], b'')
+        self.assertEqual(decoded['checked'], b'')
+
+    def test_manifest_disabled_without_signing_key(self):
+        app.config['GATE_MANIFEST_SIGNING_KEY'] = ''
+        self.assertEqual(self.client.get(f'/staff/event/{self.event.id}/manifest').status_code, 503)
+        self.assertEqual(self.client.get('/staff/gate/manifest-key').status_code, 503)
+
+    def test_manifest_requires_assignment(self):
+        self.event.staff.remove(self.staff)
+        db.session.commit()
+        response = self.client.get(f'/staff/event/{self.event.id}/manifest')
+        self.assertEqual(response.status_code, 403)
+
+    def test_upload_offline_checkins(self):
+        scanned_at = (datetime.utcnow() - timedelta(minutes=1)).isoformat()
+        response = self.client.post(f'/staff/event/{self.event.id}/offline-checkins', json={'checkins': [
+            {'uuid': self.paid.uuid, 'checked_in_at': scanned_at},
+            {'uuid': self.unpaid.uuid, 'checked_in_at': scanned_at},
+            {'uuid': self.used.uuid, 'checked_in_at': scanned_at},
+            {'uuid': str(uuid.uuid4()), 'checked_in_at': scanned_at},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        results = response.get_json()['results']
+        self.assertEqual(results[self.paid.uuid]['status'], 'ok')
+        self.assertEqual(results[self.unpaid.uuid]['status'], 'unpaid')
+        self.assertEqual(results[self.used.uuid]['status'], 'already_checked_in')
+        self.assertEqual(len(response.get_json()['conflicts']), 3)
+        ticket = db.session.get(Ticket, self.paid.id)
+        db.session.refresh(ticket)
+        self.assertTrue(ticket.is_checked_in)
+        self.assertEqual(ticket.check_in_date.isoformat(), scanned_at)
+
+
+    def test_batch_check_in(self):
+        unknown = str(uuid.uuid4())
+        response = self.client.post('/staff/scan-ticket/batch', json={
+            'event_id': self.event.id,
+            'uuids': [self.paid.uuid, self.unpaid.uuid, self.used.uuid, unknown, self.paid.uuid]
+        })
+        self.assertEqual(response.status_code, 200)
+        results = response.get_json()['results']
+        self.assertEqual(results, {
+            self.paid.uuid: 'ok',
+            self.unpaid.uuid: 'unpaid',
+            self.used.uuid: 'already_checked_in',
+            unknown: 'unknown',
+        })
+        db.session.expire_all()
+        self.assertTrue(db.session.get(Ticket, self.paid.id).is_checked_in)
+
+        again = self.client.post('/staff/scan-ticket/batch', json={'event_id': self.event.id, 'uuids': [self.paid.uuid]})
+        self.assertEqual(again.get_json()['results'][self.paid.uuid], 'already_checked_in')
+
+    def test_batch_check_in_requires_assigned_event(self):
+        batch = {'uuids': [self.paid.uuid]}
+        self.assertEqual(self.client.post('/staff/scan-ticket/batch', json=batch).status_code, 400)
+        self.assertEqual(self.client.post('/staff/scan-ticket/batch',
+                                          json={**batch, 'event_id': 'abc'}).status_code, 400)
+        self.event.staff.remove(self.staff)
+        db.session.commit()
+        response = self.client.post('/staff/scan-ticket/batch', json={**batch, 'event_id': self.event.id})
+        self.assertEqual(response.status_code, 403)
+        db.session.expire_all()
+        self.assertFalse(db.session.get(Ticket, self.paid.id).is_checked_in)
+
+    def stale_read(self):
+        """Cổng khác check-in self.paid ngay sau khi lô này đọc trạng thái vé"""
+        read = dao.get_tickets_by_uuids
+
+        def get_tickets_by_uuids(*args, **kwargs):
+            found = read(*args, **kwargs)
+            db.session.query(Ticket).filter_by(id=self.paid.id).update(
+                {'is_checked_in': True, 'check_in_date': datetime.utcnow() - timedelta(seconds=1)})
+            db.session.commit()
+            return found
+        return mock.patch.object(dao, 'get_tickets_by_uuids', get_tickets_by_uuids)
+
+    def test_batch_check_in_race_reports_only_flipped_tickets(self):
+        for update_returning in (True, False):  # False: nhánh MySQL, UPDATE từng vé
+            with self.subTest(update_returning=update_returning):
+                db.session.query(Ticket).filter_by(id=self.paid.id).update(
+                    {'is_checked_in': False, 'check_in_date': None})
+                db.session.commit()
+                fresh = Ticket(user_id=self.paid.user_id, event_id=self.event.id,
+                               ticket_type_id=self.paid.ticket_type_id, is_paid=True)
+                db.session.add(fresh)
+                db.session.commit()
+                notifications = Notification.query.count()
+                with self.stale_read(), \
+                        mock.patch.object(db.engine.dialect, 'update_returning', update_returning), \
+                        mock.patch.object(checkin_stats.counters, 'record') as record:
+                    results = dao.bulk_check_in([self.paid.uuid, fresh.uuid], self.event.id)
+                self.assertEqual(results, {self.paid.uuid: 'already_checked_in', fresh.uuid: 'ok'})
+                # Chỉ vé do lô này check-in được thông báo và đếm
+                self.assertEqual(Notification.query.count(), notifications + 1)
+                self.assertEqual(record.call_count, 1)
+
+    def test_offline_sync_race_reports_conflict(self):
+        scanned_at = datetime.utcnow() - timedelta(minutes=1)
+        notifications = Notification.query.count()
+        with self.stale_read(), mock.patch.object(checkin_stats.counters, 'record') as record:
+            results = dao.reconcile_offline_checkins(self.event.id, [
+                {'uuid': self.paid.uuid, 'checked_in_at': scanned_at.isoformat()}])
+        self.assertEqual(results[self.paid.uuid]['status'], 'already_checked_in')
+        self.assertIsNotNone(results[self.paid.uuid]['check_in_date'])
+        self.assertEqual(Notification.query.count(), notifications)
+        record.assert_not_called()
+
+    def test_gate_stats_counts_checkins(self):
+        checkin_stats.counters.reset()
+        self.client.post('/staff/scan-ticket/batch', json={'event_id': self.event.id, 'uuids': [self.paid.uuid]})
+        self.client.post('/auth/logout')
+        self.client.post('/auth/login', data={'username_or_email': 'gate_org', 'password': 'Password@123'})
+        response = self.client.get(f'/organizer/event/{self.event.id}/gate/stats')
+        self.assertEqual(response.status_code, 200)
+        stats = response.get_json()['stats']
+        self.assertEqual(stats['checked_in'], 2)
+        self.assertEqual(stats['paid_tickets'], 2)
+        self.assertEqual(stats['by_ticket_type'][0]['name'], 'GA')
+        self.assertEqual(sum(a['count'] for a in stats['arrivals_per_minute']), 2)
+
+        # Check-in ghi nhận sau lần đồng bộ được cộng dồn từ bộ nhớ, không cần truy vấn lại
+        checkin_stats.counters.record(self.event.id, self.paid.ticket_type_id)
+        self.assertEqual(checkin_stats.counters.snapshot(self.event.id)['checked_in'], 3)
+
+if __name__ == '__main__':
+    unittest.main()
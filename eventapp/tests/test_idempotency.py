@@ -0,0 +1,161 @@
+import os
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+from flask_login.utils import _create_identifier
+from eventapp.app import app
+from eventapp import dao, db, idempotency, rate_limit
+from eventapp.models import (Event, EventCategory, IdempotencyKey, Payment, PaymentMethod, Ticket, TicketType, User,
+                             UserRole)
+from base import DatabaseTestCase
+
+
+class TestIdempotency(DatabaseTestCase):
+    """Idempotency-Key: yêu cầu lặp lại nhận response đã lưu, không tạo thêm Payment/Ticket"""
+
+    def setUp(self):
+        super().setUp()
+        rate_limit.backend.clear()
+        with app.app_context():
+            organizer = User(username='idem_org', email='idem_org@example.com', password_hash='x',
+                             role=UserRole.organizer)
+            customer = User(username='idem_customer', email='idem_customer@example.com', password_hash='x',
+                            role=UserRole.customer)
+            db.session.add_all([organizer, customer])
+            db.session.flush()
+            now = datetime.utcnow()
+            event_ = Event(organizer_id=organizer.id, title='Idempotent Event', description='...',
+                           category=EventCategory.music, location='HCM', is_active=True,
+                           start_time=now + timedelta(days=1), end_time=now + timedelta(days=2))
+            db.session.add(event_)
+            db.session.flush()
+            ticket_type = TicketType(event_id=event_.id, name='GA', price=100000, total_quantity=100)
+            db.session.add(ticket_type)
+            db.session.commit()
+            self.event_id = event_.id
+            self.ticket_type_id = ticket_type.id
+            self.customer_id = customer.id
+        patcher = mock.patch.dict(os.environ, {'VNPAY_TMN_CODE': 'TEST', 'VNPAY_HASH_SECRET': 'secret'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = app.test_client()
+        with app.test_request_context(environ_base=self.client.environ_base):
+            identifier = _create_identifier()
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = str(self.customer_id)
+            sess['_id'] = identifier  # session_protection = 'strong'
+
+    def book(self, key, quantity=2):
+        body = {'event_id': self.event_id, 'payment_method': 'vnpay',
+                'tickets': [{'ticket_type_id': self.ticket_type_id, 'quantity': quantity}]}
+        return self.client.post('/booking/process', json=body, headers={'Idempotency-Key': key} if key else {})
+
+    def test_retry_with_same_key_replays_response(self):
+        first = self.book('booking-1')
+        second = self.book('booking-1')
+        self.assertTrue(first.get_json()['success'])
+        self.assertEqual(second.get_json(), first.get_json())
+        self.assertEqual(second.headers.get('Idempotent-Replayed'), 'true')
+        with app.app_context():
+            self.assertEqual(Payment.query.count(), 1)
+            self.assertEqual(Ticket.query.count(), 2)
+
+        self.book('booking-2')
+        self.book(None)
+        with app.app_context():
+            self.assertEqual(Payment.query.count(), 3)
+
+    def test_same_key_with_different_body_is_rejected(self):
+        self.book('booking-1')
+        response = self.book('booking-1', quantity=3)
+        self.assertEqual(response.status_code, 422)
+        with app.app_context():
+            self.assertEqual(Ticket.query.count(), 2)
+
+    def test_running_request_blocks_repeats_and_errors_release_the_key(self):
+        self.book('busy')
+        with app.app_context():
+            # Giả lập lần gửi đầu vẫn đang chạy
+            IdempotencyKey.query.filter_by(key=f'booking:{self.customer_id}:busy').update({'status_code': None})
+            db.session.commit()
+        self.assertEqual(self.book('busy').status_code, 409)
+
+        with mock.patch.object(dao, 'create_payment', side_effect=RuntimeError('db down')), \
+                mock.patch('eventapp.routes.jsonify', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                self.book('failing')
+        with app.app_context():
+            self.assertIsNone(IdempotencyKey.query.filter(IdempotencyKey.key.like('%:failing')).first())
+        self.assertTrue(self.book('failing').get_json()['success'])
+
+    def test_failed_booking_is_not_replayed(self):
+        with mock.patch.object(dao, 'create_payment', side_effect=RuntimeError('db down')):
+            failed = self.book('transient')
+        self.assertEqual(failed.status_code, 500)
+        self.assertFalse(failed.get_json()['success'])
+        # Lỗi tạm thời không được lưu: gửi lại cùng key sẽ đặt vé
+        retry = self.book('transient')
+        self.assertIsNone(retry.headers.get('Idempotent-Replayed'))
+        self.assertTrue(retry.get_json()['success'])
+
+    def test_replays_do_not_use_rate_limit(self):
+        with mock.patch.dict(app.config, {'RATE_LIMITS': {'booking': {'user': (1, 60)}}}):
+            first = self.book('booking-1')
+            for _ in range(3):
+                retry = self.book('booking-1')
+                self.assertEqual(retry.status_code, 200)
+                self.assertEqual(retry.get_json(), first.get_json())
+            limited = self.book('booking-2')
+            self.assertEqual(limited.status_code, 429)
+            # 429 không được lưu: hết bị giới hạn thì gửi lại cùng key sẽ đặt vé thật
+            rate_limit.backend.clear()
+            self.assertTrue(self.book('booking-2').get_json()['success'])
+        with app.app_context():
+            self.assertEqual(Payment.query.count(), 2)
+
+    def callback(self, txn_ref, code):
+        with mock.patch.object(Ticket, 'generate_qr_code'), mock.patch('eventapp.utils.send_ticket_email'):
+            return self.client.get('/vnpay/redirect', query_string={'vnp_ResponseCode': code, 'vnp_TxnRef': txn_ref})
+
+    def test_vnpay_callback_stores_only_successful_payments(self):
+        payment_url = self.book('booking-1').get_json()['payment_url']
+        txn_ref = parse_qs(urlparse(payment_url).query)['vnp_TxnRef'][0]
+        # Giao dịch thất bại không được lưu: lần thanh toán lại thành công vẫn được xử lý
+        self.assertIsNone(self.callback(txn_ref, '24').headers.get('Idempotent-Replayed'))
+        first = self.callback(txn_ref, '00')
+        self.assertIsNone(first.headers.get('Idempotent-Replayed'))
+        with app.app_context():
+            self.assertTrue(Payment.query.one().status)
+            self.assertEqual(Ticket.query.filter_by(is_paid=True).count(), 2)
+
+        replay = self.callback(txn_ref, '00')
+        self.assertEqual(replay.headers.get('Idempotent-Replayed'), 'true')
+        self.assertEqual(replay.get_data(), first.get_data())
+        # Cùng vnp_TxnRef nhưng query string khác: không phát lại trang của giao dịch thành công
+        self.assertEqual(self.callback(txn_ref, '24').status_code, 422)
+
+    def test_payment_is_claimed_once(self):
+        with app.app_context():
+            payment = Payment(user_id=self.customer_id, amount=100000, payment_method=PaymentMethod.vnpay,
+                              status=False, transaction_id='VNPAY_CLAIM')
+            db.session.add(payment)
+            db.session.commit()
+            self.assertTrue(dao.claim_payment(payment))
+            self.assertTrue(payment.status)
+            self.assertFalse(dao.claim_payment(payment))
+
+    def test_purge_expired(self):
+        now = datetime.utcnow()
+        with app.app_context():
+            db.session.add_all([
+                IdempotencyKey(key='old', fingerprint='x', status_code=200, expires_at=now - timedelta(seconds=1)),
+                IdempotencyKey(key='new', fingerprint='x', status_code=200, expires_at=now + timedelta(hours=1)),
+            ])
+            db.session.commit()
+            self.assertEqual(idempotency.purge_expired(now), 1)
+            self.assertEqual([record.key for record in IdempotencyKey.query.all()], ['new'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from eventapp.app import app
+from eventapp import db, counters, inventory
+from eventapp.models import Event, EventCategory, Ticket, TicketType, TicketTypeShard, User, UserRole
+from base import DatabaseTestCase
+
+
+class TestInventory(DatabaseTestCase):
+    """Đếm vé bán trên nhiều dòng shard cho loại vé bán rất chạy"""
+
+    def setUp(self):
+        super().setUp()
+        self.ctx = app.app_context()
+        self.ctx.push()
+        self.user = User(username='inventory_user', email='inventory_user@example.com', password_hash='x',
+                         role=UserRole.customer)
+        db.session.add(self.user)
+        db.session.flush()
+        now = datetime.utcnow()
+        event_ = Event(organizer_id=self.user.id, title='Mega On-sale', description='...', category=EventCategory.music,
+                       location='HCM', is_active=True, start_time=now + timedelta(days=1), end_time=now + timedelta(days=2))
+        db.session.add(event_)
+        db.session.flush()
+        self.ticket_type = TicketType(event_id=event_.id, name='GA', price=100000, total_quantity=10, sold_quantity=2)
+        db.session.add(self.ticket_type)
+        db.session.commit()
+        self.event_id = event_.id
+
+    def tearDown(self):
+        db.session.remove()
+        self.ctx.pop()
+
+    def sell(self, quantity):
+        tickets = [Ticket(user_id=self.user.id, event_id=self.event_id, ticket_type_id=self.ticket_type.id)
+                   for _ in range(quantity)]
+        db.session.add_all(tickets)
+        db.session.flush()
+        counters.add_sold(tickets)
+        db.session.commit()
+
+    def shard_updates(self):
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith('UPDATE'):
+                statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', record)
+        self.addCleanup(event.remove, db.engine, 'before_cursor_execute', record)
+        return statements
+
+    def test_enable_splits_unsold_capacity(self):
+        inventory.enable(self.ticket_type, 3)
+        self.assertEqual(self.ticket_type.shard_count, 3)
+        self.assertEqual([shard.capacity for shard in self.ticket_type.shards], [3, 3, 2])
+        self.assertEqual(self.ticket_type.available_quantity, 8)
+
+    def test_sale_updates_one_shard_row(self):
+        inventory.enable(self.ticket_type, 4)
+        updates = self.shard_updates()
+        self.sell(2)
+        self.assertEqual(len(updates), 1)
+        self.assertIn('ticket_type_shards', updates[0])
+        self.assertEqual(self.ticket_type.sold_quantity, 2)
+        self.assertEqual(self.ticket_type.sold_total, 4)
+        self.assertEqual(sorted(shard.sold_quantity for shard in self.ticket_type.shards), [0, 0, 0, 2])
+
+    def test_order_larger_than_any_shard_is_split(self):
+        inventory.enable(self.ticket_type, 4)
+        self.sell(5)
+        self.assertEqual(self.ticket_type.available_quantity, 3)
+        self.sell(3)
+        self.assertTrue(self.ticket_type.is_sold_out)
+        with self.assertRaises(inventory.InventoryError):
+            self.sell(1)
+
+    def test_rebalance_after_quantity_change(self):
+        inventory.enable(self.ticket_type, 2)
+        self.sell(4)
+        self.ticket_type.total_quantity = 20
+        db.session.commit()
+        shards = inventory.rebalance(self.ticket_type)
+        self.assertEqual(sum(shard.capacity - shard.sold_quantity for shard in shards), 14)
+        self.assertEqual(self.ticket_type.available_quantity, 14)
+
+    def test_merge_closed_folds_shards_back(self):
+        inventory.enable(self.ticket_type, 4)
+        self.sell(3)
+        self.assertEqual(inventory.merge_closed(datetime.utcnow()), 0)
+        self.assertEqual(inventory.merge_closed(datetime.utcnow() + timedelta(days=1, hours=1)), 1)
+        self.assertEqual(self.ticket_type.shard_count, 0)
+        self.assertEqual(self.ticket_type.sold_quantity, 5)
+        self.assertEqual(TicketTypeShard.query.count(), 0)
+        self.sell(1)
+        self.assertEqual(self.ticket_type.sold_quantity, 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
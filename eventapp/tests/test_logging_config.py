@@ -0,0 +1,58 @@
+import contextlib
+import io
+import json
+import logging
+import unittest
+from eventapp.app import app
+from eventapp import logging_config
+
+
+class TestStructuredLogging(unittest.TestCase):
+    """Log JSON qua hàng đợi: request id, trường extra, lấy mẫu DEBUG"""
+
+    def record(self, name='eventapp.test', level=logging.INFO, msg='hello %s', args=('world',), **extra):
+        record = logging.LogRecord(name, level, __file__, 1, msg, args, None)
+        record.__dict__.update(extra)
+        return record
+
+    def test_json_formatter_includes_extra_fields(self):
+        line = logging_config.JsonFormatter().format(self.record(event_id=7, duration_ms=1.5))
+        entry = json.loads(line)
+        self.assertEqual(entry['message'], 'hello world')
+        self.assertEqual(entry['logger'], 'eventapp.test')
+        self.assertEqual((entry['event_id'], entry['duration_ms']), (7, 1.5))
+        self.assertNotIn('args', entry)
+
+    def test_request_context_and_request_id_header(self):
+        record = self.record()
+        with app.test_request_context('/events', headers={'X-Request-ID': 'abc123'}):
+            app.preprocess_request()
+            logging_config.RequestContextFilter().filter(record)
+        self.assertEqual((record.request_id, record.method, record.path), ('abc123', 'GET', '/events'))
+
+        response = app.test_client().get('/health/db', headers={'X-Request-ID': 'req-42'})
+        self.assertEqual(response.headers['X-Request-ID'], 'req-42')
+        self.assertTrue(app.test_client().get('/health/db').headers['X-Request-ID'])
+
+    def test_sampling_only_applies_to_debug(self):
+        sampler = logging_config.SamplingFilter({'eventapp.checkin': 0})
+        self.assertFalse(sampler.filter(self.record('eventapp.checkin.gate', logging.DEBUG)))
+        self.assertTrue(sampler.filter(self.record('eventapp.checkin', logging.INFO)))
+        self.assertTrue(sampler.filter(self.record('eventapp.booking', logging.DEBUG)))
+
+    def test_stdout_handler_follows_redirected_stdout(self):
+        handler = logging_config.StdoutHandler()
+        handler.setFormatter(logging_config.JsonFormatter())
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            handler.handle(self.record())
+        self.assertEqual(json.loads(output.getvalue())['message'], 'hello world')
+
+    def test_parse_mapping(self):
+        self.assertEqual(logging_config.parse_mapping('eventapp.sql=warning, eventapp.checkin=debug', str.upper),
+                         {'eventapp.sql': 'WARNING', 'eventapp.checkin': 'DEBUG'})
+        self.assertEqual(logging_config.parse_mapping(''), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,192 @@
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import cloudinary
+from datetime import datetime, timedelta
+from flask_testing import TestCase
+from werkzeug.datastructures import FileStorage
+from werkzeug.security import generate_password_hash
+from eventapp.app import app
+from PIL import Image
+from eventapp import db, media, uploads, variants
+from eventapp.models import Event, EventCategory, User, UserRole, MediaUpload
+from base import DatabaseTestCase
+
+
+class TestImageUrlCache(unittest.TestCase):
+    def setUp(self):
+        cloudinary.config(cloud_name=cloudinary.config().cloud_name or 'demo')
+        media.clear_url_cache()
+
+    def test_urls_are_memoized_per_preset(self):
+        poster = media.image_url('events/posters/event_1_abc', 'poster')
+        thumb = media.image_url('events/posters/event_1_abc', 'poster_thumbnail')
+        self.assertNotEqual(poster, thumb)
+        self.assertIn('w_800', poster)
+        self.assertIn('w_300', thumb)
+
+        media.image_url('events/posters/event_1_abc', 'poster')
+        info = media.url_cache_info()
+        self.assertEqual(info.hits, 1)
+        self.assertEqual(info.misses, 2)
+
+    def test_model_properties_use_helper(self):
+        event = Event(poster='events/posters/event_2_def')
+        user = User(avatar=None)
+        self.assertEqual(event.poster_url, media.image_url('events/posters/event_2_def', 'poster'))
+        self.assertIsNone(user.avatar_url)
+        self.assertIsNone(media.image_url(None, 'avatar'))
+
+    def test_template_helper(self):
+        with app.test_request_context():
+            html = app.jinja_env.from_string("{{ image_url(p, 'qr') }}").render(p='tickets/qr_1')
+        self.assertEqual(html, media.image_url('tickets/qr_1', 'qr'))
+
+
+class TestMediaUploadQueue(DatabaseTestCase, TestCase):
+    """Upload avatar chạy nền với storage local"""
+
+    def create_app(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        return app
+
+    def setUp(self):
+        super().setUp()
+        self.media_dir = tempfile.mkdtemp()
+        self.saved_config = {key: app.config[key] for key in
+                             ('MEDIA_STORAGE', 'MEDIA_ROOT', 'MEDIA_STAGING_DIR', 'MEDIA_VARIANTS_DIR')}
+        app.config.update(MEDIA_STORAGE='local',
+                          MEDIA_ROOT=os.path.join(self.media_dir, 'media'),
+                          MEDIA_STAGING_DIR=os.path.join(self.media_dir, 'staging'),
+                          MEDIA_VARIANTS_DIR=os.path.join(self.media_dir, 'variants'))
+        self.client = self.app.test_client()
+        self.user = User(username='media_user', email='media_user@example.com',
+                         password_hash=generate_password_hash('Password@123'), role=UserRole.customer)
+        db.session.add(self.user)
+        db.session.commit()
+        self.client.post('/auth/login', data={'username_or_email': 'media_user', 'password': 'Password@123'})
+
+    def tearDown(self):
+        db.session.remove()
+        app.config.update(self.saved_config)
+        shutil.rmtree(self.media_dir, ignore_errors=True)
+
+    def upload_avatar(self, content):
+        return self.client.post('/profile/edit', data={'avatar': (io.BytesIO(content), 'me.png')},
+                                content_type='multipart/form-data')
+
+    def test_avatar_is_swapped_after_background_upload(self):
+        response = self.upload_avatar(b'first')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(db.session.get(User, self.user.id).avatar)
+        job = MediaUpload.query.one()
+        self.assertEqual(job.status, 'pending')
+        self.assertTrue(os.path.exists(job.staged_path))
+
+        self.assertEqual(uploads.process_pending(), 1)
+        db.session.expire_all()
+        avatar = db.session.get(User, self.user.id).avatar
+        self.assertTrue(avatar.startswith(media.LOCAL_PREFIX))
+        self.assertFalse(os.path.exists(job.staged_path))
+        served = self.client.get(media.image_url(avatar, 'avatar'))
+        self.assertEqual(served.data, b'first')
+        served.close()
+
+        # Ảnh mới thay thế: ảnh cũ chỉ bị xóa sau thời gian chờ
+        self.upload_avatar(b'second')
+        uploads.process_pending()
+        old_path = uploads.storage_for(avatar).path(avatar)
+        self.assertTrue(os.path.exists(old_path))
+        MediaUpload.query.update({'delete_after': datetime.utcnow() - timedelta(seconds=1)})
+        db.session.commit()
+        uploads.purge_replaced_assets()
+        self.assertFalse(os.path.exists(old_path))
+
+    def test_idle_queue_does_not_write(self):
+        with mock.patch.object(uploads, 'purge_replaced_assets') as purge:
+            self.assertEqual(uploads.process_pending(), 0)
+        purge.assert_not_called()
+        with mock.patch.object(db.session, 'commit') as commit:
+            self.assertEqual(uploads.purge_replaced_assets(), 0)
+        commit.assert_not_called()
+
+    def test_failed_upload_is_retried_with_backoff(self):
+        self.upload_avatar(b'avatar')
+        # MEDIA_ROOT là một file nên lưu local thất bại
+        open(os.path.join(self.media_dir, 'blocked'), 'w').close()
+        app.config['MEDIA_ROOT'] = os.path.join(self.media_dir, 'blocked')
+        with self.assertLogs('eventapp.uploads', 'ERROR') as logs:
+            self.assertEqual(uploads.process_pending(), 0)
+        self.assertEqual(logs.records[0].media_id, MediaUpload.query.one().id)
+        self.assertIsNotNone(logs.records[0].exc_info)
+        job = MediaUpload.query.one()
+        self.assertEqual(job.status, 'pending')
+        self.assertEqual(job.attempts, 1)
+        self.assertGreater(job.next_attempt_at, datetime.utcnow())
+        self.assertIsNone(db.session.get(User, self.user.id).avatar)
+
+    def test_poster_upload_generates_responsive_variants(self):
+        event = Event(organizer_id=self.user.id, title='Poster Event', description='...',
+                      category=EventCategory.music, location='HCM',
+                      start_time=datetime.utcnow() + timedelta(days=1),
+                      end_time=datetime.utcnow() + timedelta(days=1, hours=2))
+        buffer = io.BytesIO()
+        Image.new('RGBA', (1000, 750), (200, 30, 30, 128)).save(buffer, format='PNG')
+        content = buffer.getvalue()
+        db.session.add(event)
+        event.upload_poster(FileStorage(stream=io.BytesIO(content), filename='poster.png'))
+        db.session.commit()
+        uploads.process_pending()
+
+        db.session.expire_all()
+        event = db.session.get(Event, event.id)
+        digest, extensions, widths = variants.parse(event.poster_variants)
+        self.assertEqual(digest, hashlib.sha256(content).hexdigest()[:16])
+        self.assertIn('webp', extensions)
+        self.assertIn('jpg', extensions)
+        self.assertEqual(widths, [320, 640, 960, 1000])
+
+        with Image.open(os.path.join(app.config['MEDIA_VARIANTS_DIR'], variants.filename(digest, 320, 'jpg'))) as small:
+            self.assertEqual(small.size, (320, 240))
+        # Ảnh gốc nhỏ hơn 1280px thì không phóng to, giữ nguyên kích thước và khai báo đúng chiều rộng thật
+        with Image.open(os.path.join(app.config['MEDIA_VARIANTS_DIR'], variants.filename(digest, 1000, 'webp'))) as large:
+            self.assertEqual(large.size, (1000, 750))
+        self.assertFalse(os.path.exists(
+            os.path.join(app.config['MEDIA_VARIANTS_DIR'], variants.filename(digest, 1280, 'webp'))))
+
+        response = self.client.get(variants.variant_url(event.poster_variants, 640, 'webp'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        response.close()
+
+        html = self.app.jinja_env.from_string(
+            "{% for s in poster_sources(v) %}{{ s.type }} {{ s.srcset }}{% endfor %}|{{ jpeg_srcset(v) }}"
+        ).render(v=event.poster_variants)
+        self.assertIn('image/webp', html)
+        self.assertIn(f'{digest}-960.jpg 960w', html)
+        self.assertIn(f'{digest}-1000.jpg 1000w', html)
+        self.assertNotIn('1280w', html)
+        self.assertEqual(variants.variant_url(event.poster_variants, 1280), f'/media/variants/{digest}-1000.jpg')
+
+
+class TestVariantWidths(unittest.TestCase):
+    """Ảnh gốc hẹp hơn chiều rộng yêu cầu không bị khai báo sai descriptor trong srcset"""
+
+    def test_variant_widths(self):
+        self.assertEqual(variants.available_widths(500), [320, 500])
+        self.assertEqual(variants.available_widths(640), [320, 640])
+        self.assertEqual(variants.available_widths(2000), [320, 640, 960, 1280])
+        self.assertEqual(variants.available_widths(200), [200])
+        # Giá trị cũ chưa lưu chiều rộng ảnh gốc
+        self.assertEqual(variants.parse('abc:webp,jpg'), ('abc', ['webp', 'jpg'], [320, 640, 960, 1280]))
+        self.assertEqual(variants.variant_url('abc:webp,jpg:500', 640), '/media/variants/abc-500.jpg')
+        self.assertEqual(variants.variant_url('abc:webp,jpg:500', 320), '/media/variants/abc-320.jpg')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+from flask_login.utils import _create_identifier
+from eventapp.app import app
+from eventapp import db, metrics
+from eventapp.models import User, UserRole
+from base import DatabaseTestCase
+
+
+class TestMetrics(DatabaseTestCase):
+    """Endpoint /metrics và counter check-in"""
+
+    def setUp(self):
+        super().setUp()
+        self.saved_token = app.config['METRICS_TOKEN']
+        with app.app_context():
+            staff = User(username='metrics_staff', email='metrics_staff@example.com', password_hash='x',
+                         role=UserRole.staff)
+            db.session.add(staff)
+            db.session.commit()
+            self.staff_id = staff.id
+        self.client = app.test_client()
+        with app.test_request_context(environ_base=self.client.environ_base):
+            identifier = _create_identifier()
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = str(self.staff_id)
+            sess['_id'] = identifier  # session_protection = 'strong'
+
+    def tearDown(self):
+        app.config['METRICS_TOKEN'] = self.saved_token
+
+    def checkins(self, result):
+        return metrics.REGISTRY.get_sample_value('eventapp_checkins_total', {'result': result}) or 0
+
+    def test_scan_results_are_counted(self):
+        missing, not_found = self.checkins('missing_data'), self.checkins('not_found')
+        self.client.post('/staff/scan-ticket', json={})
+        self.client.post('/staff/scan-ticket', json={'qr_data': 'no-such-ticket'})
+        self.assertEqual(self.checkins('missing_data'), missing + 1)
+        self.assertEqual(self.checkins('not_found'), not_found + 1)
+
+    def test_metrics_endpoint(self):
+        self.client.post('/staff/scan-ticket', json={'qr_data': 'no-such-ticket'})
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        body = response.get_data(as_text=True)
+        self.assertIn('eventapp_checkins_total{result="not_found"}', body)
+        self.assertIn('eventapp_checkin_seconds_bucket', body)
+
+    def test_metrics_token(self):
+        app.config['METRICS_TOKEN'] = 'secret'
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import unittest
+from datetime import datetime, timedelta
+from decimal import Decimal
+from sqlalchemy import update
+from flask_login.utils import _create_identifier
+from eventapp.app import app
+from eventapp import db, discount_index, pricing, rate_limit
+from eventapp.models import CustomerGroup, DiscountCode, Event, EventCategory, TicketType, User, UserRole
+from base import DatabaseTestCase
+
+
+class TestPricing(DatabaseTestCase):
+    """Báo giá phía server từ bảng giá được cache"""
+
+    def setUp(self):
+        super().setUp()
+        rate_limit.backend.clear()
+        with app.app_context():
+            organizer = User(username='price_org', email='price_org@example.com', password_hash='x',
+                             role=UserRole.organizer)
+            customer = User(username='price_customer', email='price_customer@example.com', password_hash='x',
+                            role=UserRole.customer, created_at=datetime.utcnow() - timedelta(days=30))
+            db.session.add_all([organizer, customer])
+            db.session.flush()
+            now = datetime.utcnow()
+            events = [Event(organizer_id=organizer.id, title=f'Price Event {i}', description='...',
+                            category=EventCategory.music, location='HCM', is_active=True,
+                            start_time=now + timedelta(days=1), end_time=now + timedelta(days=2)) for i in range(2)]
+            db.session.add_all(events)
+            db.session.flush()
+            standard = TicketType(event_id=events[0].id, name='Standard', price=Decimal('100000.50'), total_quantity=100)
+            vip = TicketType(event_id=events[0].id, name='VIP', price=250000, total_quantity=10)
+            other = TicketType(event_id=events[1].id, name='Other', price=1, total_quantity=10)
+            db.session.add_all([standard, vip, other])
+            db.session.add(DiscountCode(code='TEN', discount_percentage=10, user_group=CustomerGroup.regular,
+                                        valid_from=datetime.now() - timedelta(days=1),
+                                        valid_to=datetime.now() + timedelta(days=1), max_uses=None))
+            db.session.commit()
+            self.event_id = events[0].id
+            self.ids = (standard.id, vip.id, other.id)
+            self.customer_id = customer.id
+        pricing.price_tables.clear()
+        discount_index.index.invalidate()
+
+    def test_quote_totals_with_discount(self):
+        standard, vip, _ = self.ids
+        with app.app_context():
+            quote = pricing.quote(self.event_id, [{'ticket_type_id': standard, 'quantity': 2},
+                                                  {'ticket_type_id': vip, 'quantity': 1},
+                                                  {'ticket_type_id': standard, 'quantity': 1}], 'TEN',
+                                  CustomerGroup.regular)
+        self.assertEqual([(line.name, line.quantity) for line in quote.lines], [('Standard', 3), ('VIP', 1)])
+        self.assertEqual(quote.subtotal, Decimal('550002'))
+        self.assertEqual(quote.discount_amount, Decimal('55000'))
+        self.assertEqual(quote.total, Decimal('495002'))
+        self.assertFalse(quote.differs_from(495002))
+        self.assertTrue(quote.differs_from('1000'))
+
+    def test_quote_rejects_bad_orders(self):
+        standard, _, other = self.ids
+        with app.app_context():
+            for tickets, code, group in (
+                ([{'ticket_type_id': other, 'quantity': 1}], None, None),
+                ([{'ticket_type_id': standard, 'quantity': 0}], None, None),
+                ([{'ticket_type_id': standard, 'quantity': -1}], None, None),
+                ([{'ticket_type_id': standard, 'quantity': 1}], 'TEN', CustomerGroup.vip),
+                ([{'ticket_type_id': standard, 'quantity': 1}], 'NOPE', None),
+            ):
+                with self.assertRaises(pricing.PricingError):
+                    pricing.quote(self.event_id, tickets, code, group)
+
+    def test_price_table_cached_until_price_changes(self):
+        standard, _, _ = self.ids
+        tickets = [{'ticket_type_id': standard, 'quantity': 1}]
+        with app.app_context():
+            pricing.quote(self.event_id, tickets)
+            loads = pricing.price_tables.loads
+            db.session.get(TicketType, standard).sold_quantity += 1
+            db.session.commit()
+            pricing.quote(self.event_id, tickets)
+            self.assertEqual(pricing.price_tables.loads, loads)
+
+            db.session.get(TicketType, standard).price = 120000
+            db.session.commit()
+            self.assertEqual(pricing.quote(self.event_id, tickets).total, Decimal('120000'))
+            self.assertEqual(pricing.price_tables.loads, loads + 1)
+
+    def login(self):
+        client = app.test_client()
+        with app.test_request_context(environ_base=client.environ_base):
+            identifier = _create_identifier()
+        with client.session_transaction() as sess:
+            sess['_user_id'] = str(self.customer_id)
+            sess['_id'] = identifier  # session_protection = 'strong'
+        return client
+
+    def test_booking_charges_price_changed_by_another_worker(self):
+        standard, _, _ = self.ids
+        client = self.login()
+        body = {'event_id': self.event_id, 'tickets': [{'ticket_type_id': standard, 'quantity': 1}]}
+        self.assertEqual(client.post('/booking/quote', json=body).get_json()['quote']['total_amount'], 100001)
+        with app.app_context():
+            # Worker khác sửa giá: bảng giá cache ở worker này không được xoá
+            db.session.execute(update(TicketType).where(TicketType.id == standard).values(price=150000))
+            db.session.commit()
+        self.assertEqual(client.post('/booking/quote', json=body).get_json()['quote']['total_amount'], 100001)
+        response = client.post('/booking/process', json=dict(body, payment_method='momo'))
+        self.assertEqual(response.get_json()['quote']['total_amount'], 150000)
+
+    def test_quote_endpoint_ignores_client_amounts(self):
+        standard, _, _ = self.ids
+        client = self.login()
+        body = {'event_id': self.event_id, 'tickets': [{'ticket_type_id': standard, 'quantity': 2, 'price': 1}],
+                'total_amount': 2}
+        response = client.post('/booking/quote', json=body)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['quote']['total_amount'], 200001)
+
+        response = client.post('/booking/process', json=dict(body, payment_method='momo'))
+        self.assertTrue(response.get_json()['success'])
+        self.assertEqual(response.get_json()['quote']['total_amount'], 200001)
+
+
+if __name__ == '__main__':
+    unittest.main()
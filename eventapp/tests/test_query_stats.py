@@ -0,0 +1,78 @@
+import unittest
+from datetime import datetime, timedelta
+from flask import g
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from eventapp.app import app
+from eventapp import db
+from eventapp.models import Event, EventCategory, User, UserRole
+from base import DatabaseTestCase
+
+
+class TestQueryStats(DatabaseTestCase):
+    """Đếm truy vấn theo request: header Server-Timing và log khi vượt ngưỡng"""
+
+    def setUp(self):
+        super().setUp()
+        self.saved = {key: app.config[key] for key in ('QUERY_STATS_HEADERS', 'SLOW_REQUEST_QUERIES', 'SLOW_QUERY_MS')}
+        with app.app_context():
+            organizer = User(username='stats_org', email='stats_org@example.com', password_hash='x',
+                             role=UserRole.organizer)
+            db.session.add(organizer)
+            db.session.flush()
+            now = datetime.utcnow()
+            db.session.add(Event(organizer_id=organizer.id, title='Stats Event', description='...',
+                                 category=EventCategory.music, location='HCM', is_active=True,
+                                 start_time=now + timedelta(days=1), end_time=now + timedelta(days=2)))
+            db.session.commit()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.config.update(self.saved)
+
+    def test_server_timing_header(self):
+        app.config['QUERY_STATS_HEADERS'] = True
+        response = self.client.get('/events')
+        self.assertEqual(response.status_code, 200)
+        count = int(response.headers['X-DB-Query-Count'])
+        self.assertGreater(count, 0)
+        self.assertRegex(response.headers['Server-Timing'], rf'^db;dur=[\d.]+;desc="{count} queries"$')
+
+        app.config['QUERY_STATS_HEADERS'] = False
+        self.assertNotIn('Server-Timing', self.client.get('/events').headers)
+
+    def test_request_over_threshold_is_logged_with_statements(self):
+        app.config['SLOW_REQUEST_QUERIES'] = 0
+        with self.assertLogs('eventapp.sql', 'WARNING') as logs:
+            self.client.get('/events')
+        record = logs.records[-1]
+        self.assertEqual(record.route, 'events')
+        self.assertGreater(record.query_count, 0)
+        self.assertTrue(any('FROM events' in statement for _, statement in record.slowest_statements))
+
+    def test_slow_statement_is_logged(self):
+        app.config['SLOW_QUERY_MS'] = -1
+        with self.assertLogs('eventapp.sql', 'WARNING') as logs:
+            self.client.get('/events')
+        self.assertTrue(any(getattr(r, 'statement', None) for r in logs.records))
+
+    def test_failing_statement_leaves_no_timer_on_pooled_connection(self):
+        with app.app_context():
+            with db.engine.connect() as conn:
+                with self.assertRaises(DBAPIError):
+                    conn.execute(text('SELECT * FROM no_such_table'))
+                conn.rollback()
+                conn.execute(text('SELECT 1'))
+                self.assertNotIn('query_start', conn.info)
+        with app.test_request_context('/events'):
+            app.preprocess_request()
+            with self.assertRaises(DBAPIError):
+                db.session.execute(text('SELECT * FROM no_such_table'))
+            db.session.rollback()
+            db.session.execute(text('SELECT 1'))
+            self.assertEqual(g.query_stats.count, 1)
+            db.session.remove()
+
+
+if __name__ == '__main__':
+    unittest.main()
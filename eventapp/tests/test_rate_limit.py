@@ -0,0 +1,138 @@
+import os
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+from flask_login.utils import _create_identifier
+from werkzeug.middleware.proxy_fix import ProxyFix
+from eventapp.app import app
+from eventapp import db, rate_limit
+from eventapp.models import Event, EventCategory, Payment, Ticket, TicketType, User, UserRole
+from base import DatabaseTestCase
+
+
+class TestSlidingWindow(DatabaseTestCase):
+    """Giới hạn tần suất theo cửa sổ trượt: backend bộ nhớ và backend CSDL"""
+
+    def setUp(self):
+        super().setUp()
+        self.ctx = app.app_context()
+        self.ctx.push()
+
+    def tearDown(self):
+        db.session.remove()
+        self.ctx.pop()
+
+    def test_memory_backend_is_an_exact_sliding_log(self):
+        backend = rate_limit.MemoryBackend()
+        self.assertEqual([backend.hit('k', 3, 60, now) for now in (0, 10, 20)], [0, 0, 0])
+        self.assertEqual(backend.hit('k', 3, 60, 30), 30)   # lượt 0 còn trong cửa sổ đến giây 60
+        self.assertEqual(backend.hit('k', 3, 60, 75), 0)    # lượt 0 và 10 đã ra khỏi cửa sổ
+        self.assertEqual(backend.hit('other', 3, 60, 30), 0)
+
+    def test_database_backend_weights_previous_window(self):
+        backend = rate_limit.DatabaseBackend()
+        self.assertEqual([backend.hit('k', 4, 60, now) for now in (50, 55, 58, 59)], [0, 0, 0, 0])
+        # Giây 90: cửa sổ trước còn chồng 50% -> 4 * 0.5 + 1 = 3
+        self.assertEqual(backend.hit('k', 4, 60, 90), 0)
+        self.assertEqual(backend.hit('k', 4, 60, 91), 0)
+        self.assertGreater(backend.hit('k', 4, 60, 92), 0)
+        self.assertEqual(backend.purge(now=119, max_window=60), 0)
+        self.assertEqual(backend.purge(now=121, max_window=60), 1)   # chỉ còn cửa sổ bắt đầu ở giây 60
+
+    def test_parse_rule(self):
+        self.assertEqual(rate_limit.parse_rule('10/60'), (10, 60))
+        self.assertEqual(rate_limit.parse_rule('5'), (5, 60))
+
+
+class TestBookingLimits(DatabaseTestCase):
+    """Giới hạn số vé mỗi tài khoản cho một sự kiện và tần suất đặt vé"""
+
+    def setUp(self):
+        super().setUp()
+        rate_limit.backend.clear()
+        with app.app_context():
+            organizer = User(username='limit_org', email='limit_org@example.com', password_hash='x',
+                             role=UserRole.organizer)
+            customer = User(username='limit_customer', email='limit_customer@example.com', password_hash='x',
+                            role=UserRole.customer)
+            db.session.add_all([organizer, customer])
+            db.session.flush()
+            now = datetime.utcnow()
+            event_ = Event(organizer_id=organizer.id, title='Limited Event', description='...',
+                           category=EventCategory.music, location='HCM', is_active=True,
+                           start_time=now + timedelta(days=1), end_time=now + timedelta(days=2))
+            db.session.add(event_)
+            db.session.flush()
+            ticket_type = TicketType(event_id=event_.id, name='GA', price=100000, total_quantity=100)
+            db.session.add(ticket_type)
+            db.session.commit()
+            self.event_id = event_.id
+            self.ticket_type_id = ticket_type.id
+            self.customer_id = customer.id
+        patcher = mock.patch.dict(os.environ, {'VNPAY_TMN_CODE': 'TEST', 'VNPAY_HASH_SECRET': 'secret'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = app.test_client()
+        with app.test_request_context(environ_base=self.client.environ_base):
+            identifier = _create_identifier()
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = str(self.customer_id)
+            sess['_id'] = identifier  # session_protection = 'strong'
+
+    def tearDown(self):
+        rate_limit.backend.clear()
+
+    def book(self, quantity):
+        return self.client.post('/booking/process', json={
+            'event_id': self.event_id, 'payment_method': 'vnpay',
+            'tickets': [{'ticket_type_id': self.ticket_type_id, 'quantity': quantity}]})
+
+    def test_cap_counts_paid_and_held_tickets(self):
+        with mock.patch.dict(app.config, {'MAX_TICKETS_PER_USER_PER_EVENT': 4}):
+            self.assertTrue(self.book(3).get_json()['success'])
+            response = self.book(2).get_json()
+            self.assertFalse(response['success'])
+            self.assertIn('tối đa 4 vé', response['message'])
+            self.assertTrue(self.book(1).get_json()['success'])
+            self.assertFalse(self.book(1).get_json()['success'])
+        with app.app_context():
+            self.assertEqual(Ticket.query.filter_by(user_id=self.customer_id).count(), 4)
+            # Đơn bị từ chối không để lại Payment
+            self.assertEqual(Payment.query.count(), 2)
+
+    def test_booking_rate_limited_per_user(self):
+        with mock.patch.dict(app.config, {'RATE_LIMITS': {'booking': {'user': (2, 60), 'ip': (100, 60)}}}):
+            self.assertTrue(self.book(1).get_json()['success'])
+            self.assertTrue(self.book(1).get_json()['success'])
+            response = self.book(1)
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response.headers['Retry-After']), 1)
+        with app.app_context():
+            self.assertEqual(Payment.query.count(), 2)
+
+    def test_ip_limit_uses_forwarded_client_behind_proxy(self):
+        # Sau proxy (PROXY_FIX_HOPS=1) mọi kết nối đến từ địa chỉ proxy; mỗi khách phải có hạn mức IP riêng
+        def client_at(client_ip):
+            client = app.test_client()
+            client.environ_base.update({'REMOTE_ADDR': '10.0.0.1', 'HTTP_X_FORWARDED_FOR': client_ip})
+            with app.test_request_context(environ_base={**client.environ_base, 'REMOTE_ADDR': client_ip}):
+                identifier = _create_identifier()
+            with client.session_transaction() as sess:
+                sess['_user_id'] = str(self.customer_id)
+                sess['_id'] = identifier
+            return client
+
+        def book(client):
+            return client.post('/booking/process', json={
+                'event_id': self.event_id, 'payment_method': 'vnpay',
+                'tickets': [{'ticket_type_id': self.ticket_type_id, 'quantity': 1}]})
+
+        first, second = client_at('203.0.113.7'), client_at('198.51.100.23')
+        with mock.patch.object(app, 'wsgi_app', ProxyFix(app.wsgi_app, x_for=1)), \
+                mock.patch.dict(app.config, {'RATE_LIMITS': {'booking': {'ip': (1, 60)}}}):
+            self.assertTrue(book(first).get_json()['success'])
+            self.assertTrue(book(second).get_json()['success'])
+            self.assertEqual(book(first).status_code, 429)
+
+if __name__ == '__main__':
+    unittest.main()
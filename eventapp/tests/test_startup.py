@@ -0,0 +1,36 @@
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+
+def run_python(code):
+    """Chạy code trong interpreter mới để sys.modules không bị ảnh hưởng bởi các test khác"""
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True,
+                            env=dict(os.environ, MEDIA_UPLOAD_WORKER='0'))
+    if result.returncode != 0:
+        raise AssertionError(result.stderr)
+    return result.stdout.strip()
+
+
+class TestLazyStartup(unittest.TestCase):
+    def test_import_defers_heavy_libraries(self):
+        loaded = run_python(
+            "import sys, eventapp; "
+            "print(','.join(m for m in ('flask_admin', 'cloudinary', 'PIL', 'pytz', 'qrcode', 'requests') "
+            "if m in sys.modules))"
+        )
+        self.assertEqual(loaded, '')
+
+    def test_create_app_registers_admin_once(self):
+        output = run_python(
+            "import eventapp; app = eventapp.create_app(); "
+            "print(app is eventapp.create_app(), 'admin' in app.blueprints, len(app.extensions['admin']))"
+        )
+        self.assertEqual(output, 'True True 1')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+from flask_login.utils import _create_identifier
+from werkzeug.security import generate_password_hash
+from eventapp.app import app
+from eventapp import db, dao, user_cache
+from eventapp.models import User, UserRole
+from base import DatabaseTestCase
+
+
+class TestUserCache(DatabaseTestCase):
+    """load_user đọc snapshot từ cache và cache bị xoá khi user thay đổi"""
+
+    def setUp(self):
+        super().setUp()
+        self.ctx = app.app_context()
+        self.ctx.push()
+        organizer = User(username='cache_org', email='cache_org@example.com',
+                         password_hash=generate_password_hash('Password@123'), role=UserRole.organizer)
+        user = User(username='cache_user', email='cache_user@example.com',
+                    password_hash=generate_password_hash('Password@123'), role=UserRole.customer, phone='0900000000')
+        db.session.add_all([organizer, user])
+        db.session.commit()
+        self.organizer_id, self.user_id = organizer.id, user.id
+        db.session.remove()
+        # Không giữ app context: request dùng chung g sẽ không gọi lại load_user
+        self.ctx.pop()
+        self.cache = user_cache.cache
+        self.cache.clear()
+        self.cache.reset_stats()
+        self.client = app.test_client()
+        with app.test_request_context(environ_base=self.client.environ_base):
+            identifier = _create_identifier()
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = str(self.user_id)
+            sess['_id'] = identifier  # session_protection = 'strong'
+
+    def test_requests_hit_cache(self):
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        with app.app_context():
+            engine = db.engine
+        db.event.listen(engine, 'before_cursor_execute', listener)
+        try:
+            for _ in range(3):
+                self.assertEqual(self.client.get('/notifications/unread-count').status_code, 200)
+        finally:
+            db.event.remove(engine, 'before_cursor_execute', listener)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+        self.assertEqual(self.cache.stats()['hits'], 2)
+        self.assertEqual(len([sql for sql in statements if 'FROM users' in sql]), 1)
+
+    def test_snapshot_is_read_only_and_falls_back_to_model(self):
+        with app.app_context():
+            snapshot = self.cache.load(self.user_id)
+            self.assertIsInstance(snapshot, user_cache.UserSnapshot)
+            self.assertEqual(snapshot.role, UserRole.customer)
+            self.assertEqual(snapshot.phone, '0900000000')
+            with self.assertRaises(AttributeError):
+                snapshot.username = 'renamed'
+
+    def test_profile_edit_and_role_change_invalidate(self):
+        self.client.get('/notifications/unread-count')
+        self.client.post('/profile/edit', data={'username': 'cache_renamed'})
+        with app.app_context():
+            self.assertEqual(self.cache.load(self.user_id).username, 'cache_renamed')
+
+            dao.update_user_role(self.user_id, 'staff', self.organizer_id)
+            snapshot = self.cache.load(self.user_id)
+            self.assertEqual(snapshot.role, UserRole.staff)
+            self.assertEqual(snapshot.creator_id, self.organizer_id)
+
+            db.session.delete(db.session.get(User, self.user_id))
+            db.session.commit()
+            self.assertIsNone(self.cache.load(self.user_id))
+        self.assertEqual(self.cache.stats()['invalidations'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
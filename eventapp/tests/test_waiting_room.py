@@ -0,0 +1,134 @@
+import unittest
+from datetime import datetime, timedelta
+from flask_login.utils import _create_identifier
+from sqlalchemy import event
+from eventapp.app import app
+from eventapp import db, rate_limit, waiting_room
+from eventapp.models import Event, EventCategory, TicketType, User, UserRole
+from base import DatabaseTestCase
+
+
+class TestWaitingRoom(DatabaseTestCase):
+    """Phòng chờ ảo: cấp lượt vào theo tốc độ cấu hình và kiểm tra token khi đặt vé"""
+
+    def setUp(self):
+        super().setUp()
+        rate_limit.backend.clear()
+        with app.app_context():
+            organizer = User(username='queue_org', email='queue_org@example.com', password_hash='x',
+                             role=UserRole.organizer)
+            customers = [User(username=f'queue_customer{i}', email=f'queue_customer{i}@example.com',
+                              password_hash='x', role=UserRole.customer) for i in range(3)]
+            db.session.add_all([organizer, *customers])
+            db.session.flush()
+            now = datetime.utcnow()
+            event_ = Event(organizer_id=organizer.id, title='Queue Event', description='...',
+                           category=EventCategory.music, location='HCM', is_active=True,
+                           start_time=now + timedelta(days=1), end_time=now + timedelta(days=2))
+            db.session.add(event_)
+            db.session.flush()
+            ticket_type = TicketType(event_id=event_.id, name='GA', price=100000, total_quantity=100)
+            db.session.add(ticket_type)
+            db.session.commit()
+            self.event_id = event_.id
+            self.ticket_type_id = ticket_type.id
+            self.customer_ids = [customer.id for customer in customers]
+        waiting_room.rooms.invalidate()
+
+    def login(self, user_id):
+        client = app.test_client()
+        with app.test_request_context(environ_base=client.environ_base):
+            identifier = _create_identifier()
+        with client.session_transaction() as sess:
+            sess['_user_id'] = str(user_id)
+            sess['_id'] = identifier  # session_protection = 'strong'
+        return client
+
+    def booking(self):
+        return {'event_id': self.event_id, 'payment_method': 'momo',
+                'tickets': [{'ticket_type_id': self.ticket_type_id, 'quantity': 1}]}
+
+    def test_token_is_bound_to_event_user_and_expiry(self):
+        now = datetime.utcnow()
+        with app.app_context():
+            token = waiting_room.make_token(self.event_id, 7, now + timedelta(minutes=5))
+            self.assertTrue(waiting_room.verify_token(token, self.event_id, 7, now))
+            self.assertFalse(waiting_room.verify_token(token, self.event_id, 8, now))
+            self.assertFalse(waiting_room.verify_token(token, self.event_id + 1, 7, now))
+            self.assertFalse(waiting_room.verify_token(token, self.event_id, 7, now + timedelta(minutes=6)))
+            tampered = token.replace('.7.', '.8.')
+            self.assertFalse(waiting_room.verify_token(tampered, self.event_id, 8, now))
+            self.assertFalse(waiting_room.verify_token('garbage', self.event_id, 7, now))
+            self.assertFalse(waiting_room.verify_token(None, self.event_id, 7, now))
+
+    def test_join_hands_out_slots_at_configured_rate(self):
+        now = datetime.utcnow()
+        with app.app_context():
+            waiting_room.open_room(self.event_id, 30)
+            entries = [waiting_room.join(self.event_id, user_id, now) for user_id in self.customer_ids]
+            self.assertEqual([entry.admit_at - now for entry in entries],
+                             [timedelta(0), timedelta(seconds=2), timedelta(seconds=4)])
+            # Tải lại trang giữ nguyên vị trí
+            self.assertEqual(waiting_room.join(self.event_id, self.customer_ids[2], now).admit_at, entries[2].admit_at)
+            status = waiting_room.status(self.event_id, self.customer_ids[2], entries[2].admit_at, now)
+            self.assertEqual((status['admitted'], status['position'], status['wait_seconds']), (False, 2, 5))
+            self.assertTrue(waiting_room.status(self.event_id, self.customer_ids[0], entries[0].admit_at,
+                                                now)['admitted'])
+            # Hết thời gian vào cửa mà không đặt: xếp lại cuối hàng
+            later = now + timedelta(seconds=app.config['WAITING_ROOM_ADMISSION_SECONDS'] + 1)
+            self.assertEqual(waiting_room.join(self.event_id, self.customer_ids[0], later).admit_at, later)
+
+    def test_booking_requires_admission_while_room_is_open(self):
+        client = self.login(self.customer_ids[0])
+        self.assertTrue(client.post('/booking/process', json=self.booking()).get_json()['success'])
+
+        with app.app_context():
+            waiting_room.open_room(self.event_id, 60)
+        response = client.post('/booking/process', json=self.booking())
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.get_json()['waiting_room_url'], f'/queue/event/{self.event_id}')
+        response = client.get(f'/booking/event/{self.event_id}')
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(f'/queue/event/{self.event_id}', response.headers['Location'])
+
+        # Người đầu hàng được vào ngay; token lưu trong session
+        self.assertEqual(client.get(f'/queue/event/{self.event_id}').status_code, 200)
+        status = client.get(f'/queue/event/{self.event_id}/status').get_json()
+        self.assertTrue(status['admitted'])
+        self.assertTrue(client.post('/booking/process', json=self.booking()).get_json()['success'])
+
+        # Người kế tiếp phải chờ thêm một phút
+        other = self.login(self.customer_ids[1])
+        status = other.get(f'/queue/event/{self.event_id}/status').get_json()
+        self.assertFalse(status['admitted'])
+        self.assertEqual(status['position'], 1)
+        self.assertEqual(other.post('/booking/process', json=self.booking()).status_code, 403)
+
+        with app.app_context():
+            waiting_room.close_room(self.event_id)
+        self.assertTrue(other.post('/booking/process', json=self.booking()).get_json()['success'])
+
+    def test_polling_before_admission_runs_no_queries(self):
+        with app.app_context():
+            waiting_room.open_room(self.event_id, 1)
+        first, second = self.login(self.customer_ids[0]), self.login(self.customer_ids[1])
+        first.get(f'/queue/event/{self.event_id}')
+        second.get(f'/queue/event/{self.event_id}')
+        self.assertEqual(second.get(f'/queue/event/{self.event_id}/status').get_json()['position'], 1)
+
+        statements = []
+        with app.app_context():
+            engine = db.engine
+        listener = lambda *args: statements.append(args[2])
+        event.listen(engine, 'before_cursor_execute', listener)
+        try:
+            status = second.get(f'/queue/event/{self.event_id}/status').get_json()
+        finally:
+            event.remove(engine, 'before_cursor_execute', listener)
+        self.assertFalse(status['admitted'])
+        self.assertEqual(status['position'], 1)
+        self.assertEqual(statements, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
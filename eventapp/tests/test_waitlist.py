@@ -0,0 +1,150 @@
+import os
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+from flask_login.utils import _create_identifier
+from eventapp.app import app
+from eventapp import dao, db, rate_limit, waitlist
+from eventapp.models import (Event, EventCategory, Ticket, TicketType, User, UserNotification, UserRole,
+                             WaitlistEntry)
+from base import DatabaseTestCase
+
+
+class TestWaitlist(DatabaseTestCase):
+    """Danh sách chờ loại vé đã hết: mời theo thứ tự, giữ vé cho người được mời, thu hồi lời mời hết hạn"""
+
+    def setUp(self):
+        super().setUp()
+        rate_limit.backend.clear()
+        with app.app_context():
+            organizer = User(username='wait_org', email='wait_org@example.com', password_hash='x',
+                             role=UserRole.organizer)
+            customers = [User(username=f'wait_customer{i}', email=f'wait_customer{i}@example.com',
+                              password_hash='x', role=UserRole.customer) for i in range(3)]
+            db.session.add_all([organizer, *customers])
+            db.session.flush()
+            now = datetime.utcnow()
+            event_ = Event(organizer_id=organizer.id, title='Sold Out Event', description='...',
+                           category=EventCategory.music, location='HCM', is_active=True,
+                           start_time=now + timedelta(days=1), end_time=now + timedelta(days=2))
+            db.session.add(event_)
+            db.session.flush()
+            ticket_type = TicketType(event_id=event_.id, name='GA', price=100000, total_quantity=5, sold_quantity=5)
+            db.session.add(ticket_type)
+            db.session.commit()
+            self.event_id = event_.id
+            self.ticket_type_id = ticket_type.id
+            self.customer_ids = [customer.id for customer in customers]
+
+    def login(self, user_id):
+        client = app.test_client()
+        with app.test_request_context(environ_base=client.environ_base):
+            identifier = _create_identifier()
+        with client.session_transaction() as sess:
+            sess['_user_id'] = str(user_id)
+            sess['_id'] = identifier  # session_protection = 'strong'
+        return client
+
+    def add_tickets(self, quantity):
+        ticket_type = db.session.get(TicketType, self.ticket_type_id)
+        ticket_type.total_quantity += quantity
+        db.session.commit()
+        return ticket_type
+
+    def statuses(self):
+        return [entry.status for entry in WaitlistEntry.query.order_by(WaitlistEntry.user_id)]
+
+    def test_offers_follow_queue_order_and_hold_tickets(self):
+        now = datetime.utcnow()
+        with app.app_context():
+            ticket_type = db.session.get(TicketType, self.ticket_type_id)
+            for user_id, quantity in zip(self.customer_ids, (2, 3, 1)):
+                waitlist.join(ticket_type, user_id, quantity, now)
+                now += timedelta(seconds=1)
+            self.add_tickets(4)
+            # Người thứ hai cần 3 vé nhưng chỉ còn 2: người thứ ba không được vượt lên
+            self.assertEqual(waitlist.allocate(now=now), 1)
+            self.assertEqual(self.statuses(), ['offered', 'waiting', 'waiting'])
+            self.assertEqual(UserNotification.query.count(), 1)
+
+            all_types = dao.get_all_ticket_types_for_event(self.event_id)
+            self.assertEqual(len(dao.get_available_ticket_types(all_types, self.customer_ids[0])), 1)
+            self.assertEqual(dao.validate_ticket_availability(
+                [{'ticket_type_id': self.ticket_type_id, 'quantity': 3}], self.customer_ids[1])[0], False)
+
+            self.add_tickets(1)
+            self.assertEqual(waitlist.allocate([self.ticket_type_id], now=now), 1)
+            self.assertEqual(self.statuses(), ['offered', 'offered', 'waiting'])
+
+    def test_expired_offer_moves_to_next_customer(self):
+        now = datetime.utcnow()
+        with app.app_context():
+            ticket_type = db.session.get(TicketType, self.ticket_type_id)
+            waitlist.join(ticket_type, self.customer_ids[0], 1, now)
+            waitlist.join(ticket_type, self.customer_ids[1], 1, now + timedelta(seconds=1))
+            self.add_tickets(1)
+            self.assertEqual(waitlist.allocate(now=now), 1)
+            self.assertEqual(waitlist.allocate(now=now + timedelta(minutes=1)), 0)
+            later = now + timedelta(minutes=app.config['WAITLIST_OFFER_MINUTES'] + 1)
+            self.assertEqual(waitlist.allocate(now=later), 1)
+            self.assertEqual(self.statuses(), ['expired', 'offered'])
+
+    def test_cleanup_of_expired_holds_offers_to_waitlist(self):
+        now = datetime.utcnow()
+        with app.app_context():
+            ticket_type = db.session.get(TicketType, self.ticket_type_id)
+            waitlist.join(ticket_type, self.customer_ids[0], 1, now)
+            # Vé trả lại mà chưa có lượt allocate nào chạy, cùng một vé giữ chỗ đã hết hạn
+            ticket_type.total_quantity += 1
+            db.session.add(Ticket(user_id=self.customer_ids[1], event_id=self.event_id,
+                                  ticket_type_id=self.ticket_type_id, created_at=now - timedelta(minutes=5)))
+            db.session.commit()
+            dao.cleanup_unpaid_tickets()
+            self.assertEqual(Ticket.query.count(), 0)
+            self.assertEqual(self.statuses(), ['offered'])
+
+    def test_sold_out_booking_leads_to_waitlist_and_claim(self):
+        client = self.login(self.customer_ids[0])
+        response = client.get(f'/booking/event/{self.event_id}')
+        self.assertIn(f'/waitlist/event/{self.event_id}', response.headers['Location'])
+        self.assertEqual(client.get(f'/waitlist/event/{self.event_id}').status_code, 200)
+        client.post('/waitlist/join', data={'ticket_type_id': self.ticket_type_id, 'quantity': 2})
+
+        with app.app_context():
+            self.add_tickets(2)
+            waitlist.allocate()
+        response = client.get(f'/waitlist/claim/{self.ticket_type_id}')
+        self.assertIn(f'/booking/event/{self.event_id}', response.headers['Location'])
+        self.assertEqual(client.get(f'/booking/event/{self.event_id}').status_code, 200)
+
+        # Người khác không mua được số vé đang dành cho người được mời
+        other = self.login(self.customer_ids[1])
+        booking = {'event_id': self.event_id, 'payment_method': 'vnpay',
+                   'tickets': [{'ticket_type_id': self.ticket_type_id, 'quantity': 2}]}
+        with mock.patch.dict(os.environ, {'VNPAY_TMN_CODE': 'TEST', 'VNPAY_HASH_SECRET': 'secret'}):
+            self.assertFalse(other.post('/booking/process', json=booking).get_json()['success'])
+            payment_url = client.post('/booking/process', json=booking).get_json()['payment_url']
+            # Vé giữ chỗ chưa trừ tồn kho: lời mời vẫn giữ vé trong lúc khách ở trang VNPay
+            with app.app_context():
+                self.assertEqual(self.statuses(), ['offered'])
+            self.assertFalse(other.post('/booking/process', json=booking).get_json()['success'])
+
+        txn_ref = parse_qs(urlparse(payment_url).query)['vnp_TxnRef'][0]
+        with mock.patch.object(Ticket, 'generate_qr_code'), mock.patch('eventapp.utils.send_ticket_email'):
+            client.get('/vnpay/redirect', query_string={'vnp_ResponseCode': '00', 'vnp_TxnRef': txn_ref})
+        with app.app_context():
+            self.assertEqual(self.statuses(), ['claimed'])
+
+    def test_join_rejects_ticket_types_still_on_sale(self):
+        with app.app_context():
+            self.add_tickets(3)
+        client = self.login(self.customer_ids[0])
+        response = client.post('/waitlist/join', data={'ticket_type_id': self.ticket_type_id, 'quantity': 1})
+        self.assertIn(f'/booking/event/{self.event_id}', response.headers['Location'])
+        with app.app_context():
+            self.assertEqual(WaitlistEntry.query.count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,295 @@
+"""
+Background media uploads for event posters and user avatars.
+
+Requests only stage the file on local disk and add a ``MediaUpload`` row in
+the same transaction as the rest of the change, so the commit never waits on
+Cloudinary. A worker thread per process claims due rows, pushes the file to
+the configured storage backend with exponential-backoff retries, swaps the new
+public_id onto the owning row and schedules the previous asset for deletion
+after a grace period, since pages rendered before the swap may still link it.
+
+Backends: ``cloudinary`` and ``local`` (files under ``MEDIA_ROOT``, served at
+``/media/``), selected with ``MEDIA_STORAGE``.
+"""
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from flask import current_app
+from werkzeug.utils import secure_filename
+
+from eventapp import variants
+from eventapp.media import LOCAL_PREFIX, cloudinary_sdk
+
+logger = logging.getLogger('eventapp.uploads')
+
+TARGETS = {
+    'event_poster': {'model': 'Event', 'field': 'poster', 'prefix': 'event',
+                     'folder': 'online-event-ticketing-system/events/posters',
+                     'variants_field': 'poster_variants'},
+    'user_avatar': {'model': 'User', 'field': 'avatar', 'prefix': 'user',
+                    'folder': 'online-event-ticketing-system/users/avatars'},
+}
+
+# Finished jobs are kept this long for troubleshooting before being purged
+JOB_RETENTION = timedelta(days=7)
+
+
+class CloudinaryStorage:
+    name = 'cloudinary'
+
+    def save(self, path, folder, public_id):
+        result = cloudinary_sdk().uploader.upload(
+            path,
+            folder=folder,
+            public_id=public_id,
+            overwrite=True,
+            resource_type='image'
+        )
+        return result['public_id']
+
+    def delete(self, public_id):
+        cloudinary_sdk().uploader.destroy(public_id)
+
+
+class LocalStorage:
+    name = 'local'
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, public_id):
+        """Absolute path of a local asset, or None if it escapes the media root"""
+        root = os.path.realpath(self.root)
+        path = os.path.realpath(os.path.join(root, public_id[len(LOCAL_PREFIX):]))
+        return path if path.startswith(root + os.sep) else None
+
+    def save(self, path, folder, public_id):
+        relative = f'{folder}/{public_id}{os.path.splitext(path)[1].lower()}'
+        target = os.path.join(self.root, relative)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(path, target)
+        return LOCAL_PREFIX + relative
+
+    def delete(self, public_id):
+        path = self.path(public_id)
+        if path and os.path.exists(path):
+            os.remove(path)
+
+
+def get_storage():
+    """Backend new uploads go to"""
+    if current_app.config.get('MEDIA_STORAGE') == 'local':
+        return LocalStorage(current_app.config['MEDIA_ROOT'])
+    return CloudinaryStorage()
+
+
+def storage_for(public_id):
+    """Backend an existing asset lives in"""
+    if public_id.startswith(LOCAL_PREFIX):
+        return LocalStorage(current_app.config['MEDIA_ROOT'])
+    return CloudinaryStorage()
+
+
+def stage_file(file):
+    """Save an uploaded FileStorage to the staging directory and return its path"""
+    staging_dir = current_app.config['MEDIA_STAGING_DIR']
+    os.makedirs(staging_dir, exist_ok=True)
+    extension = os.path.splitext(secure_filename(file.filename or ''))[1].lower()
+    path = os.path.join(staging_dir, f'{uuid.uuid4().hex}{extension}')
+    file.save(path)
+    return path
+
+
+def enqueue(kind, owner, file):
+    """Stage ``file`` for ``owner`` and add the upload job to the current session.
+
+    The job becomes visible to the worker when the caller commits, together
+    with the rest of its changes.
+    """
+    from eventapp import db
+    from eventapp.models import MediaUpload
+
+    if owner.id is None:
+        db.session.flush()
+    job = MediaUpload(kind=kind, target_id=owner.id, staged_path=stage_file(file))
+    db.session.add(job)
+    worker.wake()
+    return job
+
+
+def _discard_staged(job):
+    try:
+        os.remove(job.staged_path)
+    except OSError:
+        pass
+
+
+def _generate_variants(job):
+    """Local responsive variants for the staged file; None if Pillow cannot read it"""
+    try:
+        return variants.generate(job.staged_path, current_app.config['MEDIA_VARIANTS_DIR'])
+    except Exception:
+        logger.exception('generating poster variants failed', extra={'media_id': job.id})
+        return None
+
+
+def _run_job(job):
+    from eventapp import db, models
+    from eventapp.models import MediaUpload
+
+    target = TARGETS[job.kind]
+    now = datetime.utcnow()
+    try:
+        public_id = get_storage().save(
+            job.staged_path, target['folder'], f"{target['prefix']}_{job.target_id}_{uuid.uuid4().hex[:8]}"
+        )
+    except Exception as e:
+        job.attempts += 1
+        job.last_error = str(e)[:1000]
+        if job.attempts >= current_app.config.get('MEDIA_UPLOAD_MAX_ATTEMPTS', 5):
+            job.status = 'failed'
+            _discard_staged(job)
+        else:
+            job.status = 'pending'
+            delay = current_app.config.get('MEDIA_UPLOAD_RETRY_SECONDS', 5) * 2 ** (job.attempts - 1)
+            job.next_attempt_at = now + timedelta(seconds=delay)
+        db.session.commit()
+        logger.exception('media upload failed', extra={'media_id': job.id, 'attempt': job.attempts,
+                                                       'media_status': job.status})
+        return False
+
+    job.public_id = public_id
+    owner = db.session.get(getattr(models, target['model']), job.target_id)
+    newer = MediaUpload.query.filter(
+        MediaUpload.kind == job.kind,
+        MediaUpload.target_id == job.target_id,
+        MediaUpload.id > job.id,
+        MediaUpload.status == 'done'
+    ).first()
+    if owner is None or newer is not None:
+        # A later upload already won (or the owner is gone): drop this asset
+        job.status = 'superseded'
+        job.replaced_public_id = public_id
+        job.delete_after = now
+    else:
+        job.status = 'done'
+        job.replaced_public_id = getattr(owner, target['field'])
+        job.delete_after = now + timedelta(seconds=current_app.config.get('MEDIA_DELETE_GRACE_SECONDS', 600))
+        setattr(owner, target['field'], public_id)
+        if target.get('variants_field'):
+            setattr(owner, target['variants_field'], _generate_variants(job))
+    db.session.commit()
+    _discard_staged(job)
+    return True
+
+
+def purge_replaced_assets(limit=50):
+    """Delete assets replaced more than the grace period ago and old finished jobs;
+    returns how many rows changed (nothing is committed when there was nothing to purge)"""
+    from eventapp import db
+    from eventapp.models import MediaUpload
+
+    now = datetime.utcnow()
+    jobs = MediaUpload.query.filter(
+        MediaUpload.replaced_public_id != None,
+        MediaUpload.delete_after <= now
+    ).limit(limit).all()
+    changed = 0
+    for job in jobs:
+        try:
+            storage_for(job.replaced_public_id).delete(job.replaced_public_id)
+        except Exception:
+            logger.exception('deleting replaced media failed', extra={'public_id': job.replaced_public_id})
+            continue
+        job.replaced_public_id = None
+        changed += 1
+    changed += MediaUpload.query.filter(
+        MediaUpload.status.in_(['done', 'failed', 'superseded']),
+        MediaUpload.replaced_public_id == None,
+        MediaUpload.updated_at < now - JOB_RETENTION
+    ).delete(synchronize_session=False)
+    if changed:
+        db.session.commit()
+    else:
+        db.session.rollback()
+    return changed
+
+
+def process_pending(limit=10):
+    """Run due upload jobs; returns how many were uploaded"""
+    from eventapp import db
+    from eventapp.models import MediaUpload
+
+    now = datetime.utcnow()
+    stale_before = now - timedelta(seconds=current_app.config.get('MEDIA_UPLOAD_STALE_SECONDS', 300))
+    due = db.or_(
+        db.and_(MediaUpload.status == 'pending', MediaUpload.next_attempt_at <= now),
+        # Claimed by a process that died mid-upload
+        db.and_(MediaUpload.status == 'uploading', MediaUpload.updated_at < stale_before)
+    )
+    job_ids = [row.id for row in db.session.query(MediaUpload.id).filter(due).order_by(MediaUpload.id).limit(limit)]
+
+    uploaded = 0
+    for job_id in job_ids:
+        # Conditional claim so two worker processes never run the same job
+        claimed = MediaUpload.query.filter(MediaUpload.id == job_id, due).update(
+            {'status': 'uploading', 'updated_at': now}, synchronize_session=False
+        )
+        db.session.commit()
+        if claimed and _run_job(db.session.get(MediaUpload, job_id)):
+            uploaded += 1
+    return uploaded
+
+
+class UploadWorker:
+    """Daemon thread draining the upload queue for this process; replaced assets are purged
+    every ``MEDIA_PURGE_INTERVAL_SECONDS`` rather than on every poll"""
+
+    def __init__(self):
+        self._thread = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._next_purge = 0.0
+
+    def wake(self):
+        self._wake.set()
+
+    def ensure_started(self):
+        """Start the worker for the current app unless disabled or testing"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        app = current_app._get_current_object()
+        if app.testing or not app.config.get('MEDIA_UPLOAD_WORKER', True):
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, args=(app,), name='media-upload-worker', daemon=True
+                )
+                self._thread.start()
+
+    def _run(self, app):
+        from eventapp import db
+
+        while True:
+            self._wake.wait(app.config.get('MEDIA_UPLOAD_POLL_SECONDS', 2))
+            self._wake.clear()
+            with app.app_context():
+                try:
+                    process_pending()
+                    if time.monotonic() >= self._next_purge:
+                        self._next_purge = time.monotonic() + app.config.get('MEDIA_PURGE_INTERVAL_SECONDS', 300)
+                        purge_replaced_assets()
+                except Exception:
+                    db.session.rollback()
+                    logger.exception('media upload worker failed')
+                finally:
+                    db.session.remove()
+
+
+worker = UploadWorker()
@@ -0,0 +1,171 @@
+"""
+Short-lived, per-process cache of the logged-in user.
+
+Flask-Login calls ``load_user`` on every authenticated request (the unread
+notification polling included). Instead of a ``users`` row per request,
+``cache.load(user_id)`` returns a ``UserSnapshot``: a detached, read-only copy
+of the columns that routes and templates read from ``current_user``. Entries
+live ``USER_CACHE_TTL_SECONDS`` (0 disables caching).
+
+Invalidation is automatic: any committed flush that updates or deletes a
+``User`` (profile edits, ``dao.update_user_role``, the admin edit/delete user
+pages, payments adding to ``total_spent``) drops that user's entry in this
+process. Other gunicorn workers pick the change up when their entry expires,
+so keep the TTL short. Code that changes users with bulk UPDATE statements
+must call ``invalidate_after_commit(session, user_id)`` (or
+``cache.invalidate(user_id)``) itself.
+
+Anything outside the snapshot (``phone``, ``password_hash``, relationships)
+is read from the database row on access. To change a user, load the model
+(``dao.get_user_by_id(current_user.id)``); snapshots refuse assignments.
+"""
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from eventapp import db
+from eventapp.models import User
+
+_PENDING_KEY = 'user_cache_invalidate'
+
+
+class UserSnapshot(UserMixin):
+    """Detached, read-only copy of the User columns used on every request"""
+
+    FIELDS = ('id', 'username', 'email', 'role', 'is_active', 'avatar', 'creator_id', 'total_spent', 'customer_group',
+              'created_at')
+
+    def __init__(self, user):
+        object.__setattr__(self, '_data', {name: getattr(user, name) for name in self.FIELDS})
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name in self._data:
+            return self._data[name]
+        return getattr(self.load(), name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'UserSnapshot is read-only; load the User model to change {name!r}')
+
+    def __repr__(self):
+        return f'<UserSnapshot {self.username}>'
+
+    @property
+    def is_active(self):
+        return self._data['is_active']
+
+    def get_id(self):
+        return str(self._data['id'])
+
+    def load(self):
+        """The User model for this snapshot, bound to the current session"""
+        return db.session.get(User, self._data['id'])
+
+    avatar_url = User.avatar_url
+    avatar_thumbnail_url = User.avatar_thumbnail_url
+    get_customer_group = User.get_customer_group
+
+
+class UserCache:
+    """TTL + LRU map of user id to UserSnapshot with hit/miss counters"""
+
+    def __init__(self, ttl=30, max_size=10000):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._generation = 0
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def load(self, user_id):
+        """Snapshot for ``user_id`` from the cache, or from the database on a miss"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        snapshot = UserSnapshot(user)
+        if self.ttl > 0:
+            with self._lock:
+                # Skip the store if an invalidation raced with the query above
+                if generation == self._generation:
+                    self._entries[user_id] = (now + self.ttl, snapshot)
+                    self._entries.move_to_end(user_id)
+                    while len(self._entries) > self.max_size:
+                        self._entries.popitem(last=False)
+        return snapshot
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'invalidations': self.invalidations,
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = self.invalidations = 0
+
+
+cache = UserCache()
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_users(session, flush_context):
+    # Still the pre-flush state here: dirty/deleted hold what was just written
+    ids = {obj.id for obj in itertools.chain(session.dirty, session.deleted) if isinstance(obj, User)}
+    if ids:
+        session.info.setdefault(_PENDING_KEY, set()).update(ids)
+
+
+def invalidate_after_commit(session, user_id):
+    """Drop ``user_id`` when ``session`` commits; for bulk UPDATEs, which skip the flush events"""
+    session.info.setdefault(_PENDING_KEY, set()).add(user_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed_users(session):
+    for user_id in session.info.pop(_PENDING_KEY, ()):
+        cache.invalidate(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back_users(session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+def init_app(app):
+    cache.ttl = app.config.get('USER_CACHE_TTL_SECONDS', 30)
+    cache.max_size = app.config.get('USER_CACHE_MAX_SIZE', 10000)
+    cache.clear()
@@ -7,6 +7,9 @@ from email.utils import formataddr
 
 from flask import current_app
 
+from eventapp import metrics
+
+@metrics.track(metrics.ticket_email_seconds, metrics.ticket_emails)
 def send_ticket_email(to_email, subject, html_body, tickets=None):
     """
     Send an email with ticket info and QR codes as attachments.
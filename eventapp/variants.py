@@ -0,0 +1,128 @@
+"""
+Responsive poster variants generated locally with Pillow.
+
+When a poster upload is processed, the staged file is resized to each width in
+``WIDTHS`` narrower than the source and encoded in every supported format
+(AVIF when Pillow has an AVIF encoder, WebP, JPEG). A source narrower than the
+largest width is also kept at its own width instead of being upscaled, so every
+``w`` descriptor in a srcset is the real width of its file. Files are named
+``<content hash>-<width>.<ext>`` so they never change once written and can be
+served with an immutable cache header.
+
+The event stores ``"<hash>:<formats>:<source width>"`` in ``poster_variants``;
+templates turn it into ``<picture>`` sources with ``poster_sources`` and
+``variant_url``.
+"""
+import hashlib
+import os
+from functools import lru_cache
+
+WIDTHS = (320, 640, 960, 1280)
+URL_PREFIX = '/media/variants/'
+
+_FORMATS = (
+    # (Pillow format, extension, mime type, save options)
+    ('AVIF', 'avif', 'image/avif', {'quality': 55}),
+    ('WEBP', 'webp', 'image/webp', {'quality': 80, 'method': 4}),
+    ('JPEG', 'jpg', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+_EXTENSIONS = {extension: (fmt, mime, options) for fmt, extension, mime, options in _FORMATS}
+
+
+@lru_cache(maxsize=None)
+def supported_formats():
+    """Extensions Pillow can encode here; Pillow is only imported when posters are processed"""
+    from PIL import Image
+    Image.init()
+    return tuple(extension for fmt, extension, _, _ in _FORMATS if fmt in Image.SAVE)
+
+
+def content_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def filename(digest, width, extension):
+    return f'{digest}-{width}.{extension}'
+
+
+def available_widths(source_width, widths=WIDTHS):
+    """Widths generated for a source image: the requested widths it is wider than, plus its own width
+    when it is not wider than all of them"""
+    available = [width for width in widths if width < source_width]
+    if len(available) < len(widths):
+        available.append(source_width)
+    return available
+
+
+def generate(source_path, output_dir, widths=WIDTHS):
+    """Write all variants of an image and return the ``poster_variants`` value"""
+    from PIL import Image, ImageOps
+
+    digest = content_hash(source_path)
+    formats = supported_formats()
+    os.makedirs(output_dir, exist_ok=True)
+    with Image.open(source_path) as source:
+        image = ImageOps.exif_transpose(source)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            # Flatten transparency onto white; JPEG has no alpha channel
+            rgba = image.convert('RGBA')
+            image = Image.new('RGB', rgba.size, (255, 255, 255))
+            image.paste(rgba, mask=rgba.getchannel('A'))
+        else:
+            image = image.convert('RGB')
+    for width in available_widths(image.width, widths):
+        if image.width > width:
+            resized = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+        else:
+            resized = image
+        for extension in formats:
+            path = os.path.join(output_dir, filename(digest, width, extension))
+            if os.path.exists(path):
+                continue
+            fmt, _, options = _EXTENSIONS[extension]
+            resized.save(path + '.tmp', format=fmt, **options)
+            os.replace(path + '.tmp', path)
+    return f"{digest}:{','.join(formats)}:{image.width}"
+
+
+def parse(value):
+    """Split a ``poster_variants`` value into (hash, [extensions], [widths])"""
+    digest, _, rest = (value or '').partition(':')
+    extensions, _, source_width = rest.partition(':')
+    # Values written before the source width was stored have every width in WIDTHS
+    widths = available_widths(int(source_width)) if source_width else list(WIDTHS)
+    return digest, [e for e in extensions.split(',') if e in _EXTENSIONS], widths
+
+
+def _srcset(digest, extension, widths):
+    return ', '.join(f'{URL_PREFIX}{filename(digest, w, extension)} {w}w' for w in widths)
+
+
+def variant_url(value, width, extension='jpg'):
+    """URL of the narrowest variant at least ``width`` wide, or the widest one there is"""
+    digest, _, widths = parse(value)
+    if not digest:
+        return None
+    width = next((w for w in widths if w >= width), widths[-1])
+    return URL_PREFIX + filename(digest, width, extension)
+
+
+def poster_sources(value):
+    """``<source>`` attributes, best format first; JPEG is left to the ``<img>`` fallback"""
+    digest, extensions, widths = parse(value)
+    return [
+        {
+            'type': _EXTENSIONS[extension][1],
+            'srcset': _srcset(digest, extension, widths),
+        }
+        for extension in extensions if extension != 'jpg'
+    ] if digest else []
+
+
+def jpeg_srcset(value):
+    digest, _, widths = parse(value)
+    return _srcset(digest, 'jpg', widths) if digest else ''
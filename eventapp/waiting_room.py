@@ -0,0 +1,256 @@
+"""
+Virtual waiting room for flash sales.
+
+When a waiting room is open for an event, ``/booking/event/<id>`` and
+``/booking/process`` only accept customers holding an admission token for
+that event; everyone else is sent to ``/queue/event/<id>``. Joining the queue
+hands out the next admission slot, ``rate_per_minute`` slots per minute, so
+the booking path sees at most that many new customers per minute however many
+arrive at once:
+
+    UPDATE waiting_rooms SET next_slot_us = max(next_slot_us, now) + 60000000 / rate RETURNING next_slot_us - 60000000 / rate
+
+The room row is only locked by that one statement, which is committed
+before the queue entry is written, so joins during a spike don't queue
+behind each other's transactions.
+
+The queue page polls ``/queue/event/<id>/status``. ``admit_at`` is kept in
+the (signed) Flask session, and until then a poll needs no query: slots are
+``60 / rate`` seconds apart, so the position is
+``ceil((admit_at - now) / (60 / rate))``. From ``admit_at`` the entry is read
+once more and the customer gets a signed token (HMAC-SHA256 over event id,
+user id and expiry) valid for ``WAITING_ROOM_ADMISSION_SECONDS``. The token is
+kept in the Flask session (API clients may send it as ``X-Admission-Token``)
+and checked without a database query. A customer whose admission window
+passed unused is queued again at the back.
+
+Whether an event has an open room, and its rate, is cached per worker for
+``WAITING_ROOM_CACHE_SECONDS``.
+
+    flask --app eventapp waiting-room open <event_id> --rate 300
+    flask --app eventapp waiting-room close <event_id>
+"""
+import hashlib
+import hmac
+import itertools
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from sqlalchemy import BigInteger, case, event, func, literal, select, update
+from sqlalchemy.exc import IntegrityError, NoResultFound
+from sqlalchemy.orm import Session
+
+from eventapp import db
+from eventapp.manifest import from_timestamp, to_timestamp
+from eventapp.models import Event, WaitingRoom, WaitingRoomEntry
+
+_PENDING_KEY = 'waiting_room_invalidate'
+_EPOCH = datetime(1970, 1, 1)
+
+
+class RoomCache:
+    """Per-process map of event id to (room open, admissions per minute), refreshed after a TTL"""
+
+    def __init__(self, ttl=5):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def _get(self, event_id):
+        now = time.monotonic()
+        with self._lock:
+            cached = self._entries.get(event_id)
+            if cached and cached[0] > now:
+                return cached[1]
+        room = db.session.get(WaitingRoom, event_id)
+        state = (bool(room and room.is_open), room.rate_per_minute if room else None)
+        if self.ttl > 0:
+            with self._lock:
+                self._entries[event_id] = (now + self.ttl, state)
+        return state
+
+    def is_open(self, event_id):
+        return self._get(event_id)[0]
+
+    def rate_per_minute(self, event_id):
+        return self._get(event_id)[1]
+
+    def invalidate(self, event_ids=None):
+        with self._lock:
+            if event_ids is None:
+                self._entries.clear()
+            for event_id in event_ids or ():
+                self._entries.pop(event_id, None)
+
+
+rooms = RoomCache()
+
+
+def _secret():
+    return current_app.config.get('WAITING_ROOM_SECRET') or current_app.config['SECRET_KEY']
+
+
+def _admission_window():
+    return timedelta(seconds=current_app.config.get('WAITING_ROOM_ADMISSION_SECONDS', 600))
+
+
+def _sign(payload):
+    return hmac.new(_secret().encode('utf-8'), payload.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def make_token(event_id, user_id, expires_at):
+    """Admission token for one customer and event, valid until ``expires_at`` (naive UTC)"""
+    payload = f'{event_id}.{user_id}.{int(to_timestamp(expires_at))}'
+    return f'{payload}.{_sign(payload)}'
+
+
+def verify_token(token, event_id, user_id, now=None):
+    """True if ``token`` admits ``user_id`` to ``event_id`` at ``now``"""
+    try:
+        token_event, token_user, expires, signature = (token or '').split('.')
+        expires_at = from_timestamp(int(expires))
+    except ValueError:
+        return False
+    if (token_event, token_user) != (str(event_id), str(user_id)):
+        return False
+    if not hmac.compare_digest(_sign(f'{token_event}.{token_user}.{expires}'), signature):
+        return False
+    return (now or datetime.utcnow()) < expires_at
+
+
+def is_admitted(event_id, user_id, token, now=None):
+    """Booking allowed: no open waiting room for the event, or a valid token"""
+    try:
+        event_id = int(event_id)
+    except (TypeError, ValueError):
+        return True  # not an event id; the booking code rejects it
+    return not rooms.is_open(event_id) or verify_token(token, event_id, user_id, now)
+
+
+def open_room(event_id, rate_per_minute):
+    """Open (or re-rate) the waiting room of an event"""
+    room = db.session.get(WaitingRoom, event_id) or WaitingRoom(event_id=event_id)
+    room.rate_per_minute = rate_per_minute
+    room.is_open = True
+    db.session.add(room)
+    db.session.commit()
+    return room
+
+
+def close_room(event_id):
+    """Close the waiting room and drop its queue; bookings no longer need a token"""
+    room = db.session.get(WaitingRoom, event_id)
+    if room is None:
+        return False
+    room.is_open = False
+    room.next_slot_us = None
+    WaitingRoomEntry.query.filter_by(event_id=event_id).delete(synchronize_session=False)
+    db.session.commit()
+    return True
+
+
+def _next_slot(event_id, now):
+    """Take the next admission slot with one committed UPDATE (RETURNING, or LAST_INSERT_ID on MySQL)"""
+    now_us = (now - _EPOCH) // timedelta(microseconds=1)
+    start = case((func.coalesce(WaitingRoom.next_slot_us, 0) < now_us, now_us), else_=WaitingRoom.next_slot_us)
+    interval = literal(60_000_000, BigInteger) // WaitingRoom.rate_per_minute
+    query = (update(WaitingRoom).where(WaitingRoom.event_id == event_id)
+             .execution_options(synchronize_session=False))
+    if db.engine.dialect.update_returning:
+        slot_us = db.session.execute(
+            query.values(next_slot_us=start + interval).returning(WaitingRoom.next_slot_us - interval)
+        ).scalar_one()
+    else:
+        # MySQL: LAST_INSERT_ID(expr) hands the slot back to this connection without a locking read
+        if not db.session.execute(query.values(next_slot_us=func.last_insert_id(start) + interval)).rowcount:
+            raise NoResultFound(f'No waiting room for event {event_id}')
+        slot_us = db.session.scalar(select(func.last_insert_id()))
+    db.session.commit()
+    return _EPOCH + timedelta(microseconds=slot_us)
+
+
+def join(event_id, user_id, now=None):
+    """The customer's queue entry, queueing them (again) when they have none or it expired"""
+    now = now or datetime.utcnow()
+    entry = WaitingRoomEntry.query.filter_by(event_id=event_id, user_id=user_id).first()
+    if entry is not None and entry.admit_at + _admission_window() > now:
+        return entry
+    slot = _next_slot(event_id, now)
+    if entry is None:
+        entry = WaitingRoomEntry(event_id=event_id, user_id=user_id)
+        db.session.add(entry)
+    entry.admit_at = slot
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Same customer joined from another tab at the same moment
+        db.session.rollback()
+        entry = WaitingRoomEntry.query.filter_by(event_id=event_id, user_id=user_id).one()
+    return entry
+
+
+def status(event_id, user_id, admit_at, now=None):
+    """Queue status for an admission slot; ``token`` is set once the customer is admitted.
+    Only the room cache is read: slots are handed out 60 / rate seconds apart, so the
+    customers ahead are the slots between now and ``admit_at``."""
+    now = now or datetime.utcnow()
+    if admit_at <= now:
+        return {'admitted': True, 'position': 0, 'wait_seconds': 0,
+                'token': make_token(event_id, user_id, admit_at + _admission_window())}
+    wait = (admit_at - now).total_seconds()
+    interval = 60 / (rooms.rate_per_minute(event_id) or 60)
+    return {'admitted': False, 'position': max(1, math.ceil(wait / interval)),
+            'wait_seconds': int(wait) + 1, 'token': None}
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_rooms(session, flush_context):
+    changed = {obj.event_id for obj in itertools.chain(session.new, session.dirty, session.deleted)
+               if isinstance(obj, WaitingRoom)}
+    if changed:
+        session.info.setdefault(_PENDING_KEY, set()).update(changed)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed_rooms(session):
+    changed = session.info.pop(_PENDING_KEY, None)
+    if changed:
+        rooms.invalidate(changed)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back_rooms(session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+def init_app(app):
+    rooms.ttl = app.config.get('WAITING_ROOM_CACHE_SECONDS', 5)
+    rooms.invalidate()
+
+    @app.cli.group('waiting-room')
+    def waiting_room_command():
+        """Virtual waiting rooms for flash sales."""
+
+    @waiting_room_command.command('open')
+    @click.argument('event_id', type=int)
+    @click.option('--rate', default=120, show_default=True, help='Customers admitted per minute')
+    def open_command(event_id, rate):
+        """Queue customers of an event and admit RATE per minute."""
+        if rate < 1:
+            raise click.ClickException('--rate must be at least 1')
+        if db.session.get(Event, event_id) is None:
+            raise click.ClickException(f'Event {event_id} not found')
+        open_room(event_id, rate)
+        click.echo(f'Waiting room for event {event_id} open, {rate} admissions per minute')
+
+    @waiting_room_command.command('close')
+    @click.argument('event_id', type=int)
+    def close_command(event_id):
+        """Let everyone book the event again."""
+        if not close_room(event_id):
+            raise click.ClickException(f'Event {event_id} has no waiting room')
+        click.echo(f'Waiting room for event {event_id} closed')
@@ -0,0 +1,199 @@
+"""
+Waitlist for sold-out ticket types.
+
+Instead of refreshing a sold-out booking page, customers join the waitlist
+of a ticket type (``join``). ``allocate()`` hands freed tickets to the
+waitlist in bulk:
+
+1. offers past ``offer_expires_at`` are expired (one UPDATE) and their
+   tickets go back to the pool;
+2. for every ticket type with waiting entries, the free quantity is
+   ``available_quantity`` minus the tickets still offered to others;
+3. entries are offered in ``queued_at`` order while their quantity fits
+   (one UPDATE per run), and each customer gets an in-app notification
+   with the claim link ``/waitlist/claim/<ticket_type_id>``, valid for
+   ``WAITLIST_OFFER_MINUTES``.
+
+While an offer is open its tickets are held back from other customers
+(``offered_quantities``). Unpaid holds don't reduce availability, so the offer
+keeps them back until the VNPay callback marks the customer's tickets paid and
+``claim``s it.
+
+``allocate`` runs when organizers raise ``total_quantity`` and from a
+periodic job that also recycles expired offers:
+
+    flask --app eventapp waitlist allocate
+"""
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from sqlalchemy import func, update
+from sqlalchemy.exc import IntegrityError
+
+from eventapp import db
+from eventapp.models import Notification, TicketType, UserNotification, WaitlistEntry, load_shard_sold
+
+WAITING = 'waiting'
+OFFERED = 'offered'
+CLAIMED = 'claimed'
+EXPIRED = 'expired'
+CANCELLED = 'cancelled'
+
+
+def _offer_window():
+    return timedelta(minutes=current_app.config.get('WAITLIST_OFFER_MINUTES', 15))
+
+
+def join(ticket_type, user_id, quantity, now=None):
+    """Put the customer on the waitlist (again, at the back, if their last entry ended)"""
+    now = now or datetime.utcnow()
+    entry = WaitlistEntry.query.filter_by(ticket_type_id=ticket_type.id, user_id=user_id).first()
+    if entry is not None and entry.status == OFFERED:
+        return entry
+    if entry is None:
+        entry = WaitlistEntry(ticket_type_id=ticket_type.id, user_id=user_id)
+        db.session.add(entry)
+    elif entry.status != WAITING:
+        entry.status = WAITING
+        entry.offered_at = entry.offer_expires_at = entry.claimed_at = None
+        entry.queued_at = now
+    entry.quantity = quantity
+    if entry.queued_at is None:
+        entry.queued_at = now
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Same customer joined from another tab at the same moment
+        db.session.rollback()
+        entry = WaitlistEntry.query.filter_by(ticket_type_id=ticket_type.id, user_id=user_id).one()
+    return entry
+
+
+def leave(ticket_type_id, user_id):
+    """Cancel the customer's entry (an open offer goes back to the pool)"""
+    left = WaitlistEntry.query.filter(
+        WaitlistEntry.ticket_type_id == ticket_type_id,
+        WaitlistEntry.user_id == user_id,
+        WaitlistEntry.status.in_((WAITING, OFFERED)),
+    ).update({'status': CANCELLED}, synchronize_session=False)
+    db.session.commit()
+    return bool(left)
+
+
+def position(entry):
+    """1-based place of a waiting entry in its ticket type's queue"""
+    return WaitlistEntry.query.filter(
+        WaitlistEntry.ticket_type_id == entry.ticket_type_id,
+        WaitlistEntry.status == WAITING,
+        WaitlistEntry.queued_at < entry.queued_at,
+    ).count() + 1
+
+
+def _open_offers(now):
+    return (WaitlistEntry.status == OFFERED, WaitlistEntry.offer_expires_at > now)
+
+
+def offered_quantities(ticket_type_ids, exclude_user_id=None, now=None):
+    """{ticket_type_id: tickets held for open offers}, leaving out ``exclude_user_id``'s own offers"""
+    ticket_type_ids = list(ticket_type_ids)
+    if not ticket_type_ids:
+        return {}
+    query = (db.session.query(WaitlistEntry.ticket_type_id, func.sum(WaitlistEntry.quantity))
+             .filter(WaitlistEntry.ticket_type_id.in_(ticket_type_ids), *_open_offers(now or datetime.utcnow())))
+    if exclude_user_id is not None:
+        query = query.filter(WaitlistEntry.user_id != exclude_user_id)
+    return {ticket_type_id: int(total) for ticket_type_id, total in query.group_by(WaitlistEntry.ticket_type_id)}
+
+
+def active_offer(ticket_type_id, user_id, now=None):
+    return WaitlistEntry.query.filter(
+        WaitlistEntry.ticket_type_id == ticket_type_id,
+        WaitlistEntry.user_id == user_id,
+        *_open_offers(now or datetime.utcnow()),
+    ).first()
+
+
+def claim(user_id, ticket_type_ids, now=None):
+    """Mark the customer's open offers for these ticket types as used once their tickets are paid
+    (caller's transaction)"""
+    now = now or datetime.utcnow()
+    return db.session.execute(
+        update(WaitlistEntry)
+        .where(WaitlistEntry.user_id == user_id, WaitlistEntry.ticket_type_id.in_(list(ticket_type_ids)),
+               *_open_offers(now))
+        .values(status=CLAIMED, claimed_at=now)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+
+def _notify(ticket_type, user_ids, expires_at):
+    notification = Notification(
+        event_id=ticket_type.event_id,
+        title='Vé bạn chờ đã có',
+        message=(f'Vé "{ticket_type.name}" đã có lại. Đặt vé tại /waitlist/claim/{ticket_type.id} '
+                 f'trước {expires_at:%H:%M %d/%m/%Y} (UTC), sau thời gian này vé được chuyển cho người kế tiếp.'),
+        notification_type='waitlist',
+    )
+    db.session.add(notification)
+    db.session.flush()
+    db.session.add_all(UserNotification(user_id=user_id, notification_id=notification.id) for user_id in user_ids)
+
+
+def allocate(ticket_type_ids=None, now=None):
+    """Expire old offers and offer free tickets to the next customers; returns the number of new offers"""
+    now = now or datetime.utcnow()
+    scope = () if ticket_type_ids is None else (WaitlistEntry.ticket_type_id.in_(list(ticket_type_ids)),)
+    db.session.execute(
+        update(WaitlistEntry)
+        .where(WaitlistEntry.status == OFFERED, WaitlistEntry.offer_expires_at <= now, *scope)
+        .values(status=EXPIRED)
+        .execution_options(synchronize_session=False)
+    )
+    waiting_types = (db.session.query(WaitlistEntry.ticket_type_id)
+                     .filter(WaitlistEntry.status == WAITING, *scope).distinct())
+    # Lock the ticket types first: a concurrent run (organizer edit, /waitlist/leave, cron) waits here
+    # and then sees this run's offers, instead of offering the same free tickets to other entries
+    ticket_types = (TicketType.query
+                    .filter(TicketType.id.in_(waiting_types.scalar_subquery()), TicketType.is_active == True)
+                    .order_by(TicketType.id).with_for_update().all())
+    load_shard_sold(ticket_types)
+    offered = offered_quantities([ticket_type.id for ticket_type in ticket_types], now=now)
+    expires_at = now + _offer_window()
+
+    offers = 0
+    for ticket_type in ticket_types:
+        free = ticket_type.available_quantity - offered.get(ticket_type.id, 0)
+        if free <= 0:
+            continue
+        chosen = []
+        # Every entry needs at least one ticket, so at most `free` entries can be served
+        for entry in (WaitlistEntry.query.filter_by(ticket_type_id=ticket_type.id, status=WAITING)
+                      .order_by(WaitlistEntry.queued_at, WaitlistEntry.id).limit(free)):
+            if entry.quantity > free:
+                break  # first come, first served: nobody skips ahead
+            free -= entry.quantity
+            chosen.append(entry)
+        if not chosen:
+            continue
+        db.session.execute(
+            update(WaitlistEntry)
+            .where(WaitlistEntry.id.in_([entry.id for entry in chosen]), WaitlistEntry.status == WAITING)
+            .values(status=OFFERED, offered_at=now, offer_expires_at=expires_at)
+            .execution_options(synchronize_session=False)
+        )
+        _notify(ticket_type, [entry.user_id for entry in chosen], expires_at)
+        offers += len(chosen)
+    db.session.commit()
+    return offers
+
+
+def init_app(app):
+    @app.cli.group('waitlist')
+    def waitlist_command():
+        """Waitlists of sold-out ticket types."""
+
+    @waitlist_command.command('allocate')
+    def allocate_command():
+        """Expire unclaimed offers and offer free tickets to waiting customers."""
+        click.echo(f'{allocate()} waitlist offers sent')
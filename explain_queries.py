@@ -0,0 +1,116 @@
+"""
+Kiểm tra kế hoạch thực thi (EXPLAIN) của các truy vấn DAO trên đường nóng.
+
+Chạy trên database đã seed:
+
+    python seed.py
+    python explain_queries.py
+
+Mỗi hàm DAO được gọi thật, các câu SQL nó phát ra được bắt lại qua sự kiện
+before_cursor_execute rồi chạy EXPLAIN (EXPLAIN QUERY PLAN trên SQLite).
+Mọi thay đổi dữ liệu được rollback. Script thoát với mã 1 nếu một truy vấn
+không dùng index mong đợi.
+"""
+import sys
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from sqlalchemy import event
+
+from eventapp import app, db, dao, checkin_stats
+from eventapp.models import Ticket, Payment, event_staff
+
+
+@contextmanager
+def capture_statements(engine):
+    """Bắt các câu SQL phát ra trong khối lệnh"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and not statement.lstrip().upper().startswith(('EXPLAIN', 'SET')):
+            statements.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def explain(connection, statement, parameters):
+    if connection.dialect.name == 'sqlite':
+        rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).fetchall()
+        return '\n'.join(str(row[-1]) for row in rows)
+    rows = connection.exec_driver_sql(f'EXPLAIN {statement}', parameters).fetchall()
+    return '\n'.join(str(row[0]) for row in rows)
+
+
+def build_checks():
+    """Danh sách (tên, hàm DAO, các tên index chấp nhận được)"""
+    ticket = Ticket.query.filter_by(is_paid=True).first()
+    payment = Payment.query.first()
+    assignment = db.session.query(event_staff).first()
+    if not ticket or not payment:
+        raise SystemExit('Database chưa có dữ liệu, hãy chạy python seed.py trước.')
+    an_hour_ago = datetime.utcnow() - timedelta(hours=1)
+
+    checks = [
+        ('staff_scan_ticket: vé theo uuid',
+         lambda: dao.get_tickets_by_uuids([ticket.uuid]),
+         ('sqlite_autoindex_tickets', 'tickets_uuid_key')),
+        ('vnpay_redirect: vé giữ chỗ của payment',
+         lambda: dao.get_unpaid_tickets_for_payment(payment.id, payment.user_id),
+         ('ix_ticket_payment_user_paid',)),
+        ('cleanup_unpaid_tickets: vé giữ chỗ hết hạn',
+         lambda: dao.cleanup_unpaid_tickets(),
+         ('ix_ticket_unpaid_hold',)),
+        ('my_tickets/profile: vé đã mua theo ngày mua',
+         lambda: dao.get_paid_tickets(ticket.user_id, limit=5),
+         ('ix_ticket_user_paid_purchase',)),
+        ('manifest cổng: toàn bộ',
+         lambda: dao.get_ticket_manifest(ticket.event_id),
+         ('ix_ticket_event_checkin',)),
+        ('manifest cổng: delta',
+         lambda: dao.get_ticket_manifest(ticket.event_id, since=an_hour_ago),
+         ('ix_ticket_event_checkin',)),
+        ('bộ đếm check-in: đồng bộ',
+         lambda: checkin_stats.counters.reconcile(ticket.event_id),
+         ('ix_ticket_event_checkin',)),
+    ]
+    if assignment:
+        checks.append((
+            'staff được gán cho sự kiện',
+            lambda: dao.is_staff_assigned_to_event(assignment.staff_id, assignment.event_id),
+            ('sqlite_autoindex_event_staff', 'event_staff_pkey'),
+        ))
+    return checks
+
+
+def run():
+    failures = 0
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql':
+        # Bảng seed rất nhỏ nên planner thích seq scan; tắt để chứng minh index dùng được
+        connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+
+    for name, call, expected in build_checks():
+        with patch.object(db.session, 'commit', db.session.flush), capture_statements(db.engine) as statements:
+            call()
+        plans = [(statement, explain(connection, statement, parameters)) for statement, parameters in statements]
+        used = any(index in plan for _, plan in plans for index in expected)
+        failures += 0 if used else 1
+        print(f"{'✅' if used else '❌'} {name} (mong đợi: {' | '.join(expected)})")
+        for statement, plan in plans:
+            print('   SQL : ' + ' '.join(statement.split())[:160])
+            for line in plan.splitlines():
+                print('   PLAN: ' + line)
+    db.session.rollback()
+    return failures
+
+
+if __name__ == '__main__':
+    with app.app_context():
+        failed = run()
+    print(f"\n{'❌' if failed else '✅'} {failed} truy vấn không dùng index mong đợi")
+    sys.exit(1 if failed else 0)
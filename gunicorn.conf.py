@@ -0,0 +1,26 @@
+"""
+gunicorn settings, picked up automatically from the working directory.
+
+Prometheus counters live in each worker process; in multiprocess mode every
+worker writes them to files in PROMETHEUS_MULTIPROC_DIR and /metrics merges
+the files, so scrapes see totals no matter which worker answers. The directory
+is wiped when the master starts so counters from a previous run do not leak in,
+and a dead worker's live gauges are dropped when it exits.
+"""
+import os
+import shutil
+import tempfile
+
+# Must be in the environment before the app (and prometheus_client) is imported by the workers
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'eventapp-prometheus'))
+
+
+def on_starting(server):
+    path = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)